@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import data_manager
+
+# Hourly and daily rollups of product views and inquiries, per product and per
+# merchant, for the dashboard charts. Events are aggregated in memory and
+# written to a small SQLite file in batches (one upsert per touched rollup row),
+# so the product file never has to be scanned to draw a chart.
+
+ANALYTICS_DB = os.environ.get('ANALYTICS_DB', os.path.join('analytics', 'analytics.db'))  # Not under static/: never served
+
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+SCOPES = ('product', 'merchant')
+
+FLUSH_INTERVAL_SECONDS = 30
+FLUSH_MAX_PENDING = 500      # flush early once this many rollup rows are dirty
+
+# (granularity, scope, key, bucket_start) -> [views, inquiries]
+_pending = {}
+_last_flush = {'at': time.time()}
+_pending_lock = threading.Lock()   # guards _pending
+_flush_lock = threading.Lock()     # one flush at a time, so no increment is written twice
+
+def _connect():
+    os.makedirs(os.path.dirname(ANALYTICS_DB), exist_ok=True)
+    conn = sqlite3.connect(ANALYTICS_DB)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollups (
+            granularity TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            views INTEGER NOT NULL DEFAULT 0,
+            inquiries INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, scope, key, bucket)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS rollups_by_bucket ON rollups (granularity, scope, bucket)")
+    return conn
+
+def record(product_id, merchant_id, kind, timestamp=None):
+    """Counts a 'view' or 'inquiry' into every rollup it belongs to."""
+    now = time.time() if timestamp is None else timestamp
+    column = 1 if kind == 'inquiry' else 0
+    for granularity, seconds in GRANULARITIES.items():
+        bucket = int(now // seconds) * seconds
+        for scope, key in (('product', product_id), ('merchant', merchant_id)):
+            if not key:
+                continue
+            with _pending_lock:
+                counts = _pending.setdefault((granularity, scope, key, bucket), [0, 0])
+                counts[column] += 1
+    if len(_pending) >= FLUSH_MAX_PENDING or now - _last_flush['at'] >= FLUSH_INTERVAL_SECONDS:
+        flush()
+
+def flush():
+    """Writes all pending rollup increments to the database in one transaction.
+
+    Increments leave _pending only once the transaction has committed, so a
+    failed write is retried by the next flush instead of being lost.
+    """
+    with _flush_lock:
+        _last_flush['at'] = time.time()
+        with _pending_lock:
+            batch = [(granularity, scope, key, bucket, views, inquiries)
+                     for (granularity, scope, key, bucket), (views, inquiries) in _pending.items()]
+        if not batch:
+            return
+        conn = _connect()
+        try:
+            with conn:
+                conn.executemany("""
+                    INSERT INTO rollups (granularity, scope, key, bucket, views, inquiries)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (granularity, scope, key, bucket) DO UPDATE SET
+                        views = views + excluded.views,
+                        inquiries = inquiries + excluded.inquiries
+                """, batch)
+        finally:
+            conn.close()
+        # Take off what was written; increments recorded in the meantime stay pending.
+        with _pending_lock:
+            for granularity, scope, key, bucket, views, inquiries in batch:
+                counts = _pending[(granularity, scope, key, bucket)]
+                counts[0] -= views
+                counts[1] -= inquiries
+                if counts == [0, 0]:
+                    del _pending[(granularity, scope, key, bucket)]
+
+def run_flusher(sleep):
+    """Background task flushing pending increments every FLUSH_INTERVAL_SECONDS."""
+    while True:
+        sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            print(f"ERROR: could not flush analytics rollups: {e}")
+
+def _read(sql, params):
+    """Runs a rollup SELECT and copies the pending increments, with no flush in between (which would count some twice)."""
+    with _flush_lock:
+        rows = []
+        if os.path.exists(ANALYTICS_DB):
+            conn = _connect()
+            try:
+                rows = conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        with _pending_lock:
+            pending = [(row_key, tuple(counts)) for row_key, counts in _pending.items()]
+    return rows, pending
+
+def query(scope, key, granularity, start, end):
+    """Returns the rollup series for one product or merchant between two timestamps.
+
+    Each point is {'bucket': ISO start time, 'views': n, 'inquiries': n}.
+    Increments not yet flushed are included, so charts are never behind.
+    """
+    seconds = GRANULARITIES[granularity]
+    first_bucket = int(start // seconds) * seconds
+    rows, pending = _read("""
+        SELECT bucket, views, inquiries FROM rollups
+        WHERE granularity = ? AND scope = ? AND key = ? AND bucket >= ? AND bucket <= ?
+        ORDER BY bucket
+    """, (granularity, scope, key, first_bucket, end))
+    series = {bucket: [views, inquiries] for bucket, views, inquiries in rows}
+    for (p_granularity, p_scope, p_key, bucket), (views, inquiries) in pending:
+        if (p_granularity, p_scope, p_key) == (granularity, scope, key) and first_bucket <= bucket <= end:
+            counts = series.setdefault(bucket, [0, 0])
+            counts[0] += views
+            counts[1] += inquiries
+    return [
+        {
+            'bucket': datetime.fromtimestamp(bucket, timezone.utc).isoformat(),
+            'views': views,
+            'inquiries': inquiries,
+        }
+        for bucket, (views, inquiries) in sorted(series.items())
+    ]
+
+def rollups_since(granularity, scope, start):
+    """Returns {(key, bucket): [views, inquiries]} for every key's buckets from `start` on, unflushed increments included."""
+    seconds = GRANULARITIES[granularity]
+    first_bucket = int(start // seconds) * seconds
+    rows, pending = _read("""
+        SELECT key, bucket, views, inquiries FROM rollups
+        WHERE granularity = ? AND scope = ? AND bucket >= ?
+    """, (granularity, scope, first_bucket))
+    counts = {(key, bucket): [views, inquiries] for key, bucket, views, inquiries in rows}
+    for (p_granularity, p_scope, key, bucket), (views, inquiries) in pending:
+        if (p_granularity, p_scope) == (granularity, scope) and bucket >= first_bucket:
+            entry = counts.setdefault((key, bucket), [0, 0])
+            entry[0] += views
+            entry[1] += inquiries
+    return counts
+
+def _on_catalog_change(event, park):
+    """data_manager listener that feeds view/inquiry events into the rollups."""
+    if event in ('view', 'inquiry'):
+        record(park.get('id'), park.get('admin_id'), event)
+
+data_manager.add_listener(_on_catalog_change)
@@ -1,21 +1,59 @@
 import sqlite3
-from flask import Flask, jsonify, request, render_template, g, session, redirect, url_for
+from flask import Flask, jsonify, request, render_template, g, session, redirect, url_for, Response, send_file
 from datetime import timedelta, datetime, timezone
 from flask_socketio import SocketIO, join_room, leave_room, emit
-import json
+import json, math, tempfile, time, zipfile
 import data_manager, re, os
+import catalog_index
+import trending
+import analytics
+import reviews
+import password_hashing
+import rate_limit
+import chat_search
+import chat_archive
+import catalog_changes
+import images
+import image_store
+import blob_storage
+from json_stream import stream_json_array
+import bulk_import
+import file_lock
+import metrics
+import profiling
+import snapshots
+from urllib.parse import urlparse
 from werkzeug.utils import secure_filename
-from PIL import Image
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+# With several worker processes (serve.py), emits must go through a shared
+# message queue (e.g. redis://localhost:6379/0) to reach clients of other workers.
+socketio = SocketIO(app, message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+metrics.init_app(app)
+profiling.init_app(app)
+# Credential hashing runs on a bounded native thread pool, never on the event loop.
+password_hashing.configure(socketio.async_mode)
+# Image decoding too, with green decode slots under eventlet; bulk imports use green workers for it.
+images.configure(socketio.async_mode)
+bulk_import.configure(socketio.async_mode)
+# Waiting for another worker's file lock must not stall the event loop either.
+file_lock.configure(socketio.async_mode)
+# Under eventlet a profile also counts other requests' work; the profiles page says so.
+profiling.configure(socketio.async_mode)
+# Every catalog write through this app is recorded in the change feed and
+# moves stored images' reference counts.
+catalog_changes.register()
+image_store.register()
 
-from werkzeug.security import generate_password_hash, check_password_hash
 # Configuration for file uploads
-IMAGE_FOLDER = os.path.join('static', 'images')
-USER_IMAGE_FOLDER = os.path.join('static', 'images', 'users')
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+IMAGE_FOLDER = images.IMAGE_FOLDER
+IMAGE_URL_PREFIX = '/static/images/' # Image URLs end in their blob_storage key
+ALLOWED_EXTENSIONS = images.ALLOWED_EXTENSIONS
 app.config['IMAGE_FOLDER'] = IMAGE_FOLDER
+# Largest request body accepted (bulk imports have their own limit). Form
+# uploads above Werkzeug's 500 KB threshold are spooled to temporary files.
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 4 * images.MAX_UPLOAD_BYTES + 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 USERS_FILE = os.path.join('static', 'users.json')
 CONVERSATIONS_FILE = os.path.join('static', 'conversations.json')
 
@@ -27,14 +65,40 @@ if app.secret_key == 'a-very-long-and-random-secret-key-in-dev' and not app.debu
     print("WARNING: FLASK_SECRET_KEY is not set. Using a default, insecure key for production.")
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)  # Set "Remember Me" duration
 
+@metrics.timed('storage_call', call='get_all_users')
 def get_all_users():
     """Helper to read all users from the JSON file."""
     try:
         with open(USERS_FILE, 'r') as f:
+            metrics.inc('storage_bytes_total', os.fstat(f.fileno()).st_size, file='users', op='read')
             return json.load(f)
     except (IOError, json.JSONDecodeError):
         return []
 
+def save_users(users):
+    """Writes the users list atomically. Hold file_lock.locked(USERS_FILE) from the read to this write."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(USERS_FILE), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(users, f, indent=4)
+    os.replace(temp_path, USERS_FILE)
+
+def save_user(user):
+    """Replaces one user's record, re-reading the file under its lock so concurrent changes to other users are kept."""
+    with file_lock.locked(USERS_FILE):
+        users = get_all_users()
+        index = next((i for i, u in enumerate(users) if u.get('id') == user.get('id')), None)
+        if index is None:
+            users.append(user)
+        else:
+            users[index] = user
+        save_users(users)
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """Answers oversized uploads (MAX_CONTENT_LENGTH) with JSON like the other API errors."""
+    limit = request.max_content_length or MAX_REQUEST_BYTES
+    return jsonify({"error": f"Request is too large (limit {limit // (1024 * 1024)} MB)."}), 413
+
 @app.route('/')
 def index():
     """Serves the main shop page."""
@@ -47,6 +111,23 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _store_profile_photo(photo, user_id):
+    """Resizes and stores a user's profile photo; returns its URL. Raises images.ImageRejected."""
+    # A unique name based on the user ID prevents conflicts
+    extension = secure_filename(photo.filename).rsplit('.', 1)[1].lower()
+    key = f"users/user_{user_id}.{extension}"
+    os.makedirs(images.UPLOAD_TMP_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=images.UPLOAD_TMP_DIR, prefix='.output-', suffix='.' + extension)
+    os.close(fd)
+    try:
+        images.save_profile_photo(photo.stream, temp_path)
+        blob_storage.get_storage().put_file(key, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return IMAGE_URL_PREFIX + key
+
 @app.route('/admin')
 def admin_page():
     """Serves the data management UI page."""
@@ -62,9 +143,17 @@ def admin_page():
     _, total_unread_count = get_user_and_unread_count(session)
     return render_template('index.html', user=current_user, total_unread_count=total_unread_count)
 
+PARKS_PAGE_PARAMS = ('page', 'limit', 'q', 'sort', 'fields')
+
 @app.route('/parks', methods=['GET'])
 def get_parks():
-    """Endpoint to get all parks, filtered by admin role."""
+    """
+    Endpoint to get parks, filtered by admin role.
+    With any of page, limit, q (text search), sort (newest, oldest, views,
+    inquiries, ...) or fields (comma-separated projection) it returns one page
+    from the per-merchant index as {"products", "total", "page", "limit"};
+    without them, the full list as before.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Authentication required"}), 401
@@ -73,11 +162,42 @@ def get_parks():
     if not current_user or current_user.get('role') != 'admin':
         return jsonify({"error": "Admin privileges required"}), 403
 
-    all_parks = data_manager.get_all_parks()
-    if current_user.get('email') == os.environ.get('MAIN_ADMIN_EMAIL'):
-        return jsonify(all_parks)
-    user_parks = [park for park in all_parks if park.get('admin_id') == user_id]
-    return jsonify(user_parks)
+    is_main_admin = current_user.get('email') == os.environ.get('MAIN_ADMIN_EMAIL')
+    if any(param in request.args for param in PARKS_PAGE_PARAMS):
+        return _get_parks_page(user_id, is_main_admin)
+
+    return stream_json_array(data_manager.iter_parks(None if is_main_admin else user_id))
+
+def _get_parks_page(user_id, is_main_admin):
+    """One page of the product manager's list, served from catalog_index."""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(max(int(request.args.get('limit', 24)), 1), 200)
+    except (ValueError, TypeError):
+        page = 1
+        limit = 24
+
+    sort = request.args.get('sort', 'newest')
+    if sort not in catalog_index.SORT_OPTIONS:
+        return jsonify({"error": f"sort must be one of {list(catalog_index.SORT_OPTIONS)}"}), 400
+
+    # The main admin sees every product, optionally narrowed to one merchant.
+    admin_id = (request.args.get('admin_id') or None) if is_main_admin else user_id
+    page_parks, total = catalog_index.filter_products(
+        admin_id=admin_id,
+        text=request.args.get('q', '').strip() or None,
+        sort=sort,
+        offset=(page - 1) * limit,
+        limit=limit
+    )
+
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    if fields:
+        products = [{field: park.get(field) for field in ['id'] + fields} for park in page_parks]
+    else:
+        products = [dict(park) for park in page_parks]
+
+    return jsonify({"products": products, "total": total, "page": page, "limit": limit})
 
 @app.route('/parks', methods=['POST'])
 def create_park():
@@ -111,33 +231,20 @@ def create_park():
     extensions = [secure_filename(f.filename).rsplit('.', 1)[1].lower() for f in uploaded_files]
     # --- End Image Handling ---
 
-    os.makedirs(app.config['IMAGE_FOLDER'], exist_ok=True)
-    os.makedirs(USER_IMAGE_FOLDER, exist_ok=True)
-
     try:
-        # 1. The data_manager.add_park function must be updated to accept a list of extensions
-        # and return a list of filenames in the 'image_filenames' key.
-        new_park = data_manager.add_park(park_data, extensions, user_id)
-        
-        # 2. Save all the uploaded image files using the filenames from the created record.
-        final_filenames = new_park.get('image_filenames', [])
-        if len(final_filenames) != len(uploaded_files):
-            # This is a failsafe. If this happens, data_manager.add_park was not updated correctly.
-            # We should probably delete the DB entry here, but for now, we'll return an error.
-            data_manager.delete_park(new_park['id']) # Attempt to clean up
-            return jsonify({"error": "Mismatch between uploaded files and generated filenames."}), 500
-
-        for i, file_storage in enumerate(uploaded_files):
-            image_path = os.path.join(app.config['IMAGE_FOLDER'], final_filenames[i])
-            
-            # Open the uploaded image file with Pillow
-            img = Image.open(file_storage.stream)
-            # Resize to a max of 800x800 while maintaining aspect ratio
-            img.thumbnail((800, 800))
-            # Save with high quality.
-            img.save(image_path, quality=95, optimize=True)
+        # 1. Store the images (resized to at most 800x800). A photo already in
+        # the store, e.g. from another listing, is reused without processing.
+        filenames = [image_store.put(file_storage.stream, extension)
+                     for file_storage, extension in zip(uploaded_files, extensions)]
+
+        # 2. Create the record referencing them (image_store counts the
+        # references). If this fails, the stored images stay unreferenced and
+        # are collected later.
+        new_park = data_manager.add_park(park_data, filenames, user_id)
 
         return jsonify(new_park), 201
+    except images.ImageRejected as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         # Basic error handling in case something goes wrong
         # In a production app, you might want to log this error instead of sending details to the client.
@@ -173,8 +280,6 @@ def update_park_details(park_id):
     # Start with a copy of the existing filenames
     current_filenames = product_to_update.get('image_filenames', [])
     new_filenames = list(current_filenames) # Make a mutable copy
-    files_to_save = []
-    files_to_delete = []
 
     # Loop through the 4 possible image inputs from the form
     for i in range(4):
@@ -186,21 +291,17 @@ def update_park_details(park_id):
             if not allowed_file(file.filename):
                 return jsonify({"error": f"Invalid file type for {file_key}."}), 400
 
-            # If there was an old image in this slot, mark it for deletion
-            if i < len(new_filenames) and new_filenames[i]:
-                files_to_delete.append(new_filenames[i])
-
-            # Generate a new filename for the new file
+            # Store the new file (reusing an identical stored image) and reference it
             extension = secure_filename(file.filename).rsplit('.', 1)[1].lower()
-            generated_filename = f"{park_id}_{i+1}.{extension}"
-            
+            try:
+                stored_filename = image_store.put(file.stream, extension)
+            except images.ImageRejected as e:
+                return jsonify({"error": f"Could not process {file_key}: {e}"}), 400
+
             # Ensure the list is long enough before assignment
             while len(new_filenames) <= i:
                 new_filenames.append(None)
-            new_filenames[i] = generated_filename
-            
-            # Add the file to a list to be saved after DB update is successful
-            files_to_save.append({'file_storage': file, 'filename': generated_filename})
+            new_filenames[i] = stored_filename
 
     # Clean up any trailing None/null values from the filenames list
     while new_filenames and new_filenames[-1] is None:
@@ -210,22 +311,11 @@ def update_park_details(park_id):
     update_data['image_filenames'] = new_filenames
 
     try:
-        # We call update_park with extensions=None because we have handled the
-        # filename logic ourselves. This call will just update the product's
-        # data in the JSON file with our new `image_filenames` list.
-        updated_park, _ = data_manager.update_park(park_id, update_data, None)
-
-        # Now that the JSON is updated, handle the file system changes
-        for old_filename in files_to_delete:
-            old_image_path = os.path.join(app.config['IMAGE_FOLDER'], old_filename)
-            if os.path.exists(old_image_path):
-                os.remove(old_image_path)
-        
-        for item in files_to_save:
-            image_path = os.path.join(app.config['IMAGE_FOLDER'], item['filename'])
-            img = Image.open(item['file_storage'].stream)
-            img.thumbnail((800, 800))
-            img.save(image_path, quality=95, optimize=True)
+        # Images replaced here lose their reference inside the write itself
+        # (image_store's listener), so a concurrent edit cannot release them twice.
+        updated_park, _ = data_manager.update_park(park_id, update_data)
+        if not updated_park:
+            return jsonify({"error": "Park not found"}), 404
 
         return jsonify(updated_park), 200
     except Exception as e:
@@ -254,18 +344,138 @@ def remove_park(park_id):
 
     deleted_park = data_manager.delete_park(park_id)
     if deleted_park:
-        # If images are associated, delete them from the file system
-        image_filenames = deleted_park.get('image_filenames', [])
-        if image_filenames:
-            for filename in image_filenames:
-                image_path = os.path.join(app.config['IMAGE_FOLDER'], filename)
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-                
+        # Its images lost their references in the write; images other products
+        # still use are kept, the rest are collected later.
         return jsonify({"message": f"Park with id {park_id} deleted."}), 200
     else:
         return jsonify({"error": f"Park with id {park_id} not found."}), 404
 
+@app.route('/parks/import', methods=['POST'])
+def import_parks():
+    """
+    Bulk-creates products for the current merchant from an uploaded CSV or JSON Lines
+    file ('file'), with the images it names in an optional zip archive ('images').
+    Rows are validated and committed in batches; invalid rows are reported, not fatal.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+    current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
+    if not current_user or current_user.get('role') != 'admin':
+        return jsonify({"error": "Admin privileges required to post products."}), 403
+
+    request.max_content_length = bulk_import.MAX_IMPORT_BYTES # Before the body is parsed
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({"error": "A CSV or JSON Lines file is required."}), 400
+    fmt = request.form.get('format') or bulk_import.detect_format(upload.filename)
+    if fmt not in bulk_import.FORMATS:
+        return jsonify({"error": f"format must be one of {list(bulk_import.FORMATS)}"}), 400
+
+    archive_upload = request.files.get('images')
+    try:
+        summary = bulk_import.import_products(
+            upload.stream, fmt, user_id,
+            image_archive=archive_upload.stream if archive_upload and archive_upload.filename else None
+        )
+    except zipfile.BadZipFile:
+        return jsonify({"error": "The images upload must be a zip archive."}), 400
+    except UnicodeDecodeError:
+        return jsonify({"error": "The file must be UTF-8 encoded."}), 400
+    return jsonify(summary), 201 if summary['imported'] else 200
+
+@app.route('/parks/export', methods=['GET'])
+def export_parks():
+    """
+    Streams the current merchant's products as CSV (default) or JSON Lines (?format=jsonl).
+    The main admin exports every product, or one merchant's with ?admin_id=.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+    current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
+    if not current_user or current_user.get('role') != 'admin':
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in bulk_import.FORMATS:
+        return jsonify({"error": f"format must be one of {list(bulk_import.FORMATS)}"}), 400
+
+    admin_id = user_id
+    if current_user.get('email') == os.environ.get('MAIN_ADMIN_EMAIL'):
+        admin_id = request.args.get('admin_id') or None
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        bulk_import.export_products(data_manager.iter_parks(admin_id), fmt),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=products.{fmt}"}
+    )
+
+def _parse_range_timestamp(value):
+    """Parses an ISO date/datetime or epoch seconds query parameter to epoch seconds."""
+    try:
+        timestamp = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    # 'inf', 'nan' and values past year 9999 parse as floats but are no usable bucket bounds.
+    if not math.isfinite(timestamp):
+        raise ValueError("timestamp must be finite")
+    try:
+        datetime.fromtimestamp(timestamp, timezone.utc)
+    except (OverflowError, OSError) as e:
+        raise ValueError("timestamp out of range") from e
+    return timestamp
+
+@app.route('/api/analytics')
+def get_analytics():
+    """
+    Range query over the hourly/daily view and inquiry rollups, for charts.
+    Params: scope=merchant|product, id, granularity=hour|day, start, end.
+    Merchants may query themselves and their own products; the main admin may query anyone.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Authentication required"}), 401
+
+    current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
+    if not current_user or current_user.get('role') != 'admin':
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    scope = request.args.get('scope', 'merchant')
+    granularity = request.args.get('granularity', 'day')
+    if scope not in analytics.SCOPES or granularity not in analytics.GRANULARITIES:
+        return jsonify({"error": f"scope must be one of {list(analytics.SCOPES)} and granularity one of {list(analytics.GRANULARITIES)}"}), 400
+    key = request.args.get('id', user_id if scope == 'merchant' else None)
+    if not key:
+        return jsonify({"error": "id is required for product analytics"}), 400
+
+    is_main_admin = current_user.get('email') == os.environ.get('MAIN_ADMIN_EMAIL')
+    if not is_main_admin:
+        if scope == 'merchant' and key != user_id:
+            return jsonify({"error": "You can only view your own analytics."}), 403
+        if scope == 'product':
+            product = data_manager.get_park_by_id(key)
+            if not product or product.get('admin_id') != user_id:
+                return jsonify({"error": "You can only view analytics for your own products."}), 403
+
+    try:
+        end = _parse_range_timestamp(request.args['end']) if request.args.get('end') else datetime.now(timezone.utc).timestamp()
+        default_span = timedelta(days=30) if granularity == 'day' else timedelta(hours=48)
+        start = _parse_range_timestamp(request.args['start']) if request.args.get('start') else end - default_span.total_seconds()
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO dates or epoch seconds"}), 400
+
+    return jsonify({
+        "scope": scope,
+        "id": key,
+        "granularity": granularity,
+        "series": analytics.query(scope, key, granularity, start, end)
+    })
+
 @app.route('/api/products')
 def get_products():
     """
@@ -294,6 +504,128 @@ def get_products():
     end_index = start_index + limit
     return jsonify(products[start_index:end_index])
 
+@app.route('/api/products/filter')
+def filter_products():
+    """
+    Server-side filtering and sorting for the shop grid.
+    Supports type, location, min_price/max_price (numeric, parsed from the
+    free-form price strings), home_delivery and sort=newest|price_asc|price_desc|popular.
+    Results come from the in-memory attribute indexes, so no catalog scan is needed.
+    """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+    except (ValueError, TypeError):
+        page = 1
+        limit = 50
+
+    try:
+        min_price = float(request.args['min_price']) if request.args.get('min_price') else None
+        max_price = float(request.args['max_price']) if request.args.get('max_price') else None
+    except ValueError:
+        return jsonify({"error": "min_price and max_price must be numbers"}), 400
+
+    sort = request.args.get('sort', 'newest')
+    if sort not in catalog_index.SORT_OPTIONS:
+        return jsonify({"error": f"sort must be one of {list(catalog_index.SORT_OPTIONS)}"}), 400
+
+    home_delivery = request.args.get('home_delivery', '').lower() in ('1', 'true', 'yes', 'on')
+    page_products, total = catalog_index.filter_products(
+        product_type=request.args.get('type'),
+        location=request.args.get('location'),
+        min_price=min_price,
+        max_price=max_price,
+        home_delivery=home_delivery,
+        sort=sort,
+        offset=(page - 1) * limit,
+        limit=limit,
+    )
+
+    products = []
+    for park in page_products:
+        # Copy so the response-only field never leaks into the index.
+        product = dict(park)
+        filenames = product.get('image_filenames')
+        if filenames:
+            product['image_filename'] = filenames[0]
+        products.append(product)
+
+    return jsonify({
+        "products": products,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "facets": catalog_index.get_facets()
+    })
+
+@app.route('/api/products/changes')
+def get_product_changes():
+    """
+    Incremental catalog sync for client-side caches.
+    Returns the products added or updated since version `since`, and the ids of
+    products deleted since then, along with the version to send next time.
+    Without `since` (or when it is too old to serve as a delta) the whole
+    catalog is returned with "reset": true and the client should replace its cache.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except (ValueError, TypeError):
+        return jsonify({"error": "since must be an integer version"}), 400
+
+    version, changes = catalog_changes.get_changes(since) if since > 0 else (catalog_changes.current_version(), None)
+    if changes is None:
+        products = data_manager.get_all_parks()
+        deleted = []
+    else:
+        products = []
+        deleted = []
+        for product_id, is_deleted in changes:
+            park = None if is_deleted else catalog_index.get_park(product_id)
+            if park is None:
+                deleted.append(product_id)
+            else:
+                products.append(dict(park)) # Copy so the response-only field never leaks into the index.
+
+    for product in products:
+        filenames = product.get('image_filenames')
+        if filenames:
+            product['image_filename'] = filenames[0]
+
+    return jsonify({
+        "version": version,
+        "reset": changes is None,
+        "products": products,
+        "deleted": deleted
+    })
+
+@app.route('/api/products/trending')
+def get_trending_products():
+    """
+    Returns the products that are popular right now, optionally within one
+    category (?type=). Ranking uses time-decayed view and inquiry counts and is
+    read from a maintained top-N heap, so no catalog-wide sort happens here.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), trending.TOP_N)
+    except (ValueError, TypeError):
+        limit = 20
+
+    products = []
+    for product_id, score in trending.get_trending(request.args.get('type'), limit):
+        park = catalog_index.get_park(product_id)
+        if not park:
+            continue
+        product = dict(park)
+        filenames = product.get('image_filenames')
+        if filenames:
+            product['image_filename'] = filenames[0]
+        product['trending_score'] = round(score, 3)
+        product['recent_views'], product['recent_inquiries'] = trending.recent_counts(product_id)
+        products.append(product)
+    return jsonify(products)
+
+SEARCH_FUZZY_SCORE = 15 # Per misspelled word, at full similarity (an exact name word scores 20)
+
 @app.route('/api/search')
 def search_products():
     """Endpoint for searching products by name, description, or type."""
@@ -301,7 +633,7 @@ def search_products():
     if not query:
         return jsonify([]) # Return empty list if query is empty
 
-    all_products = data_manager.get_all_parks()
+    all_products = catalog_index.get_parks()
     query_tokens = set(query.split())
     
     product_scores = {} # Use a dict to store scores, with product ID as key
@@ -339,11 +671,29 @@ def search_products():
         if score > 0:
             product_scores[product_id] = {'product': product, 'score': score}
 
+    # 4. Typo tolerance: a word found in no product name or type also matches
+    # the closest indexed words ("iphnoe" -> "iphone"), scored by similarity
+    # below an exact name word, so exact matches still rank first.
+    for token in query_tokens:
+        if catalog_index.has_word(token):
+            continue
+        best = {}
+        for word, similarity in catalog_index.similar_words(token):
+            for product_id in catalog_index.word_ids(word):
+                best[product_id] = max(best.get(product_id, 0), similarity)
+        for product_id, similarity in sorted(best.items()): # Catalog (id) order among equal scores
+            if product_id not in product_scores:
+                park = catalog_index.get_park(product_id)
+                if park is None:
+                    continue # Deleted since the word lookup
+                product_scores[product_id] = {'product': park, 'score': 0}
+            product_scores[product_id]['score'] += round(SEARCH_FUZZY_SCORE * similarity)
+
     # Convert dict to list and sort by score, descending
     scored_products = sorted(list(product_scores.values()), key=lambda x: x['score'], reverse=True)
     
     # Extract just the product dictionaries for the final result
-    return jsonify([item['product'] for item in scored_products])
+    return stream_json_array(item['product'] for item in scored_products)
 # --- CHAT SYSTEM ---
 
 @app.route('/api/product/<string:product_id>')
@@ -383,7 +733,7 @@ def get_user_and_unread_count(session):
                         messages = convo_data
 
                     if key.endswith(f"-{user_id}"): # Check if the admin is the recipient
-                        total_unread_count += sum(1 for msg in messages if msg.get('sender') == 'user' and not msg.get('seen'))
+                        total_unread_count += count_unread(key, convo_data, messages, user_id, 'user')
             else:
                 # User's total is the sum of unread messages from admins across all their conversations.
                 for key, convo_data in conversations.items():
@@ -396,24 +746,110 @@ def get_user_and_unread_count(session):
                         messages = convo_data
 
                     if key.startswith(f"{user_id}-"): # Check if the user is the sender
-                        total_unread_count += sum(1 for msg in messages if msg.get('sender') == 'admin' and not msg.get('seen'))
+                        total_unread_count += count_unread(key, convo_data, messages, user_id, 'admin')
     return current_user, total_unread_count
 
+@metrics.timed('storage_call', call='get_conversations')
 def get_conversations():
     """Reads all chat conversations from the JSON file."""
     if not os.path.exists(CONVERSATIONS_FILE):
         return {}
     try:
         with open(CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
+            metrics.inc('storage_bytes_total', os.fstat(f.fileno()).st_size, file='conversations', op='read')
             return json.load(f)
     except (json.JSONDecodeError, FileNotFoundError):
         return {}
 
+@metrics.timed('storage_call', call='save_conversations')
 def save_conversations(conversations):
     """Saves the conversations dictionary to the JSON file."""
     os.makedirs(os.path.dirname(CONVERSATIONS_FILE), exist_ok=True)
-    with open(CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
+    # Write to a temporary file and swap it in, so a concurrent reader (the chat
+    # writer runs in the background) never sees a half-written file.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(CONVERSATIONS_FILE), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
         json.dump(conversations, f, indent=2)
+        metrics.inc('storage_bytes_total', f.tell(), file='conversations', op='write')
+    os.replace(temp_path, CONVERSATIONS_FILE)
+
+# --- Read receipts ---
+# Instead of flipping a 'seen' flag on every message, each participant has a
+# "last seen" high-water mark per conversation, stored as
+# convo_data['last_seen'][user_id] (an ISO timestamp). New marks are coalesced in
+# memory and persisted by the chat writer every few seconds, so opening a chat
+# never rewrites the conversations file. Legacy per-message 'seen' flags are
+# still honoured for old messages.
+READ_RECEIPT_FLUSH_SECONDS = 5
+
+_pending_read_marks = {} # conversation_key -> {user_id: ISO timestamp}
+
+def get_last_seen(conversation_key, convo_data, user_id):
+    """Returns a participant's read high-water mark, including unflushed marks."""
+    persisted = convo_data.get('last_seen', {}).get(user_id, '') if isinstance(convo_data, dict) else ''
+    pending = _pending_read_marks.get(conversation_key, {}).get(user_id, '')
+    return max(persisted, pending)
+
+def is_message_seen(message, last_seen):
+    """A message is seen if it carries the legacy flag or is at or before the reader's mark."""
+    return bool(message.get('seen')) or bool(last_seen and (message.get('timestamp') or '') <= last_seen)
+
+def count_unread(conversation_key, convo_data, messages, reader_id, sender_type):
+    """Counts messages from `sender_type` that `reader_id` has not read yet."""
+    last_seen = get_last_seen(conversation_key, convo_data, reader_id)
+    return sum(1 for msg in messages if msg.get('sender') == sender_type and not is_message_seen(msg, last_seen))
+
+def iter_seen(conversation_key, convo_data, messages):
+    """Yields messages with their 'seen' flag set from the recipient's mark, for display only."""
+    try:
+        user_part, admin_part = conversation_key.split('-')
+    except ValueError:
+        yield from messages
+        return
+    # Messages sent by the 'user' side are read by the admin part, and vice versa.
+    marks = {
+        'user': get_last_seen(conversation_key, convo_data, admin_part),
+        'admin': get_last_seen(conversation_key, convo_data, user_part)
+    }
+    for message in messages:
+        message['seen'] = is_message_seen(message, marks.get(message.get('sender'), ''))
+        yield message
+
+def annotate_seen(conversation_key, convo_data, messages):
+    """Sets each message's 'seen' flag from its recipient's mark, for display only."""
+    for _ in iter_seen(conversation_key, convo_data, messages):
+        pass
+    return messages
+
+def record_read_mark(conversation_key, user_id, timestamp):
+    """Raises a participant's in-memory read mark; the chat writer persists it later."""
+    marks = _pending_read_marks.setdefault(conversation_key, {})
+    if timestamp > marks.get(user_id, ''):
+        marks[user_id] = timestamp
+    _get_chat_ingest_queue() # Make sure the writer that flushes marks is running.
+
+def _apply_read_marks(conversations, marks):
+    """Merges a snapshot of pending read marks into loaded conversations."""
+    for conversation_key, user_marks in marks.items():
+        convo_data = conversations.get(conversation_key)
+        if convo_data is None:
+            continue
+        if isinstance(convo_data, list): # Migrate old format
+            convo_data = conversations[conversation_key] = {"messages": convo_data, "deleted_by": []}
+        last_seen = convo_data.setdefault('last_seen', {})
+        for user_id, timestamp in user_marks.items():
+            if timestamp > last_seen.get(user_id, ''):
+                last_seen[user_id] = timestamp
+
+def _forget_flushed_read_marks(marks):
+    """Drops pending marks that were persisted and not raised again meanwhile."""
+    for conversation_key, user_marks in marks.items():
+        pending = _pending_read_marks.get(conversation_key, {})
+        for user_id, timestamp in user_marks.items():
+            if pending.get(user_id) == timestamp:
+                del pending[user_id]
+        if not pending:
+            _pending_read_marks.pop(conversation_key, None)
 
 @app.route('/chat')
 def chat_page():
@@ -465,41 +901,44 @@ def chat_page():
         # The key is always user_id-admin_id. The current user is the first part.
         conversation_key = f"{user_id}-{target_admin_id}"
         
-        conversations = get_conversations()
-        if conversation_key not in conversations:
-            # Create an empty record for the new conversation
-            conversations[conversation_key] = {"messages": [], "deleted_by": []}
-            save_conversations(conversations)
+        with file_lock.locked(CONVERSATIONS_FILE):
+            conversations = get_conversations()
+            if conversation_key not in conversations:
+                # Create an empty record for the new conversation
+                conversations[conversation_key] = {"messages": [], "deleted_by": []}
+                save_conversations(conversations)
 
     # --- NEW LOGIC: Handle auto-messaging for reports ---
     if report_merchant_id and report_merchant_name and target_admin_id and main_admin:
         conversation_key = f"{user_id}-{target_admin_id}"
-        conversations = get_conversations()
+        with file_lock.locked(CONVERSATIONS_FILE):
+            conversations = get_conversations()
 
-        # Construct the report message
-        report_text = (
-            f"--- AUTOMATED REPORT ---\n"
-            f"User '{current_user['name']}' ({current_user['id']}) is reporting a store.\n\n"
-            f"Store Name: {report_merchant_name}\n"
-            f"Store ID: {report_merchant_id}"
-        )
+            # Construct the report message
+            report_text = (
+                f"--- AUTOMATED REPORT ---\n"
+                f"User '{current_user['name']}' ({current_user['id']}) is reporting a store.\n\n"
+                f"Store Name: {report_merchant_name}\n"
+                f"Store ID: {report_merchant_id}"
+            )
         
-        # Create the message object. It's sent from the 'user' to the 'admin'.
-        new_message = {
-            "sender": "user", # The user is sending the report
-            "text": report_text,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "seen": False, # The main admin has not seen it yet
-            "conversation_id": conversation_key,
-            "is_system": True # Flag to identify this as an automated message
-        }
+            # Create the message object. It's sent from the 'user' to the 'admin'.
+            new_message = {
+                "sender": "user", # The user is sending the report
+                "text": report_text,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "seen": False, # The main admin has not seen it yet
+                "conversation_id": conversation_key,
+                "is_system": True # Flag to identify this as an automated message
+            }
         
-        # Add user/admin info to the message for the frontend
-        new_message['user_info'] = {'id': current_user['id'], 'name': current_user['name'], 'photo': current_user.get('photo')}
-        new_message['admin_info'] = {'id': main_admin['id'], 'name': main_admin['name'], 'photo': main_admin.get('photo')}
+            # Add user/admin info to the message for the frontend
+            new_message['user_info'] = {'id': current_user['id'], 'name': current_user['name'], 'photo': current_user.get('photo')}
+            new_message['admin_info'] = {'id': main_admin['id'], 'name': main_admin['name'], 'photo': main_admin.get('photo')}
 
-        conversations.setdefault(conversation_key, {"messages": [], "deleted_by": []})['messages'].append(new_message)
-        save_conversations(conversations)
+            conversations.setdefault(conversation_key, {"messages": [], "deleted_by": []})['messages'].append(new_message)
+            save_conversations(conversations)
+        chat_search.index_messages([new_message])
         socketio.emit('receive_message', new_message, room=target_admin_id)
 
     # --- END NEW LOGIC ---
@@ -535,6 +974,7 @@ def admin_chat_dashboard():
     
     conversations = get_conversations()
     visible_conversations = {}
+    archive_segments = {}
     convo_list = []
 
     for key, convo_data in conversations.items():
@@ -555,7 +995,8 @@ def admin_chat_dashboard():
             
             # if not messages: continue # Allow empty conversations to be rendered
 
-            visible_conversations[key] = messages
+            visible_conversations[key] = annotate_seen(key, convo_data, messages)
+            archive_segments[key] = chat_archive.latest_segment(convo_data)
             
             # Determine who the "other person" is in the chat
             other_user_id = user_part if admin_id == admin_part else admin_part
@@ -568,10 +1009,10 @@ def admin_chat_dashboard():
                 last_message_time = last_message.get('timestamp')
                 # Determine which messages are "from the other person" to count as unread
                 unread_sender_type = 'user' if admin_id == admin_part else 'admin'
-                unread_count = sum(1 for msg in messages if msg.get('sender') == unread_sender_type and not msg.get('seen'))
+                unread_count = count_unread(key, convo_data, messages, admin_id, unread_sender_type)
             else:
                 clean_text = "New conversation"
-                last_message_time = datetime.now(timezone.utc).isoformat()
+                last_message_time = chat_archive.archived_until(convo_data) or datetime.now(timezone.utc).isoformat()
                 unread_count = 0
             
             convo_list.append({
@@ -586,11 +1027,14 @@ def admin_chat_dashboard():
             })
 
     convo_list.sort(key=lambda x: x['last_message_time'] or '', reverse=True)
-    return render_template('admin_chat.html', user=current_user, convo_list=convo_list, all_conversations=visible_conversations, is_main_admin=is_main_admin, user_map=user_map)
+    return render_template('admin_chat.html', user=current_user, convo_list=convo_list, all_conversations=visible_conversations, archive_segments=archive_segments, is_main_admin=is_main_admin, user_map=user_map)
 
 @app.route('/api/conversations/mark_seen', methods=['POST'])
 def mark_as_seen():
-    """API endpoint for an admin to mark user messages as seen."""
+    """
+    API endpoint for an admin to mark a conversation as read up to now.
+    Kept for older clients; the 'mark_read' socket event is the primary path.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not authenticated"}), 401
@@ -604,34 +1048,22 @@ def mark_as_seen():
     if not conversation_key:
         return jsonify({"error": "conversation_key is required"}), 400
 
-    conversations = get_conversations()
-    convo_data = conversations.get(conversation_key)
-
-    if not convo_data:
+    if conversation_key not in get_conversations():
         return jsonify({"error": "Conversation not found"}), 404
 
-    # Handle both data structures
-    if isinstance(convo_data, dict):
-        messages = convo_data.get('messages', [])
-    else:
-        messages = convo_data
-
-    updated = False
-    for message in messages:
-        if message.get('sender') == 'user' and not message.get('seen'):
-            message['seen'] = True
-            updated = True
-    
-    if updated:
-        # Ensure it's saved in the new format
-        conversations.setdefault(conversation_key, {'messages': [], 'deleted_by': []})['messages'] = messages
-        save_conversations(conversations)
-
+    now = datetime.now(timezone.utc).isoformat()
+    record_read_mark(conversation_key, user_id, now)
+    user_part, _, admin_part = conversation_key.partition('-')
+    if user_id not in [user_part, admin_part] and current_user.get('email') == os.environ.get('MAIN_ADMIN_EMAIL'):
+        record_read_mark(conversation_key, admin_part, now) # See handle_mark_read
     return jsonify({"message": "Messages marked as seen"}), 200
 
 @app.route('/api/conversation-history/<string:conversation_key>')
 def get_conversation_history(conversation_key):
-    """API endpoint to get the message history for a conversation."""
+    """
+    API endpoint to get the message history for a conversation.
+    This is read-only: read receipts are sent separately with the 'mark_read' socket event.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not authenticated"}), 401
@@ -651,78 +1083,360 @@ def get_conversation_history(conversation_key):
     else: # Old format
         messages = convo_data
 
-    updated = False
-    current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
-    
-    if current_user:
-        # Determine who the other party is to mark their messages as seen
-        # If the current user is a normal user, they are marking admin messages as seen.
-        # If the current user is an admin, they are marking user messages as seen.
-        other_party_type = 'admin' if current_user.get('role') != 'admin' else 'user'
-        for message in messages:
-            if message.get('sender') == other_party_type and not message.get('seen'):
-                message['seen'] = True
-                updated = True
-    
-    if updated:
-        # Ensure it's saved in the new format and save only once after the loop.
-        conversations.setdefault(conversation_key, {'messages': [], 'deleted_by': []})['messages'] = messages
-        save_conversations(conversations)
-
-    return jsonify(messages)
+    return stream_json_array(iter_seen(conversation_key, convo_data, messages))
 
-@app.route('/api/conversation/<string:conversation_id>/delete', methods=['POST'])
-def delete_conversation(conversation_id):
+@app.route('/api/conversation-history/<string:conversation_key>/archive/<int:segment>')
+def get_archived_history(conversation_key, segment):
+    """
+    API endpoint to get one archived segment of a conversation's older messages.
+    Clients fetch segments newest first as the user scrolls back through a chat.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not authenticated"}), 401
 
-    conversations = get_conversations()
-    if conversation_id not in conversations:
+    try:
+        user_part, admin_part = conversation_key.split('-')
+    except ValueError:
         return jsonify({"error": "Conversation not found"}), 404
+    if user_id not in (user_part, admin_part):
+        current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
+        if not current_user or current_user.get('email') != os.environ.get('MAIN_ADMIN_EMAIL'):
+            return jsonify({"error": "Forbidden"}), 403
 
-    convo_data = conversations[conversation_id]
-    if isinstance(convo_data, list): # Migrate old format on the fly
-        convo_data = {"messages": convo_data, "deleted_by": []}
+    convo_data = get_conversations().get(conversation_key)
+    if not isinstance(convo_data, dict) or user_id in convo_data.get('deleted_by', []):
+        return jsonify({"error": "Conversation not found"}), 404
+
+    messages = chat_archive.load_segment(conversation_key, segment)
+    if messages is None:
+        return jsonify({"error": "Archive segment not found"}), 404
+
+    return jsonify({
+        "messages": annotate_seen(conversation_key, convo_data, messages),
+        "segment": segment,
+        "previous_segment": segment - 1 if segment > 1 else None
+    })
 
-    deleted_by_list = convo_data.get('deleted_by', [])
-    if user_id not in deleted_by_list:
-        deleted_by_list.append(user_id)
+@app.route('/api/admin/chat-search')
+def search_chat_history():
+    """
+    Full-text search over all chat messages for the main (customer service) admin.
+    Params: q (all terms must match), participant (user id), since/until (ISO dates), page.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    users = get_all_users()
+    current_user = next((u for u in users if u.get('id') == user_id), None)
+    if not current_user or current_user.get('email') != os.environ.get('MAIN_ADMIN_EMAIL'):
+        return jsonify({"error": "Forbidden"}), 403
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"results": [], "total": 0, "page": 1, "limit": 20})
 
-    # Check if both participants have deleted the chat to permanently remove it
     try:
-        user_part, admin_part = conversation_id.split('-')
-        if user_part in deleted_by_list and admin_part in deleted_by_list:
-            del conversations[conversation_id]
-        else:
-            convo_data['deleted_by'] = deleted_by_list
-            conversations[conversation_id] = convo_data
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except (ValueError, TypeError):
+        page = 1
+        limit = 20
+
+    try:
+        since = _parse_range_timestamp(request.args['since']) if request.args.get('since') else None
+        until = _parse_range_timestamp(request.args['until']) if request.args.get('until') else None
     except ValueError:
-        # Handle malformed key, maybe just delete it
-        if conversation_id in conversations:
-            del conversations[conversation_id]
+        return jsonify({"error": "since and until must be ISO dates or epoch seconds"}), 400
+
+    chat_search.ensure_built(get_conversations)
+    results, total = chat_search.search(
+        query,
+        participant=request.args.get('participant') or None,
+        since=datetime.fromtimestamp(since, timezone.utc).isoformat() if since is not None else None,
+        until=datetime.fromtimestamp(until, timezone.utc).isoformat() if until is not None else None,
+        offset=(page - 1) * limit,
+        limit=limit
+    )
 
-    save_conversations(conversations)
+    user_map = {u['id']: u for u in users}
+    for result in results:
+        result['user_name'] = user_map.get(result['user_part'], {}).get('name', 'Unknown')
+        result['admin_name'] = user_map.get(result['admin_part'], {}).get('name', 'Unknown')
+        result['text'] = re.sub(r'<[^>]+>', ' ', result['text'] or '').strip() or '[Product Link]'
+
+    return jsonify({"results": results, "total": total, "page": page, "limit": limit})
+
+@app.route('/api/conversation/<string:conversation_id>/delete', methods=['POST'])
+def delete_conversation(conversation_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    with file_lock.locked(CONVERSATIONS_FILE):
+        conversations = get_conversations()
+        if conversation_id not in conversations:
+            return jsonify({"error": "Conversation not found"}), 404
+
+        convo_data = conversations[conversation_id]
+        if isinstance(convo_data, list): # Migrate old format on the fly
+            convo_data = {"messages": convo_data, "deleted_by": []}
+
+        deleted_by_list = convo_data.get('deleted_by', [])
+        if user_id not in deleted_by_list:
+            deleted_by_list.append(user_id)
+
+        # Check if both participants have deleted the chat to permanently remove it
+        try:
+            user_part, admin_part = conversation_id.split('-')
+            if user_part in deleted_by_list and admin_part in deleted_by_list:
+                del conversations[conversation_id]
+                chat_search.remove_conversation(conversation_id)
+                chat_archive.remove_conversation(conversation_id)
+            else:
+                convo_data['deleted_by'] = deleted_by_list
+                conversations[conversation_id] = convo_data
+        except ValueError:
+            # Handle malformed key, maybe just delete it
+            if conversation_id in conversations:
+                del conversations[conversation_id]
+
+        save_conversations(conversations)
     return jsonify({"message": "Chat hidden successfully"}), 200
 
 @socketio.on('connect')
-def handle_connect():
+@metrics.timed('socketio_event', event='connect')
+@profiling.socket_event('connect')
+def handle_connect(auth=None):
     """Handles a new WebSocket connection."""
     user_id = session.get('user_id')
     if not user_id:
         return # Silently ignore unauthenticated connections
     join_room(user_id)
+    _get_chat_ingest_queue() # Start the chat writer, which also runs archival.
+
+# --- Chat ingest: rate limiting and batched writes ---
+# Each user and each conversation gets a token bucket; a client that sends too
+# fast receives an explicit 'slow_down' event instead of the message being
+# written. Accepted messages go through a bounded per-process queue that a
+# single background writer drains, persisting each batch with one
+# read-modify-write of the conversations file before emitting it. The same
+# writer periodically moves old messages to the archive tier (chat_archive).
+CHAT_USER_RATE = float(os.environ.get('CHAT_USER_RATE', 1.0))              # messages per second
+CHAT_USER_BURST = int(os.environ.get('CHAT_USER_BURST', 5))
+CHAT_CONVERSATION_RATE = float(os.environ.get('CHAT_CONVERSATION_RATE', 2.0))
+CHAT_CONVERSATION_BURST = int(os.environ.get('CHAT_CONVERSATION_BURST', 10))
+CHAT_INGEST_QUEUE_SIZE = int(os.environ.get('CHAT_INGEST_QUEUE_SIZE', 1000))
+CHAT_INGEST_BATCH_SIZE = 100
+CHAT_WRITE_ATTEMPTS = 5                # tries per batch before its senders are told to resend
+CHAT_WRITE_RETRY_SECONDS = 0.5         # first retry delay, doubled after each failure
+CHAT_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('CHAT_ARCHIVE_INTERVAL_SECONDS', 3600))
+
+_chat_ingest = {
+    'queue': None,
+    'failed': [] # A batch whose write failed, retried before newer messages
+}
+
+def _get_chat_ingest_queue():
+    """Creates the ingest queue and starts its writer on first use."""
+    if _chat_ingest['queue'] is None:
+        _chat_ingest['queue'] = socketio.server.eio.create_queue()
+        socketio.start_background_task(_chat_writer_loop)
+    return _chat_ingest['queue']
+
+@file_lock.locked(CONVERSATIONS_FILE) # Other workers write the same file
+def _write_message_batch(batch, read_marks=None, archive=False):
+    """Persists a batch of queued messages (and due read marks) with a single conversations file rewrite.
+
+    With `archive`, messages past the retention age are also moved to the archive tier.
+    """
+    conversations = get_conversations()
+    archived = chat_archive.archive_old_messages(conversations) if archive else 0
+    if not batch and not read_marks and not archived:
+        return
+    if read_marks:
+        _apply_read_marks(conversations, read_marks)
+    for item in batch:
+        conversation_key = item['message']['conversation_id']
+        convo_data = conversations.get(conversation_key)
+        if convo_data is None:
+            convo_data = {"messages": [], "deleted_by": []}
+        elif isinstance(convo_data, list): # Migrate old format
+            convo_data = {"messages": convo_data, "deleted_by": []}
+
+        # If the recipient had deleted the chat, this new message "resurrects" it for them.
+        if item['target_room'] in convo_data.get('deleted_by', []):
+            convo_data['deleted_by'].remove(item['target_room'])
+
+        convo_data['messages'].append(item['message'])
+        conversations[conversation_key] = convo_data
+    save_conversations(conversations)
+
+def _deliver_message(item):
+    """Emits a persisted message to both participants and the main admin."""
+    new_message = item['message']
+    # Send to the target (the other person in the chat)
+    socketio.emit('receive_message', new_message, to=item['target_room'])
+    # Send back to the sender for their own UI
+    socketio.emit('receive_message', new_message, to=item['sender_room'])
+    # The main admin needs to see everything in real-time.
+    main_admin_id = item.get('main_admin_id')
+    if main_admin_id and main_admin_id not in [item['sender_room'], item['target_room']]:
+        socketio.emit('receive_message', new_message, to=main_admin_id)
+
+def _reject_message(item):
+    """Tells the sender a queued message could not be saved, so their page puts the text back for a resend."""
+    message = item['message']
+    socketio.emit('slow_down', {
+        "scope": "server",
+        "retry_after": 1.0,
+        "conversation_id": message.get('conversation_id'),
+        "text": message.get('text')
+    }, to=item['sender_room'])
+
+def _chat_writer_loop():
+    """Background task that drains the ingest queue in batches.
+
+    A batch that fails to write is retried (ahead of newer messages) with
+    exponential backoff; after CHAT_WRITE_ATTEMPTS its senders get a
+    'slow_down' so their pages offer the text for resending.
+    """
+    queue_empty = socketio.server.eio.get_queue_empty_exception()
+    ingest_queue = _chat_ingest['queue']
+    marks_flushed_at = time.monotonic()
+    archived_at = None
+    attempts = 0
+    while True:
+        if attempts:
+            socketio.sleep(min(CHAT_WRITE_RETRY_SECONDS * 2 ** (attempts - 1), 30))
+        batch, _chat_ingest['failed'] = _chat_ingest['failed'], []
+        try:
+            if not batch:
+                batch.append(ingest_queue.get(timeout=1))
+            while len(batch) < CHAT_INGEST_BATCH_SIZE:
+                batch.append(ingest_queue.get_nowait())
+        except queue_empty:
+            pass
+
+        read_marks = None
+        if _pending_read_marks and time.monotonic() - marks_flushed_at >= READ_RECEIPT_FLUSH_SECONDS:
+            read_marks = {key: dict(marks) for key, marks in _pending_read_marks.items()}
+            marks_flushed_at = time.monotonic()
+        archive = archived_at is None or time.monotonic() - archived_at >= CHAT_ARCHIVE_INTERVAL_SECONDS
+        if archive:
+            archived_at = time.monotonic()
+        if not batch and not read_marks and not archive:
+            continue
+        try:
+            _write_message_batch(batch, read_marks, archive)
+        except Exception as e:
+            # Keep the writer alive. Read marks stay pending until a write succeeds.
+            attempts += 1
+            if attempts < CHAT_WRITE_ATTEMPTS:
+                print(f"ERROR: failed to write {len(batch)} chat message(s) (attempt {attempts}), retrying: {e}")
+                _chat_ingest['failed'] = batch
+            else:
+                print(f"ERROR: giving up on {len(batch)} chat message(s) after {attempts} attempts: {e}")
+                for item in batch:
+                    _reject_message(item)
+                attempts = 0
+            continue
+        attempts = 0
+        if read_marks:
+            _forget_flushed_read_marks(read_marks)
+        try:
+            for item in batch:
+                _deliver_message(item)
+        except Exception as e:
+            print(f"ERROR: failed to deliver {len(batch)} saved chat message(s): {e}")
+        try:
+            chat_search.index_messages([item['message'] for item in batch])
+        except Exception as e:
+            print(f"ERROR: failed to index {len(batch)} chat message(s) for search: {e}")
+
+def flush_pending_writes():
+    """Writes out everything this process still buffers: queued chat messages, read marks, analytics and the catalog snapshot.
+
+    Called on graceful shutdown (serve.py), after the worker stopped accepting connections.
+    """
+    ingest_queue = _chat_ingest['queue']
+    batch, _chat_ingest['failed'] = _chat_ingest['failed'], []
+    if ingest_queue is not None:
+        queue_empty = socketio.server.eio.get_queue_empty_exception()
+        try:
+            while True:
+                batch.append(ingest_queue.get_nowait())
+        except queue_empty:
+            pass
+    read_marks = {key: dict(marks) for key, marks in _pending_read_marks.items()}
+    if batch or read_marks:
+        _write_message_batch(batch, read_marks)
+        _forget_flushed_read_marks(read_marks)
+        for item in batch:
+            _deliver_message(item)
+    analytics.flush()
+    snapshots.save_if_changed()
+
+def _slow_down(scope, retry_after, data):
+    """Tells the sending client its message was not accepted and when to retry."""
+    emit('slow_down', {
+        "scope": scope,
+        "retry_after": round(retry_after, 2),
+        "conversation_id": data.get('conversation_id'),
+        "text": data.get('text')
+    })
+
+@socketio.on('mark_read')
+@metrics.timed('socketio_event', event='mark_read')
+@profiling.socket_event('mark_read')
+def handle_mark_read(data):
+    """Records that the sender has read a conversation up to a message timestamp."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return # Not authenticated
+
+    conversation_key = data.get('conversation_id')
+    try:
+        user_part, admin_part = conversation_key.split('-')
+    except (AttributeError, ValueError):
+        return # Invalid key format
+
+    if user_id not in [user_part, admin_part]:
+        # Only the main admin may read conversations they are not part of.
+        current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
+        if not current_user or current_user.get('email') != os.environ.get('MAIN_ADMIN_EMAIL'):
+            return
+
+    now = datetime.now(timezone.utc)
+    try:
+        read_up_to = datetime.fromisoformat(data['last_timestamp'])
+        if read_up_to.tzinfo is None:
+            read_up_to = read_up_to.replace(tzinfo=timezone.utc)
+        read_up_to = min(read_up_to.astimezone(timezone.utc), now)
+    except (KeyError, TypeError, ValueError):
+        read_up_to = now
+    last_seen = read_up_to.isoformat()
+
+    record_read_mark(conversation_key, user_id, last_seen)
+    if user_id in [user_part, admin_part]:
+        other_party = admin_part if user_id == user_part else user_part
+        emit('read_receipt', {"conversation_id": conversation_key, "user_id": user_id, "last_seen": last_seen}, room=other_party)
+    else:
+        # The main admin reading a merchant's conversation reads it for the
+        # merchant too, as the shared per-message 'seen' flags used to.
+        record_read_mark(conversation_key, admin_part, last_seen)
+        emit('read_receipt', {"conversation_id": conversation_key, "user_id": admin_part, "last_seen": last_seen}, room=user_part)
+
 @socketio.on('new_message')
+@metrics.timed('socketio_event', event='new_message')
+@profiling.socket_event('new_message')
 def handle_new_message(data):
     """Handles receiving a new message from a client."""
     user_id = session.get('user_id')
     if not user_id:
         return # Not authenticated
 
-    current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
-    if not current_user:
-        return
-
     text = data.get('text')
     conversation_key = data.get('conversation_id')
 
@@ -745,46 +1459,139 @@ def handle_new_message(data):
         # The sender is not part of this conversation. This is a security check.
         return
 
-    new_message = {"sender": sender_type, "text": text, "timestamp": datetime.now(timezone.utc).isoformat(), "seen": False, "conversation_id": conversation_key}    
-    # --- NEW: Always attach current user info to the message payload ---
-    # This ensures the frontend always has the latest name, solving the identity bug.
+    # Rate limits are checked before touching any file.
+    allowed, retry_after = rate_limit.consume(f"user:{user_id}", CHAT_USER_RATE, CHAT_USER_BURST)
+    if not allowed:
+        return _slow_down('user', retry_after, data)
+    allowed, retry_after = rate_limit.consume(f"conversation:{conversation_key}", CHAT_CONVERSATION_RATE, CHAT_CONVERSATION_BURST)
+    if not allowed:
+        rate_limit.refund(f"user:{user_id}")
+        return _slow_down('conversation', retry_after, data)
+
+    ingest_queue = _get_chat_ingest_queue()
+    if ingest_queue.qsize() >= CHAT_INGEST_QUEUE_SIZE:
+        # The writer is behind; push back instead of letting the backlog grow.
+        return _slow_down('server', 1.0, data)
+
     all_users = get_all_users()
-    user_part_id, admin_part_id = conversation_key.split('-')
-    user_info = next((u for u in all_users if u.get('id') == user_part_id), None)
-    admin_info = next((u for u in all_users if u.get('id') == admin_part_id), None)
+    current_user = next((u for u in all_users if u.get('id') == user_id), None)
+    if not current_user:
+        return
+
+    new_message = {"sender": sender_type, "text": text, "timestamp": datetime.now(timezone.utc).isoformat(), "seen": False, "conversation_id": conversation_key}
+    # --- Always attach current user info to the message payload ---
+    # This ensures the frontend always has the latest name, solving the identity bug.
+    user_info = next((u for u in all_users if u.get('id') == user_part), None)
+    admin_info = next((u for u in all_users if u.get('id') == admin_part), None)
 
     if user_info and admin_info:
         new_message['user_info'] = {'id': user_info['id'], 'name': user_info['name'], 'photo': user_info.get('photo')}
         new_message['admin_info'] = {'id': admin_info['id'], 'name': admin_info['name'], 'photo': admin_info.get('photo')}
 
-    conversations = get_conversations()
-    
-    # --- Handle new data structure and undelete logic ---
-    convo_data = conversations.get(conversation_key)
-    if convo_data is None:
-        convo_data = {"messages": [], "deleted_by": []}
-    elif isinstance(convo_data, list): # Migrate old format
-        convo_data = {"messages": convo_data, "deleted_by": []}
-
-    # If the recipient had deleted the chat, this new message "resurrects" it for them.
-    recipient_id = target_room
-    if recipient_id in convo_data.get('deleted_by', []):
-        convo_data['deleted_by'].remove(recipient_id)
-
-    convo_data['messages'].append(new_message)
-    conversations[conversation_key] = convo_data
-    save_conversations(conversations)
+    main_admin = next((u for u in all_users if u.get('email') == os.environ.get('MAIN_ADMIN_EMAIL')), None)
+    ingest_queue.put({
+        "message": new_message,
+        "sender_room": user_id,
+        "target_room": target_room,
+        "main_admin_id": main_admin['id'] if main_admin else None
+    })
 
-    # --- Real-time message distribution ---
-    # Send to the target (the other person in the chat)
-    emit('receive_message', new_message, room=target_room)
-    # Send back to the sender for their own UI
-    emit('receive_message', new_message, room=user_id)
+# --- Real-time catalog updates ---
+# Open shop pages subscribe with 'subscribe_catalog' and receive 'catalog_update'
+# events describing products that were added, edited or deleted, so they can
+# patch their grids in place. Changes are coalesced per product and sent once
+# per CATALOG_BROADCAST_INTERVAL_SECONDS to the 'catalog' room (everything) and
+# to 'catalog:<type>' rooms for clients that only follow some categories.
+CATALOG_BROADCAST_INTERVAL_SECONDS = float(os.environ.get('CATALOG_BROADCAST_INTERVAL_SECONDS', 2))
+CATALOG_ROOM = 'catalog'
+CATALOG_NOTICE_FIELDS = ('name', 'description', 'price', 'location', 'type', 'image_filenames', 'date_added', 'home_delivery')
+
+_catalog_broadcast = {
+    'categories': None, # product id -> normalized type, loaded when the first client subscribes
+    'pending': {},      # product id -> (notice, set of rooms)
+    'running': False    # whether the broadcast loop has been started
+}
+
+def _catalog_room(category):
+    return f"{CATALOG_ROOM}:{catalog_index.normalize_key(category)}"
+
+def _start_catalog_broadcast():
+    if not _catalog_broadcast['running']:
+        _catalog_broadcast['running'] = True
+        socketio.start_background_task(_catalog_broadcast_loop)
+
+def _queue_catalog_notice(event, park):
+    """data_manager listener that queues a compact change notice for subscribed clients.
+
+    Notices are queued even without local subscribers: with a message queue,
+    clients connected to other workers hear about this worker's writes too.
+    """
+    park_id = park.get('id')
+    if event not in ('add', 'update', 'delete') or not park_id:
+        return
 
-    # The main admin needs to see everything in real-time.
-    main_admin = next((u for u in get_all_users() if u.get('email') == os.environ.get('MAIN_ADMIN_EMAIL')), None)
-    if main_admin and main_admin['id'] not in [user_id, target_room]:
-        emit('receive_message', new_message, room=main_admin['id'])
+    rooms = {CATALOG_ROOM, _catalog_room(park.get('type'))}
+    # Known once a client subscribed here; the category a product moved out of is only needed by such clients.
+    categories = _catalog_broadcast['categories']
+    if categories is not None:
+        previous_category = categories.get(park_id)
+        if previous_category is not None:
+            rooms.add(f"{CATALOG_ROOM}:{previous_category}") # It may have moved out of a category.
+        if event == 'delete':
+            categories.pop(park_id, None)
+        else:
+            categories[park_id] = catalog_index.normalize_key(park.get('type'))
+    if event == 'delete':
+        notice = {"id": park_id, "event": "delete"}
+    else:
+        notice = {"id": park_id, "event": event}
+        notice.update({field: park.get(field) for field in CATALOG_NOTICE_FIELDS})
+
+    pending = _catalog_broadcast['pending']
+    if park_id in pending:
+        earlier, earlier_rooms = pending[park_id]
+        rooms |= earlier_rooms
+        if earlier['event'] == 'add' and notice['event'] == 'update':
+            notice['event'] = 'add' # Still new to clients that have not heard of it.
+    pending[park_id] = (notice, rooms)
+    _start_catalog_broadcast()
+
+data_manager.add_listener(_queue_catalog_notice)
+
+def _catalog_broadcast_loop():
+    """Background task that emits the coalesced catalog notices every interval."""
+    while True:
+        socketio.sleep(CATALOG_BROADCAST_INTERVAL_SECONDS)
+        pending = _catalog_broadcast['pending']
+        if not pending:
+            continue
+        _catalog_broadcast['pending'] = {}
+        by_room = {}
+        for notice, rooms in pending.values():
+            for room in rooms:
+                by_room.setdefault(room, []).append(notice)
+        version = catalog_changes.current_version()
+        for room, notices in by_room.items():
+            socketio.emit('catalog_update', {"version": version, "changes": notices}, to=room)
+
+@socketio.on('subscribe_catalog')
+@metrics.timed('socketio_event', event='subscribe_catalog')
+@profiling.socket_event('subscribe_catalog')
+def handle_subscribe_catalog(data=None):
+    """Joins the catalog update rooms; pass {'categories': [...]} to follow only some types."""
+    if _catalog_broadcast['categories'] is None:
+        _catalog_broadcast['categories'] = {
+            park.get('id'): catalog_index.normalize_key(park.get('type')) for park in catalog_index.get_parks()
+        }
+    _start_catalog_broadcast()
+
+    categories = (data or {}).get('categories') if isinstance(data, dict) else None
+    if categories:
+        for category in categories[:50]:
+            if isinstance(category, str):
+                join_room(_catalog_room(category))
+    else:
+        join_room(CATALOG_ROOM)
 
 
 # --- User Account Creation & Login ---
@@ -811,7 +1618,18 @@ def login_user():
         user_found = next((user for user in users if user.get('email') == email), None)
 
         # Securely check the hashed password
-        if user_found and check_password_hash(user_found.get('password'), password):
+        if user_found and password_hashing.verify_password(user_found.get('password'), password):
+            # Transparently upgrade hashes made with older parameters while we have the password.
+            if password_hashing.needs_rehash(user_found.get('password')):
+                new_hash = password_hashing.hash_password(password)
+                with file_lock.locked(USERS_FILE):
+                    users = get_all_users()
+                    for user in users:
+                        if user.get('id') == user_found.get('id'):
+                            user['password'] = new_hash
+                            break
+                    save_users(users)
+
             # Store the user's ID in the session to "log them in"
             session['user_id'] = user_found.get('id')
             # If "Remember Me" was checked, make the session permanent.
@@ -826,6 +1644,17 @@ def login_user():
         return jsonify({"error": "An internal server error occurred"}), 500
 
 
+def _safe_photo_url(value):
+    """Returns a client-supplied photo URL if it is an http(s) URL or one of our image URLs, else None."""
+    if not isinstance(value, str) or len(value) > 2048:
+        return None
+    if value.startswith(IMAGE_URL_PREFIX):
+        return value if blob_storage.valid_key(value[len(IMAGE_URL_PREFIX):]) else None
+    parsed = urlparse(value)
+    if parsed.scheme in ('http', 'https') and parsed.netloc and not any(c in value for c in '"\'<>\\ '):
+        return value
+    return None
+
 @app.route('/create_user', methods=['POST'])
 def create_user():
     """
@@ -847,42 +1676,44 @@ def create_user():
     if not all([name, email, password]):
         return jsonify({"error": "Missing required fields: name, email, and password are required"}), 400
 
+    # Hashing is deliberately slow, so it happens before taking the users file lock.
+    password_hash = password_hashing.hash_password(password)
     try:
-        # Read existing users from the JSON file
-        users = get_all_users()
-
-        # Generate a new unique ID, handling potentially zero-padded string IDs
-        if users:
-            # Safely convert string IDs to integers to find the maximum
-            ids = []
-            for user in users:
-                try: ids.append(int(user.get('id')))
-                except (ValueError, TypeError): continue # Skip if ID is not a valid integer string
-            max_id = max(ids) if ids else 0
-            new_id = max_id + 1
-        else:
-            new_id = 1
-
-        # Format the ID as a 9-digit zero-padded string (e.g., "000000001")
-        formatted_id = f"{new_id:09d}"
-
-        # Create the new user dictionary
-        new_user = {
-            "id": formatted_id,
-            "name": name,
-            "email": email,
-            "number": data.get('number'),
-            "location": data.get('location'),
-            "password": generate_password_hash(password), # Hash the password
-            "photo": data.get('photo'),
-            # New users are assigned the 'normal' role by default.
-            "role": "normal"
-        }
-
-        # Add the new user to the list and write back to the file
-        users.append(new_user)
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users, f, indent=4)
+        with file_lock.locked(USERS_FILE):
+            # Read existing users from the JSON file
+            users = get_all_users()
+
+            # Generate a new unique ID, handling potentially zero-padded string IDs
+            if users:
+                # Safely convert string IDs to integers to find the maximum
+                ids = []
+                for user in users:
+                    try: ids.append(int(user.get('id')))
+                    except (ValueError, TypeError): continue # Skip if ID is not a valid integer string
+                max_id = max(ids) if ids else 0
+                new_id = max_id + 1
+            else:
+                new_id = 1
+
+            # Format the ID as a 9-digit zero-padded string (e.g., "000000001")
+            formatted_id = f"{new_id:09d}"
+
+            # Create the new user dictionary
+            new_user = {
+                "id": formatted_id,
+                "name": name,
+                "email": email,
+                "number": data.get('number'),
+                "location": data.get('location'),
+                "password": password_hash,
+                "photo": _safe_photo_url(data.get('photo')),
+                # New users are assigned the 'normal' role by default.
+                "role": "normal"
+            }
+
+            # Add the new user to the list and write back to the file
+            users.append(new_user)
+            save_users(users)
 
         return jsonify({"message": "User created successfully", "user": new_user}), 201
 
@@ -924,33 +1755,24 @@ def update_profile():
         if not allowed_file(photo.filename):
             return jsonify({"error": "Invalid file type for photo"}), 400
         
-        os.makedirs(USER_IMAGE_FOLDER, exist_ok=True)
-        
-        # Create a unique filename based on user ID to prevent conflicts
-        extension = secure_filename(photo.filename).rsplit('.', 1)[1].lower()
-        new_filename = f"user_{user_id}.{extension}"
-        new_filepath = os.path.join(USER_IMAGE_FOLDER, new_filename)
+        # Save the new photo
+        try:
+            new_photo_url = _store_profile_photo(photo, user_id) # Resize profile pictures
+        except images.ImageRejected as e:
+            return jsonify({"error": str(e)}), 400
 
         # Delete old photo if it exists and has a different name
-        old_photo_path = current_user.get('photo')
-        if old_photo_path and old_photo_path != f"/{new_filepath.replace(os.path.sep, '/')}":
-            # Construct full path from web path
-            old_fs_path = os.path.join('static', *old_photo_path.strip('/').split('/')[1:])
-            if os.path.exists(old_fs_path):
-                os.remove(old_fs_path)
-
-        # Save the new photo
-        img = Image.open(photo.stream)
-        img.thumbnail((200, 200)) # Resize profile pictures
-        img.save(new_filepath, quality=90)
+        old_photo_url = current_user.get('photo')
+        if old_photo_url and old_photo_url != new_photo_url and old_photo_url.startswith(IMAGE_URL_PREFIX):
+            old_key = old_photo_url[len(IMAGE_URL_PREFIX):]
+            if blob_storage.valid_key(old_key):
+                blob_storage.get_storage().delete(old_key)
 
         # Store the web-accessible path
-        current_user['photo'] = f"/{USER_IMAGE_FOLDER}/{new_filename}".replace(os.path.sep, '/')
+        current_user['photo'] = new_photo_url
 
     # Save the updated user list
-    users[user_index] = current_user
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    save_user(current_user)
 
     return jsonify({"message": "Profile updated successfully", "user": current_user}), 200
 
@@ -1008,25 +1830,18 @@ def process_merchant_application():
             return jsonify({"error": "Invalid file type for photo"}), 400
         
         # This logic is similar to update_profile
-        os.makedirs(USER_IMAGE_FOLDER, exist_ok=True)
-        extension = secure_filename(photo.filename).rsplit('.', 1)[1].lower()
-        new_filename = f"user_{user_id}.{extension}"
-        new_filepath = os.path.join(USER_IMAGE_FOLDER, new_filename)
-        img = Image.open(photo.stream)
-        img.thumbnail((200, 200))
-        img.save(new_filepath, quality=90)
-        user_to_upgrade['photo'] = f"/{USER_IMAGE_FOLDER}/{new_filename}".replace(os.path.sep, '/')
+        try:
+            user_to_upgrade['photo'] = _store_profile_photo(photo, user_id)
+        except images.ImageRejected as e:
+            return jsonify({"error": str(e)}), 400
 
     # Upgrade role and set initial rating
     user_to_upgrade['role'] = 'admin'
     user_to_upgrade['ratings_total'] = 5
     user_to_upgrade['ratings_count'] = 1
-    user_to_upgrade['reviews'] = []
 
     # Save the updated user list
-    users[user_index] = user_to_upgrade
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    save_user(user_to_upgrade)
 
     return jsonify({"message": "Congratulations! You are now a merchant.", "user": user_to_upgrade}), 200
 
@@ -1106,38 +1921,69 @@ def review_store(merchant_id):
     if not rating or not 1 <= rating <= 5:
         return jsonify({"error": "A valid rating between 1 and 5 is required."}), 400
 
-    all_users = get_all_users()
-    merchant_index = -1
-    for i, u in enumerate(all_users):
-        if u.get('id') == merchant_id and u.get('role') == 'admin':
-            merchant_index = i
-            break
+    with file_lock.locked(USERS_FILE):
+        all_users = get_all_users()
+        merchant_index = -1
+        for i, u in enumerate(all_users):
+            if u.get('id') == merchant_id and u.get('role') == 'admin':
+                merchant_index = i
+                break
     
-    if merchant_index == -1:
-        return jsonify({"error": "Merchant not found."}), 404
+        if merchant_index == -1:
+            return jsonify({"error": "Merchant not found."}), 404
 
-    if user_id == merchant_id:
-        return jsonify({"error": "You cannot review your own store."}), 403
+        if user_id == merchant_id:
+            return jsonify({"error": "You cannot review your own store."}), 403
 
-    merchant = all_users[merchant_index]
+        merchant = all_users[merchant_index]
     
-    merchant['ratings_total'] = merchant.get('ratings_total', 0) + rating
-    merchant['ratings_count'] = merchant.get('ratings_count', 0) + 1
+        merchant['ratings_total'] = merchant.get('ratings_total', 0) + rating
+        merchant['ratings_count'] = merchant.get('ratings_count', 0) + 1
     
-    comment = data.get('comment')
-    if comment:
-        merchant.setdefault('reviews', []).append({
-            "user_id": user_id, "comment": comment, "rating": rating,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        })
+        # Reviews are kept in their own store; only the aggregates live on the merchant.
+        reviews.migrate_embedded_reviews([merchant])
+        comment = data.get('comment')
+        if comment:
+            reviews.add_review(merchant_id, user_id, rating, comment)
 
-    all_users[merchant_index] = merchant
-    with open(USERS_FILE, 'w') as f:
-        json.dump(all_users, f, indent=4)
+        all_users[merchant_index] = merchant
+        save_users(all_users)
 
     new_avg_rating = round(merchant['ratings_total'] / merchant['ratings_count'], 2)
     return jsonify({"message": "Review submitted successfully!", "new_avg_rating": new_avg_rating, "new_ratings_count": merchant['ratings_count']}), 200
 
+@app.route('/api/store/<string:merchant_id>/reviews')
+def get_store_reviews(merchant_id):
+    """Paginated list of a merchant's reviews, newest first, for the store page."""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except (ValueError, TypeError):
+        page = 1
+        limit = 10
+
+    all_users = get_all_users()
+    merchant = next((u for u in all_users if u.get('id') == merchant_id and u.get('role') == 'admin'), None)
+    if not merchant:
+        return jsonify({"error": "Merchant not found."}), 404
+
+    page_reviews, total = reviews.get_reviews(merchant_id, (page - 1) * limit, limit)
+    user_map = {u['id']: u for u in all_users}
+    for review in page_reviews:
+        reviewer = user_map.get(review['user_id'], {})
+        review['user_name'] = reviewer.get('name', 'Former user')
+        review['user_photo'] = reviewer.get('photo')
+
+    ratings_count = merchant.get('ratings_count', 0)
+    return jsonify({
+        "reviews": page_reviews,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "avg_rating": round(merchant.get('ratings_total', 0) / ratings_count, 2) if ratings_count > 0 else 0,
+        "ratings_count": ratings_count
+    })
+
 @app.route('/product')
 def product_page():
     """Serves the product detail page shell. JS will fetch the data."""
@@ -1200,6 +2046,7 @@ def my_chats_page():
     user_map = {u['id']: u for u in users}
     user_convos_list = []
     all_user_conversations = {}
+    archive_segments = {}
 
     for key, convo_data in conversations.items():
         if key.startswith(f"{user_id}-"):
@@ -1212,7 +2059,8 @@ def my_chats_page():
             else: # Old format
                 messages = convo_data
             
-            all_user_conversations[key] = messages
+            all_user_conversations[key] = annotate_seen(key, convo_data, messages)
+            archive_segments[key] = chat_archive.latest_segment(convo_data)
 
             try:
                 _, admin_part_id = key.split('-')
@@ -1227,10 +2075,10 @@ def my_chats_page():
                 last_message = messages[-1]
                 clean_text = re.sub(r'<[^>]+>', ' ', last_message.get('text', 'No messages yet.')).strip()
                 last_message_time = last_message.get('timestamp')
-                unread_count = sum(1 for msg in messages if msg.get('sender') == 'admin' and not msg.get('seen'))
+                unread_count = count_unread(key, convo_data, messages, user_id, 'admin')
             else:
                 clean_text = "Start the conversation!"
-                last_message_time = datetime.now(timezone.utc).isoformat()
+                last_message_time = chat_archive.archived_until(convo_data) or datetime.now(timezone.utc).isoformat()
                 unread_count = 0
 
             user_convos_list.append({
@@ -1244,7 +2092,7 @@ def my_chats_page():
             })
     user_convos_list.sort(key=lambda x: x['last_message_time'] or '', reverse=True)
     _, total_unread_count = get_user_and_unread_count(session)
-    return render_template('my_chats.html', user=current_user, total_unread_count=total_unread_count, convo_list=user_convos_list, all_conversations=all_user_conversations)
+    return render_template('my_chats.html', user=current_user, total_unread_count=total_unread_count, convo_list=user_convos_list, all_conversations=all_user_conversations, archive_segments=archive_segments)
 
 @app.route('/saved')
 def saved_items_page():
@@ -1276,14 +2124,153 @@ def settings_page():
     # The template handles conditional display of user-specific content.
     return render_template('settings.html', user=current_user, total_unread_count=total_unread_count)
 
-if __name__ == '__main__':
+# --- Image serving ---
+# Product images and profile photos are served from blob_storage by key. The
+# worker only validates the key; the bytes are sent by someone else:
+#   IMAGE_SERVE_MODE=direct (default)  send_file with conditional/range support
+#                                      (local storage), or a redirect to the
+#                                      object's URL (S3 storage)
+#   IMAGE_SERVE_MODE=x-accel-redirect  nginx sends the file (or proxies the bucket):
+#       location /protected-images/ { internal; alias /srv/shop/static/images/; }
+#   IMAGE_SERVE_MODE=x-sendfile        Apache mod_xsendfile / lighttpd send the file
+# The proxy then also handles Range and conditional requests.
+IMAGE_SERVE_MODE = os.environ.get('IMAGE_SERVE_MODE', 'direct')
+IMAGE_ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX', '/protected-images/')
+
+@app.route(IMAGE_URL_PREFIX + '<path:key>')
+def serve_image(key):
+    """Serves a stored image (takes precedence over the static folder for /static/images/)."""
+    if not blob_storage.valid_key(key):
+        return jsonify({"error": "Image not found"}), 404
+    storage = blob_storage.get_storage()
+    cache_control = blob_storage.cache_control(key)
+
+    if IMAGE_SERVE_MODE == 'x-accel-redirect':
+        response = Response(content_type=blob_storage.content_type(key))
+        response.headers['X-Accel-Redirect'] = IMAGE_ACCEL_PREFIX + key
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    url = storage.url(key)
+    if url is not None:
+        return redirect(url, code=302)
+
+    path = storage.path(key)
+    if not os.path.isfile(path):
+        return jsonify({"error": "Image not found"}), 404
+    if IMAGE_SERVE_MODE == 'x-sendfile':
+        response = Response(content_type=blob_storage.content_type(key))
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        response = send_file(os.path.abspath(path), mimetype=blob_storage.content_type(key), conditional=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+# --- Background tasks ---
+# Started by the servers (serve.py workers and `python app.py`), not on import,
+# so tests, benchmarks and the CLIs that import this module run no loops in
+# whatever directory they happen to be in.
+WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', 'true').lower() in ('true', '1', 't')
+if not WARM_UP_ON_START:
+    snapshots.skip_warm_up()
+_background = {'started': False}
+
+def start_background_tasks():
+    """Starts a serving worker's periodic tasks (once)."""
+    if _background['started']:
+        return
+    _background['started'] = True
+    # Stored product images no product references any more are deleted in the background.
+    if image_store.IMAGE_GC_INTERVAL_SECONDS > 0:
+        socketio.start_background_task(image_store.run_collector, socketio.sleep)
+    # Buffered rollup increments are written every FLUSH_INTERVAL_SECONDS, even when no new events arrive.
+    socketio.start_background_task(analytics.run_flusher, socketio.sleep)
+    # Every worker reloads its ranking from the shared analytics rollups, so it covers all workers' events.
+    if trending.TRENDING_REFRESH_SECONDS > 0:
+        socketio.start_background_task(trending.run_refresher, socketio.sleep)
+    # Each worker loads (or builds) its catalog indexes as soon as it starts,
+    # and keeps a snapshot of them on disk for the next start.
+    if WARM_UP_ON_START:
+        socketio.start_background_task(snapshots.run, app, get_conversations, socketio.sleep)
+
+# --- Readiness ---
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: 503 until this worker has loaded or built its in-memory catalog."""
+    ready, details = snapshots.readiness()
+    return jsonify(details), 200 if ready else 503
+
+# --- Metrics ---
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint (needs the bearer METRICS_TOKEN)."""
+    if not metrics.METRICS_TOKEN:
+        return jsonify({"error": "Metrics are disabled; set METRICS_TOKEN"}), 404
+    if not metrics.scrape_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Profiling ---
+def _require_main_admin_json():
+    """Returns an error response unless the session belongs to the main admin."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    current_user = next((u for u in get_all_users() if u.get('id') == user_id), None)
+    if not current_user or current_user.get('email') != os.environ.get('MAIN_ADMIN_EMAIL'):
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """Lists captured request profiles (main admin only)."""
+    error = _require_main_admin_json()
+    if error:
+        return error
+    return render_template('admin_profiles.html', records=profiling.list_records(),
+                           enabled=profiling.enabled(), sample_rate=profiling.PROFILE_SAMPLE_RATE,
+                           slow_ms=profiling.PROFILE_SLOW_MS, shared_thread=profiling.shared_thread())
+
+@app.route('/api/admin/profiles/<string:record_id>')
+def get_profile(record_id):
+    """Returns one captured profile with its top functions."""
+    error = _require_main_admin_json()
+    if error:
+        return error
+    record = profiling.load_record(record_id)
+    if record is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(record)
+
+@app.route('/api/admin/profiles/<string:record_id>/download')
+def download_profile(record_id):
+    """Sends the raw cProfile data of a record (open with pstats or snakeviz)."""
+    error = _require_main_admin_json()
+    if error:
+        return error
+    path = profiling.profile_path(record_id)
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{record_id}.prof")
+
+def prepare_data_files():
+    """Creates missing data files and runs data migrations; safe to run in every worker."""
     # Ensure the users.json file exists and is a valid JSON array
-    if not os.path.isfile(USERS_FILE):
-        with open(USERS_FILE, 'w') as f:
-            json.dump([], f)
-    if not os.path.isfile(CONVERSATIONS_FILE):
-        with open(CONVERSATIONS_FILE, 'w') as f:
-            json.dump({}, f)
+    with file_lock.locked(USERS_FILE):
+        if not os.path.isfile(USERS_FILE):
+            with open(USERS_FILE, 'w') as f:
+                json.dump([], f)
+        # Move reviews still embedded in merchant records into the review store.
+        users = get_all_users()
+        if reviews.migrate_embedded_reviews(users):
+            save_users(users)
+    with file_lock.locked(CONVERSATIONS_FILE):
+        if not os.path.isfile(CONVERSATIONS_FILE):
+            with open(CONVERSATIONS_FILE, 'w') as f:
+                json.dump({}, f)
+
+if __name__ == '__main__':
+    prepare_data_files()
 
     # A note on "massive database":
     # For a small project, a JSON file is fine. For a truly "massive"
@@ -1296,12 +2283,14 @@ if __name__ == '__main__':
     # Set to True for development (enables auto-reload and detailed errors).
     # For production, this should be False. You can set an environment variable
     # on your server to control this. For local dev, you can set it to True.
-    # Example: IS_DEBUG_MODE = os.environ.get('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
-    IS_DEBUG_MODE = True # Set to True for local development
+    # `python app.py` is the development server; production runs serve.py.
+    IS_DEBUG_MODE = os.environ.get('FLASK_DEBUG', 'True').lower() in ('true', '1', 't')
 
     # With eventlet installed, socketio.run() will automatically use it as a
     # production-ready server when debug is False. 
     # For development, we let Socket.IO handle the reloader to avoid conflicts.
     # For production (`IS_DEBUG_MODE = False`), it will run without the reloader.
+    if not IS_DEBUG_MODE or os.environ.get('WERKZEUG_RUN_MAIN') == 'true': # Not in the reloader's watcher process
+        start_background_tasks()
     print(f"--- Starting server in {'DEBUG' if IS_DEBUG_MODE else 'PRODUCTION'} mode on http://0.0.0.0:5001 ---")
     socketio.run(app, host='0.0.0.0', port=5001, use_reloader=IS_DEBUG_MODE)
\ No newline at end of file
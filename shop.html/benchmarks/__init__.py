@@ -0,0 +1,10 @@
+# Benchmarks for the shop. Run from the shop.html directory:
+#
+#   python -m benchmarks.generate --products 10000 --out /tmp/shop-data
+#   python -m benchmarks.run --sizes 1000,10000,50000 --output report.json
+#   python -m benchmarks.chat_load --clients 200 --output chat-report.json
+#
+# chat_load also needs the Socket.IO client extras: pip install "python-socketio[client]"
+#
+# Everything runs against generated data in a scratch directory; the real
+# static/ files are never touched.
@@ -0,0 +1,360 @@
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+import socketio
+
+from benchmarks import generate
+from benchmarks.run import SHOP_DIR, percentile
+
+# Chat load test: many authenticated Socket.IO clients exchanging messages
+# across many conversations, measuring how long each message takes from
+# 'new_message' to the 'receive_message' events it causes (at the other party,
+# echoed back to the sender, and the copy sent to the main admin), and how many
+# accepted messages never arrive.
+#
+# By default a server is started on a generated dataset with the chat rate
+# limits lifted, so the numbers describe the ingest path rather than the
+# limiter; --keep-rate-limits measures with the configured limits instead, and
+# rejected messages are then counted under 'slow_down'. To load a server that
+# is already running, pass --url and the --data directory it was started on
+# (the generator's manifest provides the accounts).
+#
+# All clients live in this one process, so at high rates client-side overhead
+# shows up in the latencies too; compare reports made on the same machine.
+#
+#   python -m benchmarks.chat_load --clients 200 --messages 50 --output chat-report.json
+
+TEXT_PREFIX = 'bench-msg'
+SERVER_START_TIMEOUT = 60
+
+def _login(base_url, email, password):
+    """Logs in over HTTP and returns the Cookie header for the session."""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    request = urllib.request.Request(f"{base_url}/login", data=json.dumps({"email": email, "password": password}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    opener.open(request, timeout=30).close()
+    return '; '.join(f"{cookie.name}={cookie.value}" for cookie in jar)
+
+def _summarize(latencies, expected):
+    latencies = sorted(latencies)
+    summary = {"expected": expected, "received": len(latencies), "lost": expected - len(latencies),
+               "loss_rate": round((expected - len(latencies)) / expected, 4) if expected else 0.0}
+    if latencies:
+        summary.update({
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        })
+    return summary
+
+class LoadTest:
+    """Tracks sent messages and the deliveries they are expected to produce."""
+
+    def __init__(self, main_admin_email):
+        self.main_admin_email = main_admin_email
+        self.lock = threading.Lock()
+        self.sent = {}          # seq -> (sent at, {email: role} still expected)
+        self.latencies = {"recipient": [], "echo": [], "main_admin": []}
+        self.expected = {"recipient": 0, "echo": 0, "main_admin": 0}
+        self.slow_down = {}
+        self.duplicates = 0
+        self.unexpected = 0
+        self.send_errors = 0
+        self.last_seq = 0
+
+    def next_seq(self):
+        with self.lock:
+            self.last_seq += 1
+            return self.last_seq
+
+    def record_send(self, seq, sender_email, recipient_email):
+        waiting = {recipient_email: 'recipient', sender_email: 'echo'}
+        if self.main_admin_email:
+            waiting.setdefault(self.main_admin_email, 'main_admin')
+        with self.lock:
+            self.sent[seq] = (time.perf_counter(), waiting)
+            for role in waiting.values():
+                self.expected[role] += 1
+
+    def record_receive(self, email, message):
+        received_at = time.perf_counter()
+        seq = _sequence_number(message.get('text'))
+        if seq is None:
+            return # Not ours (e.g. another conversation's traffic on a shared server)
+        with self.lock:
+            entry = self.sent.get(seq)
+            if entry is None:
+                self.unexpected += 1
+                return
+            sent_at, waiting = entry
+            role = waiting.pop(email, None)
+            if role is None:
+                self.duplicates += 1
+                return
+            self.latencies[role].append(received_at - sent_at)
+
+    def record_slow_down(self, data):
+        seq = _sequence_number(data.get('text'))
+        with self.lock:
+            self.slow_down[data.get('scope')] = self.slow_down.get(data.get('scope'), 0) + 1
+            entry = self.sent.pop(seq, None)
+            if entry:
+                # Not accepted, so nothing will be delivered for it.
+                for role in entry[1].values():
+                    self.expected[role] -= 1
+
+    def record_send_error(self, seq):
+        with self.lock:
+            self.send_errors += 1
+            for role in self.sent.pop(seq)[1].values():
+                self.expected[role] -= 1
+
+    def outstanding(self):
+        with self.lock:
+            return sum(len(waiting) for _, waiting in self.sent.values())
+
+    def report(self):
+        with self.lock:
+            delivery = {role: _summarize(self.latencies[role], self.expected[role]) for role in self.latencies}
+            return {
+                "sent": len(self.sent) + sum(self.slow_down.values()) + self.send_errors,
+                "accepted": len(self.sent),
+                "send_errors": self.send_errors,
+                "slow_down": dict(self.slow_down),
+                "duplicates": self.duplicates,
+                "unexpected": self.unexpected,
+                "delivery": delivery,
+            }
+
+def _sequence_number(text):
+    parts = (text or '').split(' ', 2)
+    if len(parts) < 2 or parts[0] != TEXT_PREFIX or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+def _connect_client(base_url, email, password, load_test, transports):
+    client = socketio.Client(reconnection=False)
+    client.on('receive_message', lambda message: load_test.record_receive(email, message))
+    client.on('slow_down', load_test.record_slow_down)
+    started = time.perf_counter()
+    client.connect(base_url, headers={'Cookie': _login(base_url, email, password)}, transports=transports)
+    return client, time.perf_counter() - started
+
+def _conversation_sender(pair, clients, load_test, messages, rate, message_size, start_event, rng):
+    """Sends `messages` messages in one conversation, alternating sides, at `rate` per second."""
+    filler = 'x' * message_size
+    interval = 1.0 / rate if rate > 0 else 0
+    start_event.wait()
+    time.sleep(rng.uniform(0, interval)) # Spread conversations over the first interval
+    next_send = time.perf_counter()
+    for i in range(messages):
+        sender, recipient = ((pair['user_email'], pair['merchant_email']) if i % 2 == 0
+                             else (pair['merchant_email'], pair['user_email']))
+        seq = load_test.next_seq()
+        load_test.record_send(seq, sender, recipient)
+        try:
+            clients[sender].emit('new_message', {"conversation_id": pair['key'], "text": f"{TEXT_PREFIX} {seq} {filler}"})
+        except Exception:
+            load_test.record_send_error(seq)
+        next_send += interval
+        time.sleep(max(0.0, next_send - time.perf_counter()))
+
+def _start_server(data_dir, port, keep_rate_limits):
+    """Starts the app on a dataset directory in a subprocess; returns the process once it answers."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SHOP_DIR, os.environ.get('PYTHONPATH')])))
+    if not keep_rate_limits:
+        env.update(CHAT_USER_RATE='100000', CHAT_USER_BURST='100000',
+                   CHAT_CONVERSATION_RATE='100000', CHAT_CONVERSATION_BURST='100000',
+                   CHAT_INGEST_QUEUE_SIZE='1000000')
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.chat_load', '--serve', str(port)],
+                               cwd=data_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited: {process.stderr.read().strip()[-2000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2).close()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.25)
+    process.kill()
+    raise RuntimeError('server did not start in time')
+
+def _serve(port):
+    """Runs the app from the current directory (the dataset) until killed."""
+    with open(os.path.join('static', generate.MANIFEST_FILE), encoding='utf-8') as f:
+        os.environ['MAIN_ADMIN_EMAIL'] = json.load(f)['main_admin_email']
+    import app as shop_app
+    shop_app.socketio.run(shop_app.app, host='127.0.0.1', port=port, use_reloader=False,
+                          log_output=False, allow_unsafe_werkzeug=True)
+
+def run_load_test(base_url, manifest, clients, messages, rate, message_size, drain_timeout,
+                  include_main_admin=True, transports=None, seed=1):
+    """Connects the clients, runs the conversations and returns the report dict."""
+    rng = random.Random(seed)
+    pairs = []
+    emails = set()
+    for pair in manifest['conversation_pairs']:
+        new_emails = {pair['user_email'], pair['merchant_email']} - emails
+        if len(emails) + len(new_emails) > clients:
+            continue
+        emails |= new_emails
+        pairs.append(pair)
+    if not pairs:
+        raise RuntimeError('the dataset has no conversations to load')
+
+    load_test = LoadTest(manifest['main_admin_email'] if include_main_admin else None)
+    if include_main_admin:
+        emails.add(manifest['main_admin_email'])
+    connected = {}
+    connect_times = []
+    connect_errors = 0
+    for email in sorted(emails):
+        try:
+            client, elapsed = _connect_client(base_url, email, manifest['password'], load_test, transports)
+        except Exception as e:
+            connect_errors += 1
+            print(f"  could not connect {email}: {e}", file=sys.stderr)
+            continue
+        connected[email] = client
+        connect_times.append(elapsed)
+    pairs = [pair for pair in pairs if pair['user_email'] in connected and pair['merchant_email'] in connected]
+    if load_test.main_admin_email not in connected:
+        load_test.main_admin_email = None
+
+    start_event = threading.Event()
+    senders = [threading.Thread(target=_conversation_sender, daemon=True,
+                                args=(pair, connected, load_test, messages, rate, message_size,
+                                      start_event, random.Random(rng.random())))
+               for pair in pairs]
+    for sender in senders:
+        sender.start()
+    started = time.perf_counter()
+    start_event.set()
+    for sender in senders:
+        sender.join()
+    sending_seconds = time.perf_counter() - started
+
+    deadline = time.perf_counter() + drain_timeout
+    while load_test.outstanding() and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    total_seconds = time.perf_counter() - started
+
+    for client in connected.values():
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+    report = load_test.report()
+    connect_times.sort()
+    report.update({
+        "clients": len(connected),
+        "conversations": len(pairs),
+        "connect": {
+            "failed": connect_errors,
+            "p50_ms": round(percentile(connect_times, 0.50) * 1000, 2) if connect_times else None,
+            "p99_ms": round(percentile(connect_times, 0.99) * 1000, 2) if connect_times else None,
+        },
+        "sending_seconds": round(sending_seconds, 2),
+        "total_seconds": round(total_seconds, 2),
+        "accepted_per_second": round(report['accepted'] / sending_seconds, 1) if sending_seconds else None,
+    })
+    return report
+
+def format_summary(report):
+    lines = [f"{report['clients']} clients, {report['conversations']} conversations: "
+             f"{report['accepted']} of {report['sent']} messages accepted in {report['sending_seconds']}s "
+             f"({report['accepted_per_second']}/s), slow_down {report['slow_down'] or 0}"]
+    lines.append(f"{'delivery':<12}{'expected':>10}{'lost':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for role, summary in report['delivery'].items():
+        if not summary['expected']:
+            continue
+        lines.append(f"{role:<12}{summary['expected']:>10}{summary['lost']:>8}"
+                     + ''.join(f"{summary.get(key, float('nan')):>10.1f}" for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test chat delivery over Socket.IO.')
+    parser.add_argument('--clients', type=int, default=100, help='Maximum number of connected users (plus the main admin).')
+    parser.add_argument('--messages', type=int, default=20, help='Messages sent in each conversation.')
+    parser.add_argument('--rate', type=float, default=1.0, help='Messages per second in each conversation.')
+    parser.add_argument('--message-size', type=int, default=80, help='Characters of filler text per message.')
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help='Seconds to wait for outstanding deliveries before counting them as lost.')
+    parser.add_argument('--no-main-admin', action='store_true', help='Do not connect the main admin.')
+    parser.add_argument('--transport', choices=['websocket', 'polling'], help='Force one Socket.IO transport.')
+    parser.add_argument('--url', help='Load an already running server instead of starting one.')
+    parser.add_argument('--data', help='Dataset directory (from benchmarks.generate) the server uses.')
+    parser.add_argument('--port', type=int, default=5055, help='Port for the server started by the test.')
+    parser.add_argument('--keep-rate-limits', action='store_true', help='Start the server with its configured chat rate limits.')
+    parser.add_argument('--users', type=int, default=400, help='Shoppers in the generated dataset.')
+    parser.add_argument('--merchants', type=int, default=40, help='Merchants in the generated dataset.')
+    parser.add_argument('--conversations', type=int, default=400, help='Conversations in the generated dataset.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here.')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        _serve(args.serve)
+        return 0
+    if args.url and not args.data:
+        parser.error('--url needs --data, the dataset directory the server was started with')
+
+    data_dir = args.data
+    server = None
+    try:
+        if not data_dir:
+            data_dir = tempfile.mkdtemp(prefix='shop-chat-load-')
+            print("Generating dataset...", file=sys.stderr)
+            generate.generate(data_dir, products=200, merchants=args.merchants, users=args.users,
+                              conversations=args.conversations, messages_per_conversation=10, seed=args.seed)
+        with open(os.path.join(data_dir, 'static', generate.MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        base_url = args.url
+        if not base_url:
+            print(f"Starting server on port {args.port}...", file=sys.stderr)
+            server = _start_server(data_dir, args.port, args.keep_rate_limits)
+            base_url = f"http://127.0.0.1:{args.port}"
+
+        report = run_load_test(base_url, manifest, args.clients, args.messages, args.rate, args.message_size,
+                               args.drain_timeout, include_main_admin=not args.no_main_admin,
+                               transports=[args.transport] if args.transport else None, seed=args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if data_dir and not args.data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report.update({
+        "created": datetime.now(timezone.utc).isoformat(),
+        "config": {"clients": args.clients, "messages": args.messages, "rate": args.rate,
+                   "message_size": args.message_size, "transport": args.transport or 'default',
+                   "rate_limits": args.keep_rate_limits or bool(args.url), "seed": args.seed},
+    })
+    print(format_summary(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    lost = sum(summary['lost'] for summary in report['delivery'].values())
+    return 0 if not lost else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import password_hashing
+
+# Seeded generator for a synthetic marketplace: merchants, shoppers, products
+# and chat conversations with roughly the shapes and sizes real data has.
+# Merchant catalog sizes are skewed (a few big stores, many small ones), and
+# so is the number of conversations per shopper. The same seed and counts
+# always produce the same data.
+
+MAIN_ADMIN_EMAIL = 'main@bench.local'
+PASSWORD = 'benchmark'
+MANIFEST_FILE = 'benchmark_manifest.json'
+
+CATEGORIES = ['Phone', 'Laptop', 'Dress', 'Sneakers', 'Sofa', 'Television', 'Watch', 'Headphones',
+              'Car', 'Apartment', 'Perfume', 'Bag', 'Camera', 'Bicycle', 'Fridge', 'Tablet']
+CITIES = ['Douala', 'Yaounde', 'Bafoussam', 'Garoua', 'Bamenda', 'Maroua', 'Kribi', 'Limbe', 'Buea', 'Ebolowa']
+WORDS = ('new used original quality fast delivery warranty black white red blue large small premium cheap '
+         'genuine leather cotton wireless smart portable modern classic vintage stylish durable light heavy '
+         'battery screen camera memory storage comfortable elegant family business student gift offer sale '
+         'brand local imported clean perfect condition price negotiable contact available today stock').split()
+
+def _sentence(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+def _skewed_index(rng, count):
+    """Picks an index in [0, count) with a long-tailed distribution (low indexes are popular)."""
+    return min(int(rng.paretovariate(1.2)) - 1, count - 1)
+
+def generate(directory, products=1000, merchants=20, users=200, conversations=100,
+             messages_per_conversation=30, seed=1):
+    """Writes products.json, users.json and conversations.json under directory/static.
+
+    Returns the manifest (also written to static/benchmark_manifest.json) that
+    lists the ids and credentials benchmark scenarios need.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    static_dir = os.path.join(directory, 'static')
+    os.makedirs(static_dir, exist_ok=True)
+    # One hash shared by every account: hashing is deliberately slow.
+    password_hash = password_hashing.hash_password(PASSWORD)
+
+    all_users = [{
+        "id": f"{1:09d}", "name": "Customer Service", "email": MAIN_ADMIN_EMAIL, "number": "600000000",
+        "location": CITIES[0], "password": password_hash, "photo": None, "role": "admin",
+        "ratings_total": 5, "ratings_count": 1
+    }]
+    for i in range(merchants):
+        ratings_count = rng.randint(1, 400)
+        all_users.append({
+            "id": f"{len(all_users) + 1:09d}", "name": f"{rng.choice(WORDS).title()} {rng.choice(CATEGORIES)} Store",
+            "email": f"merchant{i}@bench.local", "number": f"6{rng.randint(10000000, 99999999)}",
+            "location": rng.choice(CITIES), "password": password_hash, "photo": None, "role": "admin",
+            "ratings_total": sum(rng.randint(3, 5) for _ in range(ratings_count)), "ratings_count": ratings_count
+        })
+    merchant_ids = [user['id'] for user in all_users[1:]] or [all_users[0]['id']]
+    for i in range(users):
+        all_users.append({
+            "id": f"{len(all_users) + 1:09d}", "name": f"Shopper {i}", "email": f"user{i}@bench.local",
+            "number": f"6{rng.randint(10000000, 99999999)}", "location": rng.choice(CITIES),
+            "password": password_hash, "photo": None, "role": "normal"
+        })
+    shopper_ids = [user['id'] for user in all_users[1 + merchants:]]
+
+    parks = []
+    start = now - timedelta(days=730)
+    for i in range(products):
+        product_id = f"{i + 1:06d}"
+        extensions = [rng.choice(['jpg', 'jpeg', 'png']) for _ in range(rng.randint(2, 4))]
+        parks.append({
+            "id": product_id,
+            "name": f"{_sentence(rng, 1, 3).title()} {rng.choice(CATEGORIES)}",
+            "location": rng.choice(CITIES),
+            "price": f"{rng.randint(1, 2000) * 500:,}".replace(',', ' '),
+            "description": _sentence(rng, 30, 120),
+            "date_added": (start + timedelta(seconds=730 * 86400 * i / max(products, 1))).isoformat(),
+            "web_details": _sentence(rng, 5, 20) if rng.random() < 0.3 else None,
+            "type": rng.choice(CATEGORIES),
+            "image_filenames": [f"{product_id}_{n + 1}.{ext}" for n, ext in enumerate(extensions)],
+            "link1": None,
+            "link2": None,
+            "admin_id": merchant_ids[_skewed_index(rng, len(merchant_ids))],
+            "views": int(rng.paretovariate(1.1) * 10),
+            "inquiries": int(rng.paretovariate(1.5)),
+            "home_delivery": rng.random() < 0.4
+        })
+
+    all_conversations = {}
+    attempts = 0
+    while shopper_ids and len(all_conversations) < conversations and attempts < conversations * 20:
+        attempts += 1 # Skewed picks repeat pairs; give up rather than loop on a saturated set.
+        shopper_id = shopper_ids[_skewed_index(rng, len(shopper_ids))]
+        merchant_id = merchant_ids[_skewed_index(rng, len(merchant_ids))]
+        key = f"{shopper_id}-{merchant_id}"
+        if key in all_conversations:
+            continue
+        count = max(1, int(rng.lognormvariate(0, 0.8) * messages_per_conversation))
+        # Recent enough that none of it is due for archival.
+        timestamp = now - timedelta(days=rng.uniform(0, 30))
+        messages = []
+        for _ in range(count):
+            timestamp += timedelta(seconds=rng.randint(5, 3600))
+            if parks and rng.random() < 0.05:
+                park = parks[rng.randrange(len(parks))]
+                text = f'<a href="/product?id={park["id"]}">{park["name"]}</a>'
+            else:
+                text = _sentence(rng, 2, 30)
+            messages.append({
+                "sender": rng.choice(['user', 'admin']), "text": text,
+                "timestamp": timestamp.isoformat(), "seen": False, "conversation_id": key
+            })
+        last_seen = messages[rng.randrange(len(messages))]['timestamp']
+        all_conversations[key] = {"messages": messages, "deleted_by": [],
+                                  "last_seen": {shopper_id: last_seen, merchant_id: last_seen}}
+
+    chats_per_shopper = {}
+    for key in all_conversations:
+        shopper_id = key.split('-')[0]
+        chats_per_shopper[shopper_id] = chats_per_shopper.get(shopper_id, 0) + 1
+    products_per_merchant = {}
+    for park in parks:
+        products_per_merchant[park['admin_id']] = products_per_merchant.get(park['admin_id'], 0) + 1
+    user_emails = {user['id']: user['email'] for user in all_users}
+
+    manifest = {
+        "seed": seed,
+        "counts": {"products": len(parks), "merchants": merchants, "users": users,
+                   "conversations": len(all_conversations),
+                   "messages": sum(len(c['messages']) for c in all_conversations.values())},
+        "password": PASSWORD,
+        "main_admin_email": MAIN_ADMIN_EMAIL,
+        "busiest_shopper_email": user_emails.get(max(chats_per_shopper, key=chats_per_shopper.get)) if chats_per_shopper else None,
+        "largest_merchant_id": max(products_per_merchant, key=products_per_merchant.get) if products_per_merchant else None,
+        "sample_product_ids": [parks[rng.randrange(len(parks))]['id'] for _ in range(100)] if parks else [],
+        "sample_merchant_ids": [merchant_ids[_skewed_index(rng, len(merchant_ids))] for _ in range(100)],
+        "search_terms": [rng.choice(WORDS + [c.lower() for c in CATEGORIES]) for _ in range(100)],
+        "conversation_pairs": [
+            {"key": key, "user_email": user_emails[key.split('-')[0]], "merchant_email": user_emails[key.split('-')[1]]}
+            for key in all_conversations
+        ]
+    }
+
+    for filename, data in (('products.json', parks), ('users.json', all_users),
+                           ('conversations.json', all_conversations), (MANIFEST_FILE, manifest)):
+        with open(os.path.join(static_dir, filename), 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic marketplace dataset.')
+    parser.add_argument('--out', required=True, help='Directory to write static/*.json into.')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--merchants', type=int, default=20)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=30, help='Typical messages per conversation.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    manifest = generate(args.out, args.products, args.merchants, args.users, args.conversations,
+                        args.messages, args.seed)
+    print(json.dumps(manifest['counts']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks import generate
+
+# Endpoint benchmarks over generated datasets of increasing size.
+#
+# For every dataset size the data is generated once into a scratch directory;
+# then each endpoint is measured in its own subprocess, so its peak RSS is not
+# inflated by the endpoints measured before it and module-level caches start
+# cold. Requests go through Flask's test client in-process (no network), one at
+# a time, which isolates the application's own cost.
+#
+#   python -m benchmarks.run --sizes 1000,10000,50000 --output report.json
+#   python -m benchmarks.run --sizes 10000 --baseline report.json   # compare with an earlier run
+
+SHOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (login as, request path builder). Paths are built from the manifest
+# of the generated dataset; `i` is the request number.
+ENDPOINTS = {
+    'products': (None, lambda m, i: f"/api/products?page={i % 5 + 1}&limit=50"),
+    'filter': (None, lambda m, i: f"/api/products/filter?type={generate.CATEGORIES[i % len(generate.CATEGORIES)]}"
+                         f"&sort={('newest', 'price_asc', 'popular')[i % 3]}&page={i % 5 + 1}&limit=50"),
+    'search': (None, lambda m, i: f"/api/search?q={m['search_terms'][i % len(m['search_terms'])]}"),
+    'product_page': (None, lambda m, i: f"/api/product-page/{m['sample_product_ids'][i % len(m['sample_product_ids'])]}"),
+    'store': (None, lambda m, i: f"/store?id={m['sample_merchant_ids'][i % len(m['sample_merchant_ids'])]}"),
+    'admin_chat': ('main_admin_email', lambda m, i: "/admin/chat"),
+    'my_chats': ('busiest_shopper_email', lambda m, i: "/my-chats"),
+}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def measure_endpoint(data_dir, endpoint, requests, warmup):
+    """Runs one endpoint's benchmark in this process (cwd must be the dataset directory)."""
+    with open(os.path.join('static', generate.MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    os.environ['MAIN_ADMIN_EMAIL'] = manifest['main_admin_email']
+    os.environ['WARM_UP_ON_START'] = 'false' # The warm-up requests below play that part, without a competing thread.
+    rss_before_import = _peak_rss_mb()
+    import app as shop_app # Imported here: it reads its configuration and data relative to the cwd.
+
+    login_as, build_path = ENDPOINTS[endpoint]
+    client = shop_app.app.test_client()
+    if login_as:
+        email = manifest[login_as]
+        if not email:
+            return {"skipped": f"dataset has no {login_as}"}
+        response = client.post('/login', json={"email": email, "password": manifest['password']})
+        if response.status_code != 200:
+            return {"skipped": f"login failed with {response.status_code}"}
+
+    for i in range(warmup):
+        client.get(build_path(manifest, i)).close()
+    rss_baseline = _peak_rss_mb()
+
+    latencies = []
+    status_codes = {}
+    response_bytes = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        request_started = time.perf_counter()
+        response = client.get(build_path(manifest, warmup + i))
+        body = response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        response.close()
+        status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+        response_bytes += len(body)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_growth_mb": round(_peak_rss_mb() - max(rss_baseline, rss_before_import), 1),
+        "mean_response_kb": round(response_bytes / requests / 1024, 1),
+        "status_codes": status_codes,
+    }
+
+def _run_worker(data_dir, endpoint, requests, warmup):
+    """Measures one endpoint in a fresh interpreter and returns its result dict."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SHOP_DIR, os.environ.get('PYTHONPATH')])))
+    completed = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.run', '--worker', endpoint,
+         '--requests', str(requests), '--warmup', str(warmup)],
+        cwd=data_dir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "worker failed"}
+    # The app prints warnings at import; the result is the last line.
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run(sizes, endpoints, requests, warmup, ratios, messages, seed, keep_data=False):
+    """Generates each dataset size and benchmarks every endpoint against it."""
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "requests": requests,
+        "runs": []
+    }
+    for size in sizes:
+        data_dir = tempfile.mkdtemp(prefix=f'shop-bench-{size}-')
+        counts = {name: max(1, int(size * ratio)) for name, ratio in ratios.items()}
+        print(f"Generating {size} products, {counts}...", file=sys.stderr)
+        manifest = generate.generate(data_dir, products=size, messages_per_conversation=messages, seed=seed, **counts)
+        run_result = {"size": size, "counts": manifest['counts'], "endpoints": {}}
+        for endpoint in endpoints:
+            print(f"  {endpoint}...", file=sys.stderr)
+            run_result['endpoints'][endpoint] = _run_worker(data_dir, endpoint, requests, warmup)
+        report['runs'].append(run_result)
+        if not keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return report
+
+def format_table(report, baseline=None):
+    """Renders p50/p99/throughput/RSS per endpoint and size, with growth from the smallest size."""
+    lines = []
+    endpoints = sorted({name for run_result in report['runs'] for name in run_result['endpoints']})
+    baseline_runs = {run_result['size']: run_result for run_result in (baseline or {}).get('runs', [])}
+    header = f"{'endpoint':<14}{'products':>10}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'RSS MB':>9}{'p50 x':>8}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    lines.append(header)
+    for endpoint in endpoints:
+        first_p50 = None
+        for run_result in report['runs']:
+            result = run_result['endpoints'].get(endpoint, {})
+            if 'p50_ms' not in result:
+                lines.append(f"{endpoint:<14}{run_result['size']:>10}  {result.get('error') or result.get('skipped')}")
+                continue
+            first_p50 = first_p50 or result['p50_ms']
+            line = (f"{endpoint:<14}{run_result['size']:>10}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                    f"{result['throughput_rps']:>10.1f}{result['peak_rss_mb']:>9.1f}"
+                    f"{result['p50_ms'] / first_p50 if first_p50 else 0:>8.1f}")
+            base = baseline_runs.get(run_result['size'], {}).get('endpoints', {}).get(endpoint, {})
+            if baseline and base.get('p50_ms'):
+                line += f"{(result['p50_ms'] / base['p50_ms'] - 1) * 100:>+9.0f}%"
+            lines.append(line)
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark shop endpoints over synthetic datasets.')
+    parser.add_argument('--sizes', default='1000,10000', help='Comma-separated product counts.')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f'Subset of: {", ".join(ENDPOINTS)}.')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--merchant-ratio', type=float, default=0.02, help='Merchants per product.')
+    parser.add_argument('--user-ratio', type=float, default=0.2, help='Shoppers per product.')
+    parser.add_argument('--conversation-ratio', type=float, default=0.1, help='Conversations per product.')
+    parser.add_argument('--messages', type=int, default=30, help='Typical messages per conversation.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here.')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare p50 latencies against.')
+    parser.add_argument('--keep-data', action='store_true', help='Leave the generated datasets on disk.')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(measure_endpoint(os.getcwd(), args.worker, args.requests, args.warmup)))
+        return 0
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {unknown}")
+    ratios = {"merchants": args.merchant_ratio, "users": args.user_ratio, "conversations": args.conversation_ratio}
+    report = run([int(size) for size in args.sizes.split(',')], endpoints, args.requests, args.warmup,
+                 ratios, args.messages, args.seed, args.keep_data)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(format_table(report, baseline))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import mimetypes
+import os
+import shutil
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    # boto3 is only needed for IMAGE_STORAGE=s3.
+    boto3 = None
+    ClientError = None
+
+# Where image bytes live. Every image read and write (product images through
+# image_store, profile photos, the /static/images/ route) goes through
+# get_storage(), keyed by the path relative to the old static/images folder
+# ("store/ab/abcd....jpg", "users/user_7.jpg", "000123_1.jpg"), so existing
+# image URLs and stored filenames keep working.
+#
+#   IMAGE_STORAGE=local (default)  files under IMAGE_STORAGE_ROOT (static/images)
+#   IMAGE_STORAGE=s3               an S3 bucket shared by all nodes; set
+#                                  IMAGE_STORAGE_BUCKET, and IMAGE_STORAGE_ENDPOINT
+#                                  for an S3-compatible server such as MinIO.
+#                                  Credentials come from the usual AWS variables.
+#                                  Needs boto3 (pip install boto3).
+#
+# A local MinIO server, e.g. for a multi-node test setup:
+#
+#   docker run -d -p 9000:9000 -p 9001:9001 -e MINIO_ROOT_USER=shop \
+#       -e MINIO_ROOT_PASSWORD=change-me minio/minio server /data --console-address :9001
+#   mc alias set local http://localhost:9000 shop change-me && mc mb local/shop-images
+#
+#   IMAGE_STORAGE=s3 IMAGE_STORAGE_BUCKET=shop-images IMAGE_STORAGE_ENDPOINT=http://localhost:9000
+#   AWS_ACCESS_KEY_ID=shop AWS_SECRET_ACCESS_KEY=change-me AWS_DEFAULT_REGION=us-east-1
+#
+# The bucket stays private: without IMAGE_STORAGE_PUBLIC_URL clients get
+# presigned URLs, so the endpoint must be reachable from their browsers (or
+# proxied, see IMAGE_SERVE_MODE in app.py). Existing local images can be copied
+# over with `mc mirror --exclude '.uploads/*' static/images local/shop-images/images`.
+#
+# Serving is described in app.py (IMAGE_SERVE_MODE): the app only checks the
+# key and hands the bytes off to nginx/Apache, to S3, or to send_file.
+
+IMAGE_STORAGE = os.environ.get('IMAGE_STORAGE', 'local')
+IMAGE_STORAGE_ROOT = os.environ.get('IMAGE_STORAGE_ROOT', os.path.join('static', 'images'))
+IMAGE_STORAGE_BUCKET = os.environ.get('IMAGE_STORAGE_BUCKET')
+IMAGE_STORAGE_PREFIX = os.environ.get('IMAGE_STORAGE_PREFIX', 'images/')
+IMAGE_STORAGE_ENDPOINT = os.environ.get('IMAGE_STORAGE_ENDPOINT')          # e.g. http://minio:9000
+IMAGE_STORAGE_PUBLIC_URL = os.environ.get('IMAGE_STORAGE_PUBLIC_URL')      # CDN or public bucket URL, if any
+PRESIGNED_URL_SECONDS = int(os.environ.get('IMAGE_PRESIGNED_URL_SECONDS', 3600))
+
+IMMUTABLE_PREFIX = 'store/' # Content-addressed: a key's bytes never change
+
+_storage = {'backend': None}
+
+def valid_key(key):
+    """True for keys the app may read or write: relative, no '..', no hidden segments."""
+    if not key or key.startswith('/') or '\\' in key:
+        return False
+    return all(part and not part.startswith('.') for part in key.split('/'))
+
+def content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+def cache_control(key):
+    if key.startswith(IMMUTABLE_PREFIX):
+        return 'public, max-age=31536000, immutable'
+    return 'public, max-age=300' # Profile photos are replaced under the same name
+
+class LocalStorage:
+    """Files under a directory on this node."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put_file(self, key, source_path):
+        """Moves a finished local file into place (atomically on the same filesystem)."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source_path, path)
+        except OSError:
+            shutil.move(source_path, path)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def url(self, key):
+        return None # Served by the app (or its front proxy)
+
+class S3Storage:
+    """Objects in an S3 (or S3-compatible) bucket."""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, public_url=None):
+        if boto3 is None:
+            raise RuntimeError("IMAGE_STORAGE=s3 needs boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("IMAGE_STORAGE=s3 needs IMAGE_STORAGE_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url.rstrip('/') + '/' if public_url else None
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def path(self, key):
+        return None
+
+    def put_file(self, key, source_path):
+        """Uploads a finished local file and removes it."""
+        self.client.upload_file(source_path, self.bucket, self.prefix + key, ExtraArgs={
+            'ContentType': content_type(key), 'CacheControl': cache_control(key)})
+        os.remove(source_path)
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        head = self._head(key)
+        return head['ContentLength'] if head else 0
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+
+    def url(self, key):
+        """Where clients can fetch the image directly: the public URL, or a presigned one."""
+        if self.public_url:
+            return self.public_url + self.prefix + key
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key}, ExpiresIn=PRESIGNED_URL_SECONDS)
+
+def get_storage():
+    """Returns the configured backend (created on first use)."""
+    if _storage['backend'] is None:
+        if IMAGE_STORAGE == 's3':
+            _storage['backend'] = S3Storage(IMAGE_STORAGE_BUCKET, IMAGE_STORAGE_PREFIX,
+                                            IMAGE_STORAGE_ENDPOINT, IMAGE_STORAGE_PUBLIC_URL)
+        elif IMAGE_STORAGE == 'local':
+            _storage['backend'] = LocalStorage(IMAGE_STORAGE_ROOT)
+        else:
+            raise RuntimeError(f"Unknown IMAGE_STORAGE {IMAGE_STORAGE!r} (use 'local' or 's3')")
+    return _storage['backend']
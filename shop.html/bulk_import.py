@@ -0,0 +1,271 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import data_manager
+import images
+import image_store
+import catalog_changes
+
+# Bulk import and export of a merchant's products.
+#
+# Imports read CSV or JSON Lines one row at a time, so the upload is never
+# held in memory as a whole. Product images come from an optional zip archive;
+# each row names its images (2-4, like the product form) by file name. Valid
+# rows are committed in batches through data_manager.add_parks (one catalog
+# rewrite per batch), after their images have been stored (image_store) on a
+# pool of workers; an image shared by many rows is processed once. Under
+# eventlet the workers are green threads and the heavy image work goes to
+# native threads inside images, so the hub keeps serving other clients while
+# an import runs; see configure().
+# Rows that fail validation or image processing are skipped and reported.
+#
+# CLI:
+#   python bulk_import.py import products.csv --admin-id 000012 --images images.zip
+#   python bulk_import.py export --admin-id 000012 --format jsonl > products.jsonl
+
+IMPORT_FIELDS = ('name', 'location', 'price', 'description', 'type', 'web_details', 'link1', 'link2', 'home_delivery')
+REQUIRED_FIELDS = ('name', 'location', 'price', 'description', 'type')
+EXPORT_FIELDS = ('id',) + IMPORT_FIELDS + ('image_filenames', 'date_added', 'views', 'inquiries')
+FORMATS = ('csv', 'jsonl')
+
+MIN_IMAGES = 2
+MAX_IMAGES = 4
+BATCH_SIZE = 500
+# Decoding is capped at images.IMAGE_DECODE_CONCURRENCY per process whatever this
+# is set to; workers beyond that only overlap reading and hashing archive members.
+IMAGE_WORKERS = int(os.environ.get('IMPORT_IMAGE_WORKERS', images.IMAGE_DECODE_CONCURRENCY))
+MAX_REPORTED_ERRORS = 100
+MAX_IMPORT_BYTES = int(os.environ.get('MAX_IMPORT_BYTES', 512 * 1024 * 1024)) # Product file plus image archive
+
+_pool = {'submit': None}
+
+def configure(async_mode):
+    """Picks how import images are processed for the server's async mode (as password_hashing does)."""
+    if async_mode == 'eventlet':
+        from eventlet.greenpool import GreenPool
+        # images copies, decodes and encodes on tpool and parks the green
+        # thread meanwhile; its decode slots are a green semaphore, so the
+        # workers must be green threads too, not native ones.
+        pool = GreenPool(IMAGE_WORKERS)
+        def submit(func, *args):
+            return pool.spawn(func, *args).wait
+    else:
+        executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='import-image')
+        def submit(func, *args):
+            return executor.submit(func, *args).result
+    _pool['submit'] = submit
+
+def _submit(func, *args):
+    """Starts func(*args) on the image workers; returns a callable that waits for its result."""
+    if _pool['submit'] is None:
+        configure(None)
+    return _pool['submit'](func, *args)
+
+def detect_format(filename):
+    """Guesses the import format from a file name; returns None if unknown."""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        return 'csv'
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    return None
+
+def iter_rows(stream, fmt):
+    """Yields (line_number, row, error) for each record of a binary CSV or JSON Lines stream."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+            continue
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, None, "Each line must be a JSON object"
+
+def _parse_image_names(value):
+    if isinstance(value, list):
+        return [str(name).strip() for name in value if str(name).strip()]
+    return [name.strip() for name in str(value or '').replace('|', ';').split(';') if name.strip()]
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def open_archive(file):
+    """Opens an image zip archive; returns (zipfile, {base name: member name})."""
+    archive = zipfile.ZipFile(file)
+    members = {os.path.basename(info.filename): info.filename for info in archive.infolist() if not info.is_dir()}
+    return archive, members
+
+def validate_row(row, members):
+    """Checks one import row; returns (park_data, archive member names) or raises ValueError."""
+    park_data = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if value is None:
+            continue
+        park_data[field] = _parse_bool(value) if field == 'home_delivery' else str(value).strip()
+    missing = [field for field in REQUIRED_FIELDS if not park_data.get(field)]
+    if missing:
+        raise ValueError(f"Missing required fields: {missing}")
+
+    image_names = _parse_image_names(row.get('images'))
+    if not MIN_IMAGES <= len(image_names) <= MAX_IMAGES:
+        raise ValueError(f"Each product needs between {MIN_IMAGES} and {MAX_IMAGES} images")
+    if not members:
+        raise ValueError("Images are required, but no image archive was uploaded")
+    member_names = []
+    for name in image_names:
+        extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        if extension not in images.ALLOWED_EXTENSIONS:
+            raise ValueError(f"Invalid file type for image {name}. Allowed: {sorted(images.ALLOWED_EXTENSIONS)}")
+        if os.path.basename(name) not in members:
+            raise ValueError(f"Image {name} is not in the image archive")
+        member_names.append(members[os.path.basename(name)])
+    return park_data, member_names
+
+def _extension(member_name):
+    return member_name.rsplit('.', 1)[1].lower()
+
+def _process_image(archive, member_name):
+    """Stores one archived image (resized, or reused if already stored) and returns its filename."""
+    with archive.open(member_name) as source:
+        return image_store.put(source, _extension(member_name))
+
+def _report(summary, line_number, error):
+    summary['failed'] += 1
+    if len(summary['errors']) < MAX_REPORTED_ERRORS:
+        summary['errors'].append({"line": line_number, "error": error})
+
+def _commit_batch(batch, admin_id, archive, summary):
+    """Processes a batch's images in parallel, then adds the rows whose images all succeeded.
+
+    An archive member used by several rows is processed once. Images of rows
+    that fail are left unreferenced in the store and collected later.
+    """
+    futures = {}
+    for _, _, member_names in batch:
+        for name in member_names:
+            if name not in futures:
+                futures[name] = _submit(_process_image, archive, name)
+    ready = []
+    for line_number, park_data, member_names in batch:
+        filenames = []
+        error = None
+        for name in member_names:
+            try:
+                filenames.append(futures[name]())
+            except Exception as e:
+                error = error or f"Could not process image: {e}"
+        if error:
+            _report(summary, line_number, error)
+            continue
+        ready.append((park_data, filenames))
+    if not ready:
+        return
+
+    new_parks = data_manager.add_parks(ready, admin_id) # image_store's listener counts the references
+    for new_park in new_parks:
+        summary['ids'].append(new_park['id'])
+        summary['imported'] += 1
+
+def import_products(stream, fmt, admin_id, image_archive=None, batch_size=BATCH_SIZE):
+    """Imports products for a merchant from a CSV/JSON Lines stream and an optional image zip.
+
+    Returns a summary: {"imported", "failed", "ids", "errors"} (errors are capped).
+    """
+    summary = {"imported": 0, "failed": 0, "ids": [], "errors": []}
+    archive, members = open_archive(image_archive) if image_archive is not None else (None, {})
+    try:
+        batch = []
+        for line_number, row, error in iter_rows(stream, fmt):
+            if error is None:
+                try:
+                    park_data, member_names = validate_row(row, members)
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                _report(summary, line_number, error)
+                continue
+            batch.append((line_number, park_data, member_names))
+            if len(batch) >= batch_size:
+                _commit_batch(batch, admin_id, archive, summary)
+                batch = []
+        if batch:
+            _commit_batch(batch, admin_id, archive, summary)
+    finally:
+        if archive is not None:
+            archive.close()
+    summary['errors'].sort(key=lambda error: error['line']) # Image failures are found a batch later.
+    return summary
+
+def _export_record(park):
+    return {field: park.get(field) for field in EXPORT_FIELDS}
+
+def export_products(parks, fmt):
+    """Yields a CSV or JSON Lines export of `parks` one row at a time."""
+    if fmt == 'jsonl':
+        for park in parks:
+            yield json.dumps(_export_record(park), ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The 'images' column holds file names, in the format imports accept.
+    writer.writerow([field if field != 'image_filenames' else 'images' for field in EXPORT_FIELDS])
+    for park in parks:
+        record = _export_record(park)
+        record['image_filenames'] = ';'.join(record['image_filenames'] or [])
+        writer.writerow(['' if record[field] is None else record[field] for field in EXPORT_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or export a merchant's products.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='Import products from a CSV or JSON Lines file.')
+    import_parser.add_argument('file')
+    import_parser.add_argument('--admin-id', required=True, help='Merchant (admin) id that will own the products.')
+    import_parser.add_argument('--images', help='Zip archive holding the images named in the file.')
+    import_parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+    import_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    export_parser = commands.add_parser('export', help='Write products to stdout.')
+    export_parser.add_argument('--admin-id', help='Only export this merchant\'s products.')
+    export_parser.add_argument('--format', choices=FORMATS, default='csv')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        for chunk in export_products(data_manager.iter_parks(args.admin_id), args.format):
+            sys.stdout.write(chunk)
+        return 0
+
+    catalog_changes.register() # Records the imported products in the change feed
+    image_store.register() # and counts their image references
+    fmt = args.format or detect_format(args.file)
+    if fmt is None:
+        parser.error('cannot tell the format from the file name; pass --format')
+    with open(args.file, 'rb') as stream:
+        summary = import_products(stream, fmt, args.admin_id, image_archive=args.images, batch_size=args.batch_size)
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0 if not summary['failed'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import time
+
+import data_manager
+
+# Versioned change feed for client-side catalog caches. Every add, update or
+# delete made through data_manager bumps a global catalog version and records
+# it against the product, so `changes since version N` is a single indexed
+# range scan. Only the latest change per product is kept; deletes are kept as
+# tombstones for TOMBSTONE_RETENTION_DAYS. A client whose version is older than
+# the oldest pruned tombstone (the "floor") has to reload the whole catalog.
+# View and inquiry counters are not versioned: they change on every page view
+# and would turn every sync into a full download.
+
+CATALOG_CHANGES_DB = os.environ.get('CATALOG_CHANGES_DB', os.path.join('catalog_changes', 'catalog_changes.db'))  # Not under static/: never served
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('CATALOG_TOMBSTONE_RETENTION_DAYS', 30))
+
+def _connect():
+    os.makedirs(os.path.dirname(CATALOG_CHANGES_DB), exist_ok=True)
+    # Autocommit mode, so record_change can take the write lock up front with
+    # BEGIN IMMEDIATE; version numbers are then unique across processes.
+    conn = sqlite3.connect(CATALOG_CHANGES_DB, timeout=10, isolation_level=None)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS changes (
+            product_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            changed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS changes_by_version ON changes (version);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """)
+    return conn
+
+def _meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else 0
+
+def record_change(product_id, deleted=False, now=None):
+    """Bumps the catalog version and records it as the product's latest change."""
+    return record_changes([product_id], deleted, now)
+
+def record_changes(product_ids, deleted=False, now=None):
+    """Records a change for several products in one transaction; returns the last version."""
+    now = time.time() if now is None else now
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = _meta(conn, 'version')
+            for product_id in product_ids:
+                version += 1
+                conn.execute(
+                    "INSERT INTO changes (product_id, version, deleted, changed_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (product_id) DO UPDATE SET version = excluded.version, "
+                    "deleted = excluded.deleted, changed_at = excluded.changed_at",
+                    (product_id, version, 1 if deleted else 0, now))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+            if deleted:
+                _prune_tombstones(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return version
+
+def _prune_tombstones(conn, now):
+    """Drops expired tombstones and raises the floor past the newest one dropped."""
+    cutoff = now - TOMBSTONE_RETENTION_DAYS * 86400
+    newest_pruned = conn.execute(
+        "SELECT MAX(version) FROM changes WHERE deleted = 1 AND changed_at < ?", (cutoff,)).fetchone()[0]
+    if newest_pruned is None:
+        return
+    conn.execute("DELETE FROM changes WHERE deleted = 1 AND changed_at < ?", (cutoff,))
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('floor', ?)",
+                 (max(newest_pruned, _meta(conn, 'floor')),))
+
+def current_version():
+    """Returns the latest catalog version (0 before the first recorded change)."""
+    conn = _connect()
+    try:
+        return _meta(conn, 'version')
+    finally:
+        conn.close()
+
+def get_changes(since):
+    """Returns (version, changes) for everything changed after version `since`.
+
+    `changes` is a list of (product_id, deleted) in version order, or None if
+    `since` cannot be served incrementally (it predates the tombstone floor or
+    is ahead of this feed) and the client must reload the catalog.
+    """
+    conn = _connect()
+    try:
+        version = _meta(conn, 'version')
+        if since < _meta(conn, 'floor') or since > version:
+            return version, None
+        rows = conn.execute(
+            "SELECT product_id, deleted FROM changes WHERE version > ? AND version <= ? ORDER BY version",
+            (since, version)).fetchall()
+    finally:
+        conn.close()
+    return version, [(product_id, bool(deleted)) for product_id, deleted in rows]
+
+def _on_catalog_change(event, park):
+    _on_catalog_changes(event, [park])
+
+def _on_catalog_changes(event, parks):
+    product_ids = [park['id'] for park in parks if park.get('id')]
+    if event in ('add', 'update', 'delete') and product_ids:
+        record_changes(product_ids, deleted=event == 'delete')
+
+_registered = {'done': False}
+
+def register():
+    """Starts recording this process's catalog writes in the feed (the app and the import CLI call this)."""
+    if not _registered['done']:
+        _registered['done'] = True
+        data_manager.add_listener(_on_catalog_change, batch_callback=_on_catalog_changes)
@@ -0,0 +1,227 @@
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional: without it catalog_index answers queries from its sets.
+    np = None
+
+import catalog_index # For INQUIRY_WEIGHT; catalog_index imports this module too, so only use it in functions
+
+# Columnar (struct-of-arrays) view of the product table. Each product is a row
+# number; numeric fields live in NumPy arrays and repeated strings (type,
+# location, merchant) are interned into small integer codes, so a filter or a
+# top-N sort is a handful of vectorized operations instead of a loop over dicts.
+# catalog_index owns the product dicts and tells this module when they change:
+# a changed product is rewritten in its row, a new one appended (the arrays
+# keep spare capacity, like a list), and a deleted one only marked dead. Once
+# dead rows outnumber live ones, the next query rebuilds the arrays compactly.
+
+_columns = {
+    'generation': None,   # catalog_index generation the arrays were built from
+    'ids': [],            # row -> product id
+    'rows': {},           # product id -> row (live rows only)
+    'count': 0,           # rows in use; the arrays may be longer
+    'dead': 0,            # rows of deleted products
+    'vocab': {'type': {}, 'location': {}, 'admin': {}},
+}
+
+# Column name -> (dtype, value of an unused row).
+_COLUMN_TYPES = {
+    'live': ('bool', False),
+    'price': ('float64', float('nan')),
+    'views': ('int64', 0),
+    'inquiries': ('int64', 0),
+    'date': ('float64', 0.0),
+    'type_code': ('int32', 0),
+    'location_code': ('int32', 0),
+    'admin_code': ('int32', 0),
+    'home_delivery': ('bool', False),
+}
+
+def available():
+    """True when NumPy is installed and the columnar view can be used."""
+    return np is not None
+
+def _intern(vocab, value):
+    """Returns the integer code for a string value, assigning a new one if needed."""
+    return vocab.setdefault(value, len(vocab))
+
+def _timestamp(date_added):
+    try:
+        return datetime.fromisoformat(date_added).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def _allocate(columns, capacity):
+    """Gives `columns` arrays of `capacity` rows, keeping the rows already in them."""
+    for name, (dtype, empty) in _COLUMN_TYPES.items():
+        array = np.full(capacity, empty, dtype=dtype)
+        if name in columns:
+            array[:columns[name].size] = columns[name]
+        columns[name] = array
+
+def _set_row(columns, row, park, price_value, normalize_key):
+    vocab = columns['vocab']
+    columns['price'][row] = np.nan if price_value is None else price_value
+    columns['views'][row] = park.get('views', 0)
+    columns['inquiries'][row] = park.get('inquiries', 0)
+    columns['date'][row] = _timestamp(park.get('date_added'))
+    columns['type_code'][row] = _intern(vocab['type'], normalize_key(park.get('type')))
+    columns['location_code'][row] = _intern(vocab['location'], normalize_key(park.get('location')))
+    columns['admin_code'][row] = _intern(vocab['admin'], park.get('admin_id'))
+    columns['home_delivery'][row] = bool(park.get('home_delivery'))
+    columns['live'][row] = True
+
+def rebuild(parks, generation, normalize_key, price_values):
+    """Builds the column arrays from an iterable of park dicts and their parsed prices (id -> float or None)."""
+    parks = list(parks)
+    columns = {'vocab': {'type': {}, 'location': {}, 'admin': {}}, 'ids': [], 'count': len(parks), 'dead': 0}
+    _allocate(columns, len(parks))
+    for row, park in enumerate(parks):
+        columns['ids'].append(park['id'])
+        _set_row(columns, row, park, price_values.get(park['id']), normalize_key)
+    columns['rows'] = {park_id: row for row, park_id in enumerate(columns['ids'])}
+    columns['generation'] = generation
+    _columns.update(columns)
+
+def update_row(park_id, park, price_value, normalize_key, generation):
+    """Applies one added or changed product (or a deleted one, park=None) in place.
+
+    Afterwards the arrays count as built from `generation`, unless so many rows
+    are dead that a compacting rebuild is due.
+    """
+    row = _columns['rows'].get(park_id)
+    if park is None:
+        if row is not None:
+            del _columns['rows'][park_id]
+            _columns['live'][row] = False
+            _columns['dead'] += 1
+    elif row is not None:
+        _set_row(_columns, row, park, price_value, normalize_key)
+    else:
+        row = _columns['count']
+        if row == _columns['live'].size:
+            _allocate(_columns, max(16, row * 2))
+        _set_row(_columns, row, park, price_value, normalize_key)
+        _columns['ids'].append(park_id)
+        _columns['rows'][park_id] = row
+        _columns['count'] = row + 1  # Last, so a concurrent query never sees a half-written row
+    live = _columns['count'] - _columns['dead']
+    _columns['generation'] = None if _columns['dead'] > live else generation
+
+def export_columns():
+    """Returns the column arrays for a snapshot, or None if they were never built."""
+    if _columns['generation'] is None:
+        return None
+    return {key: value for key, value in _columns.items() if key != 'generation'}
+
+def restore_columns(saved, generation):
+    """Installs column arrays loaded from a snapshot as built from `generation`."""
+    _columns.update(saved)
+    _columns['generation'] = generation
+
+def is_current(generation):
+    """True if the arrays were built from the given catalog_index generation."""
+    return _columns['generation'] == generation
+
+def update_counts(park_id, views, inquiries):
+    """Applies a view/inquiry counter change in place, without a rebuild."""
+    row = _columns['rows'].get(park_id)
+    if row is not None:
+        _columns['views'][row] = views
+        _columns['inquiries'][row] = inquiries
+
+def _order(rows, sort, limit):
+    """Returns the first `limit` of `rows` in sort order, using a partial sort."""
+    if sort == 'price_asc':
+        key = np.nan_to_num(_columns['price'][rows], nan=np.inf)
+    elif sort == 'price_desc':
+        key = -np.nan_to_num(_columns['price'][rows], nan=-np.inf)
+    elif sort == 'popular':
+        key = -(_columns['views'][rows] + _columns['inquiries'][rows] * catalog_index.INQUIRY_WEIGHT).astype(np.float64)
+    elif sort in ('views', 'inquiries'):
+        key = -_columns[sort][rows].astype(np.float64)
+    elif sort == 'oldest':
+        key = _columns['date'][rows]
+    else:
+        key = -_columns['date'][rows]
+
+    if limit < rows.size:
+        # np.partition is O(n) and finds the key of the last wanted row; only
+        # rows at or above it (ties included, so none is cut arbitrarily) are sorted.
+        threshold = np.partition(key, limit - 1)[limit - 1]
+        head = np.flatnonzero(key <= threshold)
+    else:
+        head = np.arange(rows.size)
+    if sort in ('popular', 'views', 'inquiries'):
+        # Break count ties by newest first, like the dict-based path.
+        ordered = head[np.lexsort((-_columns['date'][rows][head], key[head]))]
+    else:
+        ordered = head[np.argsort(key[head], kind='stable')]
+    return rows[ordered[:limit]]
+
+def _mask(product_type, location, min_price, max_price, home_delivery, admin_id, normalize_key):
+    """Boolean mask of the live rows passing every filter, or None if a filter value is unknown."""
+    count = _columns['count']
+    mask = _columns['live'][:count].copy()
+    vocab = _columns['vocab']
+    for value, vocab_name, column in ((product_type, 'type', 'type_code'),
+                                      (location, 'location', 'location_code'),
+                                      (admin_id, 'admin', 'admin_code')):
+        if not value:
+            continue
+        key = normalize_key(value) if vocab_name != 'admin' else value
+        code = vocab[vocab_name].get(key)
+        if code is None:
+            return None
+        mask &= _columns[column][:count] == code
+    if home_delivery:
+        mask &= _columns['home_delivery'][:count]
+    if min_price is not None:
+        mask &= _columns['price'][:count] >= min_price  # NaN compares False, so unpriced rows drop out
+    if max_price is not None:
+        mask &= _columns['price'][:count] <= max_price
+    return mask
+
+def query(product_type=None, location=None, min_price=None, max_price=None,
+          home_delivery=None, admin_id=None, sort='newest', offset=0, limit=50,
+          normalize_key=None):
+    """Vectorized filter + top-N over the columns.
+
+    Returns (page_of_product_ids, total_matches).
+    """
+    mask = _mask(product_type, location, min_price, max_price, home_delivery, admin_id, normalize_key)
+    if mask is None:
+        return [], 0
+    rows = np.flatnonzero(mask)
+    total = int(rows.size)
+    end = offset + limit
+    if offset >= total:
+        return [], total
+    page_rows = _order(rows, sort, min(end, total))[offset:end]
+    ids = _columns['ids']
+    return [ids[row] for row in page_rows], total
+
+def matching_ids(product_type=None, location=None, min_price=None, max_price=None,
+                 home_delivery=None, admin_id=None, normalize_key=None):
+    """Ids of every product passing the filters, unordered (for catalog_index's text search)."""
+    mask = _mask(product_type, location, min_price, max_price, home_delivery, admin_id, normalize_key)
+    if mask is None:
+        return []
+    ids = _columns['ids']
+    return [ids[row] for row in np.flatnonzero(mask)]
+
+def counts():
+    """Live product counts per type and location key, the home delivery count and the price range, for facets."""
+    count = _columns['count']
+    live = _columns['live'][:count]
+    result = {'home_delivery': int(np.count_nonzero(_columns['home_delivery'][:count] & live))}
+    for vocab_name, column in (('type', 'type_code'), ('location', 'location_code')):
+        keys = list(_columns['vocab'][vocab_name])  # Codes are assigned in insertion order
+        per_code = np.bincount(_columns[column][:count][live], minlength=len(keys))
+        result[vocab_name] = {keys[code]: int(n) for code, n in enumerate(per_code) if n}
+    prices = _columns['price'][:count][live]
+    prices = prices[~np.isnan(prices)]
+    result['price_range'] = (float(prices.min()), float(prices.max())) if prices.size else (None, None)
+    return result
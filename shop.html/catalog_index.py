@@ -0,0 +1,446 @@
+import bisect
+import heapq
+import re
+from collections import defaultdict
+
+import catalog_columns
+import data_manager
+
+# Attribute indexes over the product catalog, kept in memory so the shop can
+# filter and sort without re-reading and scanning products.json per request.
+# The index follows data_manager writes through a listener and rebuilds itself
+# whenever the file on disk was changed by someone else (another worker).
+# When NumPy is installed, filtering, sorting and facet counts run over the
+# columnar view in catalog_columns instead, and the per-attribute sets and the
+# sorted price list below are left empty: they only serve the fallback.
+#
+# For typo-tolerant search, every word of a product's name and type is indexed
+# by its trigrams. similar_words() collects the indexed words sharing the most
+# trigrams with a search term (at most FUZZY_CANDIDATE_WORDS of them), then
+# keeps those within a small edit distance, so "iphnoe" finds "iphone".
+
+SORT_OPTIONS = ('newest', 'oldest', 'price_asc', 'price_desc', 'popular', 'views', 'inquiries')
+
+# An inquiry (someone opening a chat about the product) is a much stronger
+# signal than a page view, so it weighs more in the popularity sort.
+INQUIRY_WEIGHT = 5
+
+_PRICE_NUMBER = re.compile(r'\d[\d\s.,]*')
+_WORD = re.compile(r'[^\W_]+')
+
+FUZZY_MIN_LENGTH = 4          # shorter terms have too many near neighbours
+FUZZY_CANDIDATE_WORDS = 100   # words compared by edit distance per term
+
+_state = {
+    'built': False,
+    'signature': None,
+    'generation': 0,                   # bumped on every structural change
+    'products': {},                    # id -> park dict
+    'by_type': defaultdict(set),       # normalized type -> ids (without NumPy only)
+    'by_location': defaultdict(set),   # normalized location -> ids (without NumPy only)
+    'by_admin': defaultdict(set),      # admin_id -> ids (without NumPy only)
+    'home_delivery': set(),            # ids offering home delivery (without NumPy only)
+    'price_values': {},                # id -> parsed price (None if unparseable); kept out of the park dicts
+    'prices': [],                      # sorted (price_value, id) pairs (without NumPy only)
+    'labels': {'type': {}, 'location': {}},
+    'words': {},                       # name/type word -> ids
+    'word_trigrams': defaultdict(set), # trigram -> words containing it
+    'facets': None,                    # cached facet counts
+}
+
+def parse_price(raw_price):
+    """Normalizes a free-form price string ("1,200 DA", "$15.99") to a float.
+
+    Returns None when no number can be found.
+    """
+    if raw_price is None:
+        return None
+    if isinstance(raw_price, (int, float)):
+        return float(raw_price)
+    match = _PRICE_NUMBER.search(str(raw_price))
+    if not match:
+        return None
+    number = re.sub(r'\s', '', match.group(0)).rstrip('.,')
+    if ',' in number and '.' in number:
+        # Whichever separator comes last is the decimal point.
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif ',' in number:
+        groups = number.split(',')
+        if all(len(group) == 3 for group in groups[1:]):
+            number = ''.join(groups)  # "1,200,000" style thousands
+        else:
+            number = number.replace(',', '.')
+    elif number.count('.') > 1:
+        number = number.replace('.', '')  # "1.200.000" style thousands
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+def normalize_key(value):
+    """Lower-cases and trims an attribute value so facets group consistently."""
+    return (value or '').strip().lower()
+
+def popularity(park):
+    """Lifetime popularity used by the 'popular' sort."""
+    return park.get('views', 0) + park.get('inquiries', 0) * INQUIRY_WEIGHT
+
+def _park_words(park):
+    return set(_WORD.findall(f"{park.get('name') or ''} {park.get('type') or ''}".lower()))
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _index_words(park_id, park):
+    for word in _park_words(park):
+        ids = _state['words'].get(word)
+        if ids is None:
+            ids = _state['words'][word] = set()
+            for trigram in _trigrams(word):
+                _state['word_trigrams'][trigram].add(word)
+        ids.add(park_id)
+
+def _unindex_words(park_id, park):
+    for word in _park_words(park):
+        ids = _state['words'].get(word)
+        if ids is None:
+            continue
+        ids.discard(park_id)
+        if not ids:
+            del _state['words'][word]
+            for trigram in _trigrams(word):
+                _discard_from(_state['word_trigrams'], trigram, word)
+
+def _index_park(park):
+    park_id = park.get('id')
+    if not park_id:
+        return
+    _state['products'][park_id] = park
+    type_key = normalize_key(park.get('type'))
+    location_key = normalize_key(park.get('location'))
+    _state['labels']['type'].setdefault(type_key, (park.get('type') or '').strip())
+    _state['labels']['location'].setdefault(location_key, (park.get('location') or '').strip())
+    _index_words(park_id, park)
+    price_value = parse_price(park.get('price'))
+    _state['price_values'][park_id] = price_value
+    if catalog_columns.available():
+        return  # The columns hold the attributes below
+    _state['by_type'][type_key].add(park_id)
+    _state['by_location'][location_key].add(park_id)
+    _state['by_admin'][park.get('admin_id')].add(park_id)
+    if park.get('home_delivery'):
+        _state['home_delivery'].add(park_id)
+    if price_value is not None:
+        bisect.insort(_state['prices'], (price_value, park_id))
+
+def _discard_from(index, key, park_id):
+    ids = index.get(key)
+    if ids is None:
+        return
+    ids.discard(park_id)
+    if not ids:
+        del index[key]
+
+def _unindex_park(park_id):
+    park = _state['products'].pop(park_id, None)
+    if park is None:
+        return
+    _discard_from(_state['by_type'], normalize_key(park.get('type')), park_id)
+    _discard_from(_state['by_location'], normalize_key(park.get('location')), park_id)
+    _discard_from(_state['by_admin'], park.get('admin_id'), park_id)
+    _state['home_delivery'].discard(park_id)
+    _unindex_words(park_id, park)
+    price_value = _state['price_values'].pop(park_id, None)
+    if price_value is not None:
+        prices = _state['prices']
+        position = bisect.bisect_left(prices, (price_value, park_id))
+        if position < len(prices) and prices[position] == (price_value, park_id):
+            del prices[position]
+
+def rebuild(parks=None):
+    """Rebuilds every index from scratch from the database file."""
+    signature = data_manager.get_catalog_signature()
+    if parks is None:
+        parks = data_manager.get_all_parks()
+    _state['products'] = {}
+    _state['by_type'] = defaultdict(set)
+    _state['by_location'] = defaultdict(set)
+    _state['by_admin'] = defaultdict(set)
+    _state['home_delivery'] = set()
+    _state['price_values'] = {}
+    _state['prices'] = []
+    _state['labels'] = {'type': {}, 'location': {}}
+    _state['words'] = {}
+    _state['word_trigrams'] = defaultdict(set)
+    _state['facets'] = None
+    for park in parks:
+        _index_park(dict(park))
+    _state['signature'] = signature
+    _state['built'] = True
+    _state['generation'] += 1
+
+def export_state():
+    """Returns the built indexes for a snapshot (see snapshots.py), or None if not built yet."""
+    if not _state['built']:
+        return None
+    state = {key: _state[key] for key in ('signature', 'generation', 'products', 'by_type', 'by_location',
+                                          'by_admin', 'home_delivery', 'price_values', 'prices', 'labels',
+                                          'words', 'word_trigrams')}
+    state['columnar'] = catalog_columns.available()  # The sets are empty when True
+    return state
+
+def restore_state(saved):
+    """Installs indexes loaded from a snapshot; returns the new generation."""
+    _state.update({key: value for key, value in saved.items() if key not in ('generation', 'columnar')})
+    _state['facets'] = None
+    _state['built'] = True
+    _state['generation'] += 1
+    return _state['generation']
+
+def ensure_current():
+    """Rebuilds the indexes if products.json changed outside this process."""
+    if not _state['built'] or _state['signature'] != data_manager.get_catalog_signature():
+        rebuild()
+
+def _on_catalog_change(event, park):
+    """data_manager listener that keeps the indexes in step with writes."""
+    if not _state['built']:
+        return  # Not built yet; the first query builds it from disk.
+    before, after = data_manager.last_write_signatures()
+    if _state['signature'] not in (before, after): # after: an earlier park of the same batched write
+        # Another process wrote since we last looked; applying only our own
+        # change would hide theirs. Rebuild from disk on the next query.
+        _state['built'] = False
+        return
+    park_id = park.get('id')
+    if event in ('view', 'inquiry') and park_id in _state['products']:
+        _state['products'][park_id]['views'] = park.get('views', 0)
+        _state['products'][park_id]['inquiries'] = park.get('inquiries', 0)
+        if catalog_columns.available():
+            catalog_columns.update_counts(park_id, park.get('views', 0), park.get('inquiries', 0))
+    else:
+        _unindex_park(park_id)
+        if event != 'delete':
+            _index_park(dict(park))
+        _state['facets'] = None
+        _state['generation'] += 1
+        if catalog_columns.available() and catalog_columns.is_current(_state['generation'] - 1):
+            catalog_columns.update_row(park_id, _state['products'].get(park_id), _state['price_values'].get(park_id),
+                                       normalize_key, _state['generation'])
+    _state['signature'] = after
+
+data_manager.add_listener(_on_catalog_change)
+
+def get_park(park_id):
+    """Returns the indexed park dict for an id, or None. Copy before mutating."""
+    ensure_current()
+    return _state['products'].get(park_id)
+
+def get_parks():
+    """Returns every indexed park dict, in catalog order. Copy before mutating."""
+    ensure_current()
+    return list(_state['products'].values())
+
+def has_word(word):
+    """True if some product's name or type contains `word` (lower-case) as a whole word."""
+    ensure_current()
+    return word in _state['words']
+
+def word_ids(word):
+    """Ids of the products whose name or type contains `word` (a copy, safe to iterate)."""
+    ensure_current()
+    return set(_state['words'].get(word, ()))
+
+def _edit_distance(a, b, limit):
+    """Optimal string alignment distance (adjacent swaps count once); anything over `limit` is limit + 1."""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+def similar_words(term, limit=5):
+    """Indexed name/type words close to a (misspelled) term, as (word, similarity 0-1), best first."""
+    ensure_current()
+    term = term.lower()
+    if len(term) < FUZZY_MIN_LENGTH:
+        return []
+    # Writes on other threads add and remove words while this runs, so each
+    # set is copied (atomically, under the GIL) before it is iterated.
+    shared = defaultdict(int)
+    for trigram in _trigrams(term):
+        for word in tuple(_state['word_trigrams'].get(trigram, ())):
+            shared[word] += 1
+    max_distance = 1 if len(term) < 7 else 2
+    matches = []
+    for word, _ in heapq.nlargest(FUZZY_CANDIDATE_WORDS, shared.items(), key=lambda item: item[1]):
+        if word == term or abs(len(word) - len(term)) > max_distance:
+            continue
+        distance = _edit_distance(term, word, max_distance)
+        if distance <= max_distance:
+            matches.append((word, 1 - distance / max(len(word), len(term))))
+    words = _state['words']
+    matches.sort(key=lambda match: (-match[1], -len(words.get(match[0], ())), match[0]))
+    return matches[:limit]
+
+def _ensure_columns():
+    if not catalog_columns.is_current(_state['generation']):
+        catalog_columns.rebuild(_state['products'].values(), _state['generation'], normalize_key,
+                                _state['price_values'])
+
+def _columnar_facets():
+    _ensure_columns()
+    counts = catalog_columns.counts()
+    labels = _state['labels']
+    price_min, price_max = counts['price_range']
+    return {
+        'type': sorted(
+            ({'value': labels['type'].get(key, key), 'count': count}
+             for key, count in counts['type'].items() if key),
+            key=lambda facet: facet['count'], reverse=True),
+        'location': sorted(
+            ({'value': labels['location'].get(key, key), 'count': count}
+             for key, count in counts['location'].items() if key),
+            key=lambda facet: facet['count'], reverse=True),
+        'home_delivery': counts['home_delivery'],
+        'price_range': {'min': price_min, 'max': price_max},
+        'total': len(_state['products']),
+    }
+
+def get_facets():
+    """Returns cached product counts per type, location and delivery option."""
+    ensure_current()
+    if _state['facets'] is None and catalog_columns.available():
+        _state['facets'] = _columnar_facets()
+    if _state['facets'] is None:
+        labels = _state['labels']
+        prices = _state['prices']
+        _state['facets'] = {
+            'type': sorted(
+                ({'value': labels['type'].get(key, key), 'count': len(ids)}
+                 for key, ids in _state['by_type'].items() if key),
+                key=lambda facet: facet['count'], reverse=True),
+            'location': sorted(
+                ({'value': labels['location'].get(key, key), 'count': len(ids)}
+                 for key, ids in _state['by_location'].items() if key),
+                key=lambda facet: facet['count'], reverse=True),
+            'home_delivery': len(_state['home_delivery']),
+            'price_range': {
+                'min': prices[0][0] if prices else None,
+                'max': prices[-1][0] if prices else None,
+            },
+            'total': len(_state['products']),
+        }
+    return _state['facets']
+
+def _ids_in_price_range(min_price, max_price):
+    prices = _state['prices']
+    start = 0 if min_price is None else bisect.bisect_left(prices, (min_price, ''))
+    if max_price is None:
+        end = len(prices)
+    else:
+        # '\uffff' sorts after any real id, so equal prices are included.
+        end = bisect.bisect_right(prices, (max_price, '\uffff'))
+    return {park_id for _, park_id in prices[start:end]}
+
+def _sort_key(sort):
+    price_values = _state['price_values']
+    if sort == 'price_asc':
+        # Products without a parseable price go last in both directions.
+        return lambda park: (price_values[park['id']] is None, price_values[park['id']] or 0), False
+    if sort == 'price_desc':
+        return lambda park: (price_values[park['id']] is not None, price_values[park['id']] or 0), True
+    if sort == 'popular':
+        return lambda park: (popularity(park), park.get('date_added') or ''), True
+    if sort in ('views', 'inquiries'):
+        return lambda park: (park.get(sort, 0), park.get('date_added') or ''), True
+    if sort == 'oldest':
+        return lambda park: park.get('date_added') or '', False
+    return lambda park: park.get('date_added') or '', True
+
+def _text_matches(text, park_ids):
+    """Ids among `park_ids` whose name, type, location or description contain every word of `text`."""
+    terms = text.lower().split()
+    products = _state['products']
+    matches = set()
+    for park_id in park_ids:
+        park = products[park_id]
+        haystack = ' '.join(str(park.get(field) or '') for field in ('name', 'type', 'location', 'description')).lower()
+        if all(term in haystack for term in terms):
+            matches.add(park_id)
+    return matches
+
+def filter_products(product_type=None, location=None, min_price=None, max_price=None,
+                    home_delivery=None, admin_id=None, sort='newest', offset=0, limit=50, text=None):
+    """Filters and sorts the catalog using the attribute indexes.
+
+    `text` keeps products whose name, type, location or description contain
+    every word of it; it scans the other filters' candidates, so it is meant
+    for narrow sets such as one merchant's products.
+    Returns (page_of_parks, total_matches). The parks are the index's own
+    dicts, so callers must copy them before adding response-only fields.
+    """
+    ensure_current()
+    if catalog_columns.available():
+        _ensure_columns()
+        if not text:
+            page_ids, total = catalog_columns.query(
+                product_type, location, min_price, max_price, home_delivery, admin_id,
+                sort, offset, limit, normalize_key=normalize_key)
+            return [_state['products'][park_id] for park_id in page_ids], total
+        if product_type or location or admin_id or home_delivery or min_price is not None or max_price is not None:
+            scope = catalog_columns.matching_ids(product_type, location, min_price, max_price, home_delivery,
+                                                 admin_id, normalize_key=normalize_key)
+        else:
+            scope = _state['products'].keys()
+        matches = [_state['products'][park_id] for park_id in _text_matches(text, scope)]
+        return _page(matches, sort, offset, limit)
+
+    candidate_sets = []
+    if product_type:
+        candidate_sets.append(_state['by_type'].get(normalize_key(product_type), set()))
+    if location:
+        candidate_sets.append(_state['by_location'].get(normalize_key(location), set()))
+    if admin_id:
+        candidate_sets.append(_state['by_admin'].get(admin_id, set()))
+    if home_delivery:
+        candidate_sets.append(_state['home_delivery'])
+    if min_price is not None or max_price is not None:
+        candidate_sets.append(_ids_in_price_range(min_price, max_price))
+    if text:
+        scope = min(candidate_sets, key=len) if candidate_sets else _state['products'].keys()
+        candidate_sets.append(_text_matches(text, scope))
+
+    if candidate_sets:
+        # Intersect starting from the most selective index.
+        candidate_sets.sort(key=len)
+        matching_ids = set(candidate_sets[0])
+        for ids in candidate_sets[1:]:
+            matching_ids &= ids
+        matches = [_state['products'][park_id] for park_id in matching_ids]
+    else:
+        matches = list(_state['products'].values())
+    return _page(matches, sort, offset, limit)
+
+def _page(matches, sort, offset, limit):
+    """Sorts matching parks and returns (page, total)."""
+    key, descending = _sort_key(sort)
+    end = offset + limit
+    if end < len(matches):
+        # Only the requested page and those before it need to be ordered.
+        select = heapq.nlargest if descending else heapq.nsmallest
+        ordered = select(end, matches, key=key)
+    else:
+        ordered = sorted(matches, key=key, reverse=descending)
+    return ordered[offset:end], len(matches)
@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# Archive tier for old chat messages. Messages older than CHAT_ARCHIVE_MAX_AGE_DAYS
+# are moved out of conversations.json into gzip-compressed JSON segments, one
+# directory per conversation, so the live file (which every chat page loads)
+# only holds recent history. Each conversation keeps a small manifest of its
+# segments in convo_data['archive'], oldest first; the history API reads a
+# segment only when a user scrolls back that far.
+
+CHAT_ARCHIVE_DIR = os.environ.get('CHAT_ARCHIVE_DIR', 'chat_archive')   # Not under static/: never served directly
+CHAT_ARCHIVE_MAX_AGE_DAYS = int(os.environ.get('CHAT_ARCHIVE_MAX_AGE_DAYS', 90))
+SEGMENT_MAX_MESSAGES = 500
+
+_CONVERSATION_KEY = re.compile(r'\w+-\w+')
+
+def _conversation_dir(conversation_key):
+    # Keys come from URLs, so never let one escape the archive directory.
+    if not _CONVERSATION_KEY.fullmatch(conversation_key or ''):
+        raise ValueError(f"Invalid conversation key: {conversation_key!r}")
+    return os.path.join(CHAT_ARCHIVE_DIR, conversation_key)
+
+def _segment_path(conversation_key, segment):
+    return os.path.join(_conversation_dir(conversation_key), f"{segment:06d}.json.gz")
+
+def _write_segment(conversation_key, segment, messages):
+    directory = _conversation_dir(conversation_key)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+        f.write(json.dumps(messages, ensure_ascii=False).encode('utf-8'))
+    os.replace(temp_path, _segment_path(conversation_key, segment))
+
+def load_segment(conversation_key, segment):
+    """Returns the messages stored in one archive segment, or None if it does not exist."""
+    try:
+        with gzip.open(_segment_path(conversation_key, segment), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (FileNotFoundError, ValueError):
+        return None
+
+def latest_segment(convo_data):
+    """Returns the number of the newest archive segment of a conversation, or None."""
+    manifest = convo_data.get('archive', []) if isinstance(convo_data, dict) else []
+    return manifest[-1]['segment'] if manifest else None
+
+def archived_until(convo_data):
+    """Returns the timestamp of the newest archived message of a conversation, or None."""
+    manifest = convo_data.get('archive', []) if isinstance(convo_data, dict) else []
+    return manifest[-1]['last'] if manifest else None
+
+def archive_old_messages(conversations, now=None, max_age_days=None):
+    """Moves messages older than the retention age into archive segments.
+
+    Mutates `conversations` in place; the caller must save it afterwards.
+    Segment files are written before that save and are numbered from the
+    manifest, so an interrupted run is simply overwritten by the next one.
+    Returns the number of messages archived.
+    """
+    max_age_days = CHAT_ARCHIVE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    cutoff = ((now or datetime.now(timezone.utc)) - timedelta(days=max_age_days)).isoformat()
+    archived = 0
+    for conversation_key, convo_data in list(conversations.items()):
+        if isinstance(convo_data, list): # Migrate old format
+            convo_data = conversations[conversation_key] = {"messages": convo_data, "deleted_by": []}
+        messages = convo_data.get('messages', [])
+        # Messages are appended in time order, so the old ones form a prefix.
+        split = 0
+        while split < len(messages) and (messages[split].get('timestamp') or '') < cutoff:
+            split += 1
+        if not split or not _CONVERSATION_KEY.fullmatch(conversation_key):
+            continue
+
+        manifest = convo_data.setdefault('archive', [])
+        next_segment = manifest[-1]['segment'] + 1 if manifest else 1
+        old_messages = messages[:split]
+        for start in range(0, len(old_messages), SEGMENT_MAX_MESSAGES):
+            chunk = old_messages[start:start + SEGMENT_MAX_MESSAGES]
+            _write_segment(conversation_key, next_segment, chunk)
+            manifest.append({
+                "segment": next_segment,
+                "count": len(chunk),
+                "first": chunk[0].get('timestamp'),
+                "last": chunk[-1].get('timestamp')
+            })
+            next_segment += 1
+        convo_data['messages'] = messages[split:]
+        archived += split
+    return archived
+
+def remove_conversation(conversation_key):
+    """Deletes every archive segment of a permanently deleted conversation."""
+    shutil.rmtree(_conversation_dir(conversation_key), ignore_errors=True)
@@ -0,0 +1,139 @@
+import os
+import re
+import sqlite3
+
+import chat_archive
+
+# Inverted index over chat message text for the customer-service (main) admin.
+# Every stored message gets a row in `messages` and one posting per distinct
+# term, so a query only touches the postings of its terms instead of loading
+# every conversation. The index is fed as messages are written and is built
+# once, the first time it is used, from conversations.json and the archive
+# segments (chat_archive) of every conversation.
+
+CHAT_SEARCH_DB = os.environ.get('CHAT_SEARCH_DB', os.path.join('chat_search', 'chat_search.db'))  # Not under static/
+
+_TAG = re.compile(r'<[^>]+>')
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+def _connect():
+    os.makedirs(os.path.dirname(CHAT_SEARCH_DB), exist_ok=True)
+    conn = sqlite3.connect(CHAT_SEARCH_DB)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            conversation_id TEXT NOT NULL,
+            user_part TEXT NOT NULL,
+            admin_part TEXT NOT NULL,
+            sender TEXT,
+            timestamp TEXT NOT NULL,
+            is_system INTEGER NOT NULL DEFAULT 0,
+            text TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS messages_identity ON messages (conversation_id, timestamp, sender);
+        CREATE INDEX IF NOT EXISTS messages_by_user ON messages (user_part, timestamp);
+        CREATE INDEX IF NOT EXISTS messages_by_admin ON messages (admin_part, timestamp);
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (term, message_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    return conn
+
+def tokenize(text):
+    """Splits message text (which may contain product-link HTML) into distinct search terms."""
+    plain = _TAG.sub(' ', text or '').lower()
+    return {term for term in _TERM.findall(plain) if len(term) > 1}
+
+def _insert(conn, conversation_key, message):
+    try:
+        user_part, admin_part = conversation_key.split('-')
+    except ValueError:
+        return
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO messages (conversation_id, user_part, admin_part, sender, timestamp, is_system, text) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (conversation_key, user_part, admin_part, message.get('sender'), message.get('timestamp') or '',
+         1 if message.get('is_system') else 0, message.get('text')))
+    if cursor.rowcount:
+        conn.executemany("INSERT OR IGNORE INTO postings (term, message_id) VALUES (?, ?)",
+                         [(term, cursor.lastrowid) for term in tokenize(message.get('text'))])
+
+def index_messages(messages):
+    """Adds stored messages (dicts carrying their 'conversation_id') to the index."""
+    if not messages:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            for message in messages:
+                _insert(conn, message.get('conversation_id') or '', message)
+    finally:
+        conn.close()
+
+def remove_conversation(conversation_key):
+    """Drops a permanently deleted conversation from the index."""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM postings WHERE message_id IN (SELECT id FROM messages WHERE conversation_id = ?)",
+                         (conversation_key,))
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_key,))
+    finally:
+        conn.close()
+
+def ensure_built(load_conversations):
+    """Indexes every existing conversation, archived messages included, once, the first time search is used."""
+    conn = _connect()
+    try:
+        # 'built' 1 was written by versions that skipped the archive segments.
+        if conn.execute("SELECT value FROM meta WHERE key = 'built' AND value = '2'").fetchone():
+            return
+        with conn:
+            for conversation_key, convo_data in load_conversations().items():
+                messages = convo_data.get('messages', []) if isinstance(convo_data, dict) else convo_data
+                for entry in (convo_data.get('archive', []) if isinstance(convo_data, dict) else []):
+                    for message in chat_archive.load_segment(conversation_key, entry['segment']) or []:
+                        _insert(conn, conversation_key, message)
+                for message in messages:
+                    _insert(conn, conversation_key, message)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '2')")
+    finally:
+        conn.close()
+
+def search(query, participant=None, since=None, until=None, offset=0, limit=20):
+    """Finds messages containing every term of `query`, newest first.
+
+    `participant` restricts results to conversations that user id is part of;
+    `since`/`until` are ISO timestamps. Returns (results, total).
+    """
+    terms = sorted(tokenize(query))
+    if not terms:
+        return [], 0
+    clauses = ["m.id IN (SELECT message_id FROM postings WHERE term IN ({}) GROUP BY message_id HAVING COUNT(*) = ?)"
+               .format(', '.join('?' * len(terms)))]
+    params = terms + [len(terms)]
+    if participant:
+        clauses.append("(m.user_part = ? OR m.admin_part = ?)")
+        params += [participant, participant]
+    if since:
+        clauses.append("m.timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("m.timestamp <= ?")
+        params.append(until)
+    where = ' AND '.join(clauses)
+
+    conn = _connect()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM messages m WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT m.conversation_id, m.user_part, m.admin_part, m.sender, m.timestamp, m.is_system, m.text "
+            f"FROM messages m WHERE {where} ORDER BY m.timestamp DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+    finally:
+        conn.close()
+    return [dict(row, is_system=bool(row['is_system'])) for row in rows], total
@@ -1,10 +1,84 @@
 import json
 import os
+import tempfile
 from datetime import datetime, timezone
 
+import file_lock
+import metrics
+
 # The database file is located in the 'static' directory, which is standard
 # for serving assets like JSON files and images.
 DATABASE_PATH = os.path.join('static', 'products.json')
+# Write counter, bumped on every save, so the catalog signature changes even
+# when a rewrite keeps the file's size and lands within the same mtime tick.
+VERSION_PATH = DATABASE_PATH + '.version'
+
+# Callbacks registered by the in-memory catalog structures (indexes, caches).
+# Each one is called as callback(event, park) after a successful write, where
+# event is one of 'add', 'update', 'delete', 'view' or 'inquiry'.
+_listeners = []
+# Optional batch_callback(event, parks) per listener, used by batched writes so
+# a listener with per-call overhead (e.g. a database transaction) pays it once.
+_batch_listeners = {}
+# Catalog signatures just before and just after this process's latest save.
+# Listeners run while the write lock is still held, so they can tell whether
+# their own state was current before the write (see catalog_index). 'previous'
+# holds the parks that write changed, as they were before it (see image_store).
+_last_write = {'before': None, 'after': None, 'previous': {}}
+
+def add_listener(callback, batch_callback=None):
+    """Registers a callback to be notified after every catalog write."""
+    _listeners.append(callback)
+    if batch_callback is not None:
+        _batch_listeners[callback] = batch_callback
+
+def _notify(event, park):
+    """Tells every registered listener about a change to a single park."""
+    for callback in _listeners:
+        _notify_one(callback, event, park)
+
+def _notify_many(event, parks):
+    """Tells every registered listener about the same change to several parks."""
+    for callback in _listeners:
+        if callback in _batch_listeners:
+            _notify_one(_batch_listeners[callback], event, parks)
+        else:
+            for park in parks:
+                _notify_one(callback, event, park)
+
+def _notify_one(callback, event, payload):
+    # The write itself has succeeded; a broken listener must not fail it or starve the others.
+    try:
+        callback(event, payload)
+    except Exception as e:
+        print(f"ERROR: catalog listener {getattr(callback, '__qualname__', callback)} failed on {event}: {e}")
+
+def _read_version():
+    try:
+        with open(VERSION_PATH, 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def get_catalog_signature():
+    """Returns a cheap fingerprint of the database file (write counter, mtime and size).
+
+    In-memory structures compare this against the signature they were built
+    from to notice writes made by other processes.
+    """
+    try:
+        stat = os.stat(DATABASE_PATH)
+    except OSError:
+        return None
+    return (_read_version(), stat.st_mtime_ns, stat.st_size)
+
+def last_write_signatures():
+    """Returns (before, after): the catalog signatures around this process's latest save."""
+    return _last_write['before'], _last_write['after']
+
+def previous_version(park_id):
+    """Returns a park as it was before this process's latest save changed it (None if it did not)."""
+    return _last_write['previous'].get(park_id)
 
 def _get_next_id(items):
     """Helper function to get the next available ID as a zero-padded string."""
@@ -15,32 +89,51 @@ def _get_next_id(items):
     next_id_num = max_id + 1
     return f"{next_id_num:06d}" # Formats as 6-digit string with leading zeros
 
+@metrics.timed('storage_call', call='data_manager.get_all_parks')
 def get_all_parks():
     """Reads all parks from the JSON database file."""
     if not os.path.exists(DATABASE_PATH):
         return []
     try:
         with open(DATABASE_PATH, 'r', encoding='utf-8') as f:
+            metrics.inc('storage_bytes_total', os.fstat(f.fileno()).st_size, file='products', op='read')
             return json.load(f)
     except (json.JSONDecodeError, FileNotFoundError):
         # Return an empty list if the file is empty, not found, or corrupted
         return []
 
-def _save_all_parks(parks):
-    """Saves a list of parks to the JSON database file."""
+@metrics.timed('storage_call', call='data_manager.iter_parks')
+def iter_parks(admin_id=None):
+    """Yields parks one at a time, optionally only those of one admin (merchant)."""
+    for park in get_all_parks():
+        if admin_id is None or park.get('admin_id') == admin_id:
+            yield park
+
+@metrics.timed('storage_call', call='data_manager.save_all_parks')
+def _save_all_parks(parks, previous=None):
+    """Saves a list of parks to the JSON database file. Callers hold the file lock.
+
+    `previous` maps the ids of changed parks to their state before the change.
+    """
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-    with open(DATABASE_PATH, 'w', encoding='utf-8') as f:
+    before = get_catalog_signature()
+    # Swap in a complete file, so readers in other workers never see a partial one.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(DATABASE_PATH), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
         json.dump(parks, f, indent=2, ensure_ascii=False)
+        metrics.inc('storage_bytes_total', f.tell(), file='products', op='write')
+    os.replace(temp_path, DATABASE_PATH)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(DATABASE_PATH), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(str((before[0] if before else 0) + 1))
+    os.replace(temp_path, VERSION_PATH)
+    _last_write['before'] = before
+    _last_write['after'] = get_catalog_signature()
+    _last_write['previous'] = previous or {}
 
-def add_park(park_data, image_extensions, admin_id):
-    """Adds a new park to the database, generating the ID and multiple filenames."""
-    parks = get_all_parks()
-    new_id = _get_next_id(parks)
-    
-    # Generate a list of filenames, one for each uploaded image extension
-    filenames = [f"{new_id}_{i+1}.{ext}" for i, ext in enumerate(image_extensions)]
-    
-    new_park = {
+def _build_park(new_id, park_data, image_filenames, admin_id):
+    """Creates a new park record referencing already stored images."""
+    return {
         'id': new_id,
         'name': park_data.get('name'),
         'location': park_data.get('location'),
@@ -49,7 +142,7 @@ def add_park(park_data, image_extensions, admin_id):
         'date_added': datetime.now(timezone.utc).isoformat(), # Automatically add timestamp
         'web_details': park_data.get('web_details'),
         'type': park_data.get('type'),
-        'image_filenames': filenames, # Store a list of filenames
+        'image_filenames': list(image_filenames),
         'link1': park_data.get('link1'), # Added link1
         'link2': park_data.get('link2'),  # Added link2
         'admin_id': admin_id,
@@ -57,10 +150,33 @@ def add_park(park_data, image_extensions, admin_id):
         'inquiries': 0,
         'home_delivery': park_data.get('home_delivery', False) # Add the home_delivery field
     }
-    parks.append(new_park)
+
+@metrics.timed('storage_call', call='data_manager.add_park')
+def add_park(park_data, image_filenames, admin_id):
+    """Adds a new park to the database, generating its ID."""
+    return add_parks([(park_data, image_filenames)], admin_id)[0]
+
+@metrics.timed('storage_call', call='data_manager.add_parks')
+@file_lock.locked(DATABASE_PATH) # Read-modify-write: one worker at a time
+def add_parks(new_parks_data, admin_id):
+    """Adds several parks with a single read and write of the database.
+
+    `new_parks_data` is a list of (park_data, image_filenames) pairs, with the
+    images already stored by image_store.put(). IDs are allocated
+    consecutively after the current highest one, so the id scan runs once per
+    batch instead of once per product. Returns the new parks in order.
+    """
+    parks = get_all_parks()
+    next_id_num = int(_get_next_id(parks))
+    new_parks = []
+    for offset, (park_data, image_filenames) in enumerate(new_parks_data):
+        new_parks.append(_build_park(f"{next_id_num + offset:06d}", park_data, image_filenames, admin_id))
+    parks.extend(new_parks)
     _save_all_parks(parks)
-    return new_park
+    _notify_many('add', new_parks)
+    return new_parks
 
+@metrics.timed('storage_call', call='data_manager.get_park_by_id')
 def get_park_by_id(park_id):
     """Finds a single park by its string ID."""
     parks = get_all_parks()
@@ -69,8 +185,10 @@ def get_park_by_id(park_id):
             return park
     return None # Return None if no park is found
 
-def update_park(park_id, update_data, new_image_extensions=None):
-    """Updates an existing park's details and optionally its image filename."""
+@metrics.timed('storage_call', call='data_manager.update_park')
+@file_lock.locked(DATABASE_PATH)
+def update_park(park_id, update_data):
+    """Updates an existing park's details (including 'image_filenames', if given)."""
     parks = get_all_parks()
     park_to_update = None
     for park in parks:
@@ -83,6 +201,7 @@ def update_park(park_id, update_data, new_image_extensions=None):
     
     # Get the list of old filenames to be returned for deletion
     old_image_filenames = park_to_update.get('image_filenames', [])
+    previous = dict(park_to_update)
     
     # Update fields from the provided data
     for key, value in update_data.items():
@@ -92,13 +211,12 @@ def update_park(park_id, update_data, new_image_extensions=None):
     # Explicitly handle the home_delivery checkbox, as it might be a new key
     park_to_update['home_delivery'] = update_data.get('home_delivery', False)
 
-    # If new images are being uploaded, replace the list of filenames
-    if new_image_extensions:
-        park_to_update['image_filenames'] = [f"{park_id}_{i+1}.{ext}" for i, ext in enumerate(new_image_extensions)]
-    
-    _save_all_parks(parks)
+    _save_all_parks(parks, {park_id: previous})
+    _notify('update', park_to_update)
     return park_to_update, old_image_filenames
 
+@metrics.timed('storage_call', call='data_manager.delete_park')
+@file_lock.locked(DATABASE_PATH)
 def delete_park(park_id):
     """Deletes a park from the database and returns the deleted park data."""
     parks = get_all_parks()
@@ -111,29 +229,36 @@ def delete_park(park_id):
     if park_to_delete:
         parks.remove(park_to_delete)
         _save_all_parks(parks)
+        _notify('delete', park_to_delete)
         return park_to_delete
     return None # Return None if the park was not found
 
+@metrics.timed('storage_call', call='data_manager.increment_product_view')
+@file_lock.locked(DATABASE_PATH)
 def increment_product_view(product_id):
     """Increments the view count for a specific product."""
     parks = get_all_parks()
-    product_found = False
+    product_found = None
     for park in parks:
         if park.get('id') == product_id:
             park['views'] = park.get('views', 0) + 1
-            product_found = True
+            product_found = park
             break
     if product_found:
         _save_all_parks(parks)
+        _notify('view', product_found)
 
+@metrics.timed('storage_call', call='data_manager.increment_product_inquiry')
+@file_lock.locked(DATABASE_PATH)
 def increment_product_inquiry(product_id):
     """Increments the inquiry count for a specific product."""
     parks = get_all_parks()
-    product_found = False
+    product_found = None
     for park in parks:
         if park.get('id') == product_id:
             park['inquiries'] = park.get('inquiries', 0) + 1
-            product_found = True
+            product_found = park
             break
     if product_found:
-        _save_all_parks(parks)
\ No newline at end of file
+        _save_all_parks(parks)
+        _notify('inquiry', product_found)
\ No newline at end of file
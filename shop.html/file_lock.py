@@ -0,0 +1,94 @@
+import contextlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the app runs as a single development process.
+    fcntl = None
+
+try:
+    from greenlet import getcurrent
+except ImportError:
+    # Installed with eventlet; without it every caller is a plain thread.
+    getcurrent = None
+
+# Cross-process locks for the JSON stores. With several workers (serve.py),
+# each one does read-modify-write cycles on products.json, users.json and
+# conversations.json; holding the file's lock from the read to the write keeps
+# one worker from overwriting another's change. The lock is an flock on a
+# "<file>.lock" sidecar, so it also serializes threads of the same process.
+# Re-entering a lock the current thread already holds is allowed (e.g.
+# data_manager.add_park calling add_parks).
+#
+# Under eventlet all green threads share one OS thread, so holders are told
+# apart by greenlet, not by thread. Green threads of one process queue on a
+# green semaphore before the flock, and waiting for another process's flock
+# happens on a native thread (tpool), so the hub keeps serving meanwhile.
+
+_state = {
+    'depth': {},           # (holder, path) -> how many times the holder has entered the lock
+    'green_locks': None,   # path -> eventlet semaphore, when running under eventlet
+    'tpool': None
+}
+
+def configure(async_mode):
+    """Picks how waiting for a lock is done for the server's async mode (as password_hashing does)."""
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        _state['green_locks'] = {}
+        _state['tpool'] = tpool
+    else:
+        _state['green_locks'] = None
+        _state['tpool'] = None
+
+def _holder():
+    return getcurrent() if getcurrent is not None else threading.get_ident()
+
+def _flock(lock_file):
+    if _state['tpool'] is None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        _state['tpool'].execute(fcntl.flock, lock_file, fcntl.LOCK_EX) # Held by another process
+
+@contextlib.contextmanager
+def _green_lock(path):
+    green_locks = _state['green_locks']
+    if green_locks is None:
+        yield
+        return
+    if path not in green_locks:
+        from eventlet.semaphore import Semaphore
+        green_locks[path] = Semaphore(1)
+    with green_locks[path]:
+        yield
+
+@contextlib.contextmanager
+def locked(path):
+    """Holds an exclusive lock on `path` for the duration of the with-block (or decorated call)."""
+    key = (_holder(), path)
+    depth = _state['depth']
+    if fcntl is None or depth.get(key):
+        depth[key] = depth.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            depth[key] -= 1
+            if not depth[key]:
+                del depth[key]
+        return
+
+    lock_path = path + '.lock'
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with _green_lock(path), open(lock_path, 'a') as lock_file:
+        _flock(lock_file)
+        depth[key] = 1
+        try:
+            yield
+        finally:
+            del depth[key]
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+import blob_storage
+import data_manager
+import images
+import metrics
+
+# Content-addressed storage for product images. An upload is named by the
+# SHA-256 of its bytes (plus the output format), so the same photo uploaded for
+# many listings is resized and encoded once and stored once. Products keep
+# referencing images through 'image_filenames'; stored names look like
+# "store/ab/abcd....jpg" and are blob_storage keys, so the existing
+# /static/images/<filename> URLs keep working.
+#
+# Each stored image has a reference count in a small SQLite table. register()
+# keeps the counts in step with the catalog: a data_manager listener retains a
+# product's images when it is added, releases them when it is deleted, and
+# diffs the old and new image_filenames of an update. Listeners run inside the
+# catalog write lock, so two concurrent edits of one product each see the
+# images the other left behind and never release the same one twice. Images
+# whose count drops to zero are deleted by collect_garbage(), which runs in the
+# background and leaves them alone for IMAGE_GC_GRACE_SECONDS, so an image that
+# was just stored for a product being created is not collected before the
+# product is saved. Older per-product names ("000123_1.jpg") are not in the
+# store; release() deletes those files directly, as before.
+
+STORE_PREFIX = 'store/'
+STORE_DB = os.environ.get('IMAGE_STORE_DB', os.path.join('image_store', 'image_store.db'))  # Not under static/: never served
+IMAGE_GC_INTERVAL_SECONDS = int(os.environ.get('IMAGE_GC_INTERVAL_SECONDS', 600))  # 0 disables the collector
+IMAGE_GC_GRACE_SECONDS = int(os.environ.get('IMAGE_GC_GRACE_SECONDS', 3600))
+
+def _connect():
+    os.makedirs(os.path.dirname(STORE_DB), exist_ok=True)
+    conn = sqlite3.connect(STORE_DB, timeout=30, isolation_level=None)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            name TEXT PRIMARY KEY,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            size INTEGER,
+            updated REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS blobs_unreferenced ON blobs (refcount, updated)")
+    return conn
+
+def is_stored(filename):
+    return isinstance(filename, str) and filename.startswith(STORE_PREFIX)
+
+def put(source, extension):
+    """Stores an uploaded product image (a file object) and returns its filename.
+
+    The upload is spooled to disk and hashed in chunks, so it is never held in
+    memory whole; identical uploads return the existing image without
+    processing it again. The image is unreferenced until retain() is called
+    for it. Raises images.ImageRejected for uploads over the size limits.
+    """
+    storage = blob_storage.get_storage()
+    temp_path, digest = images.spool(source, images.UPLOAD_TMP_DIR)
+    try:
+        filename = f"{STORE_PREFIX}{digest[:2]}/{digest}.{extension}"
+
+        conn = _connect()
+        try:
+            # Touch the row first: a concurrent collect_garbage() either sees it as
+            # recently used, or has already removed it and the file is rebuilt below.
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO blobs (name, updated) VALUES (?, ?) "
+                         "ON CONFLICT(name) DO UPDATE SET updated = excluded.updated", (filename, time.time()))
+            conn.execute("COMMIT")
+            if storage.exists(filename):
+                metrics.inc('image_store_uploads_total', result='deduplicated')
+                return filename
+
+            fd, output_path = tempfile.mkstemp(dir=images.UPLOAD_TMP_DIR, prefix='.output-', suffix='.' + extension)
+            os.close(fd)
+            try:
+                images.save_product_image(temp_path, output_path)
+                size = os.path.getsize(output_path)
+                storage.put_file(filename, output_path)
+            except BaseException:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            conn.execute("UPDATE blobs SET size = ? WHERE name = ?", (size, filename))
+            metrics.inc('image_store_uploads_total', result='stored')
+        finally:
+            conn.close()
+    finally:
+        os.remove(temp_path)
+    return filename
+
+def _adjust(filenames, delta):
+    stored = [name for name in filenames if is_stored(name)]
+    if not stored:
+        return
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for name in stored:
+                conn.execute("INSERT INTO blobs (name, refcount, updated) VALUES (?, MAX(?, 0), ?) "
+                             "ON CONFLICT(name) DO UPDATE SET refcount = MAX(refcount + ?, 0), updated = ?",
+                             (name, delta, now, delta, now))
+    finally:
+        conn.close()
+
+def retain(filenames):
+    """Counts one more reference to each stored image in `filenames` (once per occurrence)."""
+    _adjust(filenames, 1)
+
+def release(filenames):
+    """Drops one reference to each stored image; per-product files from before the store are deleted now."""
+    _adjust(filenames, -1)
+    storage = blob_storage.get_storage()
+    for name in filenames:
+        if name and not is_stored(name) and blob_storage.valid_key(name):
+            storage.delete(name)
+
+def collect_garbage(grace_seconds=None):
+    """Deletes stored images nothing has referenced for the grace period; returns how many were removed."""
+    grace_seconds = IMAGE_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    conn = _connect()
+    try:
+        with conn:
+            # Files are removed while holding the write lock, so put() cannot
+            # reuse one of them in between.
+            conn.execute("BEGIN IMMEDIATE")
+            names = [row[0] for row in conn.execute(
+                "SELECT name FROM blobs WHERE refcount <= 0 AND updated < ?", (time.time() - grace_seconds,))]
+            storage = blob_storage.get_storage()
+            for name in names:
+                storage.delete(name)
+                conn.execute("DELETE FROM blobs WHERE name = ?", (name,))
+    finally:
+        conn.close()
+    if names:
+        metrics.inc('image_store_collected_total', len(names))
+    return len(names)
+
+def reconcile(parks):
+    """Recomputes every reference count from the products (e.g. after restoring products.json from a backup)."""
+    counts = {}
+    for park in parks:
+        for name in park.get('image_filenames') or []:
+            if is_stored(name):
+                counts[name] = counts.get(name, 0) + 1
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE blobs SET refcount = 0, updated = ? WHERE refcount != 0", (now,))
+            for name, count in counts.items():
+                conn.execute("INSERT INTO blobs (name, refcount, updated) VALUES (?, ?, ?) "
+                             "ON CONFLICT(name) DO UPDATE SET refcount = excluded.refcount",
+                             (name, count, now))
+    finally:
+        conn.close()
+    return counts
+
+def _on_catalog_change(event, park):
+    """data_manager listener: moves references as products gain and lose images."""
+    if event == 'add':
+        retain(park.get('image_filenames') or [])
+    elif event == 'delete':
+        release(park.get('image_filenames') or [])
+    elif event == 'update':
+        previous = data_manager.previous_version(park.get('id'))
+        if previous is None:
+            return
+        old = Counter(previous.get('image_filenames') or [])
+        new = Counter(park.get('image_filenames') or [])
+        retain(list((new - old).elements()))
+        release(list((old - new).elements()))
+
+def _on_catalog_changes(event, parks):
+    """Batch form of _on_catalog_change: one transaction for a whole bulk import."""
+    if event == 'add':
+        retain([name for park in parks for name in park.get('image_filenames') or []])
+    else:
+        for park in parks:
+            _on_catalog_change(event, park)
+
+_registered = {'done': False}
+
+def register():
+    """Keeps reference counts in step with this process's catalog writes (the app and the import CLI call this)."""
+    if not _registered['done']:
+        _registered['done'] = True
+        data_manager.add_listener(_on_catalog_change, batch_callback=_on_catalog_changes)
+
+def stats():
+    """Returns {"images", "referenced", "bytes"} for the store."""
+    conn = _connect()
+    try:
+        images_count, referenced, total_bytes = conn.execute(
+            "SELECT COUNT(*), SUM(refcount > 0), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+    finally:
+        conn.close()
+    return {"images": images_count, "referenced": referenced or 0, "bytes": total_bytes}
+
+def run_collector(sleep):
+    """Background task collecting unreferenced images every IMAGE_GC_INTERVAL_SECONDS."""
+    while True:
+        sleep(IMAGE_GC_INTERVAL_SECONDS)
+        try:
+            collect_garbage()
+        except Exception as e:
+            print(f"ERROR: image garbage collection failed: {e}")
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'reconcile':
+        print(f"{len(reconcile(data_manager.get_all_parks()))} stored image(s) referenced")
+    elif command == 'collect':
+        print(f"{collect_garbage()} unreferenced image(s) removed")
+    elif command == 'stats':
+        print(stats())
+    else:
+        sys.exit("usage: python image_store.py [stats|reconcile|collect]")
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import metrics
+
+# Shared image processing for uploads, so the product form, profile photos and
+# bulk imports all resize and encode images the same way. Pillow is imported on
+# first use, so workers that never handle an upload do not load it at start-up.
+#
+# Memory is what uploads cost most, so every image goes through the same
+# limits: at most MAX_UPLOAD_BYTES per file, at most MAX_IMAGE_PIXELS
+# (checked from the header, before anything is decoded), and at most
+# IMAGE_DECODE_CONCURRENCY decodes at a time per process. JPEGs are decoded
+# with draft mode at the smallest 1/2, 1/4 or 1/8 scale still at least as big
+# as the target, so a 50-megapixel photo headed for 800x800 never exists in
+# memory at full resolution. The request body itself is limited by
+# MAX_CONTENT_LENGTH (app.py), and Werkzeug spools uploaded files to disk.
+#
+# Under eventlet (configure()), the decode slots are a green semaphore, and the
+# copying, hashing, decoding and encoding run on native threads (tpool), so a
+# request waiting for a slot or for Pillow parks only its own green thread.
+
+IMAGE_FOLDER = os.path.join('static', 'images')
+UPLOAD_TMP_DIR = os.path.join(IMAGE_FOLDER, '.uploads') # Scratch space; never served (see blob_storage.valid_key)
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+PRODUCT_IMAGE_SIZE = (800, 800)
+PROFILE_PHOTO_SIZE = (200, 200)
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 15 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+IMAGE_DECODE_CONCURRENCY = int(os.environ.get('IMAGE_DECODE_CONCURRENCY', 2))
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+_offload = {'slots': None, 'run': None}
+
+def configure(async_mode):
+    """Picks the decode-slot semaphore and how image work is offloaded for the server's async mode."""
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        from eventlet.semaphore import BoundedSemaphore
+        _offload['slots'] = BoundedSemaphore(IMAGE_DECODE_CONCURRENCY)
+        _offload['run'] = tpool.execute
+    else:
+        _offload['slots'] = threading.BoundedSemaphore(IMAGE_DECODE_CONCURRENCY)
+        _offload['run'] = lambda func, *args, **kwargs: func(*args, **kwargs)
+
+def _slots():
+    if _offload['slots'] is None:
+        configure(None)
+    return _offload['slots']
+
+def _run(func, *args, **kwargs):
+    if _offload['run'] is None:
+        configure(None)
+    return _offload['run'](func, *args, **kwargs)
+
+class ImageRejected(ValueError):
+    """An upload that is too large, too many pixels, or not an image. The message is safe to show."""
+
+def spool(source, directory, suffix=''):
+    """Copies an upload to a temporary file in `directory`, hashing it on the way.
+
+    Returns (temp_path, sha256 hex digest). Raises ImageRejected past
+    MAX_UPLOAD_BYTES, without reading further.
+    """
+    return _run(_spool, source, directory, suffix)
+
+def _spool(source, directory, suffix):
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix=suffix)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: source.read(SPOOL_CHUNK_BYTES), b''):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ImageRejected(f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+def _thumbnail(source, size):
+    """Decodes an image at no more than the resolution needed for `size` and shrinks it to fit."""
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = None # Replaced by the check below, which rejects instead of warning
+    try:
+        img = Image.open(source) # Reads the header only
+    except OSError as e:
+        raise ImageRejected("File is not a readable image.") from e
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"Image has too many pixels ({width}x{height}, limit {MAX_IMAGE_PIXELS}).")
+    img.draft(img.mode, size) # JPEG only: decode straight at a reduced scale
+    img.thumbnail(size)
+    return img
+
+def _resize(source, path, size, **save_options):
+    _thumbnail(source, size).save(path, **save_options)
+
+@metrics.timed('image_processing', op='product_image')
+def save_product_image(source, path):
+    """Resizes an uploaded product image to at most 800x800 and saves it (format from the path's extension)."""
+    with _slots():
+        _run(_resize, source, path, PRODUCT_IMAGE_SIZE, quality=95, optimize=True)
+    metrics.inc('image_output_bytes_total', os.path.getsize(path), op='product_image')
+
+@metrics.timed('image_processing', op='profile_photo')
+def save_profile_photo(source, path):
+    """Resizes a profile photo to at most 200x200 and saves it."""
+    temp_path, _ = spool(source, UPLOAD_TMP_DIR)
+    try:
+        with _slots():
+            _run(_resize, temp_path, path, PROFILE_PHOTO_SIZE, quality=90)
+    finally:
+        os.remove(temp_path)
+    metrics.inc('image_output_bytes_total', os.path.getsize(path), op='profile_photo')
@@ -0,0 +1,31 @@
+from flask import Response, current_app
+
+# Streaming JSON arrays for large list responses. jsonify() renders the whole
+# body as one string before sending anything, so a big catalog or chat history
+# costs its full serialized size in memory for every concurrent request. Here
+# each element is serialized on its own as the client reads the response, and
+# only a few elements' worth of text is held at a time.
+#
+# The status and headers go out before the first element is serialized, so any
+# validation that can fail must happen before the response is created.
+
+CHUNK_ITEMS = 64   # elements per chunk handed to the server
+
+def _array_chunks(items, dumps):
+    buffer = ['[']
+    first = True
+    for item in items:
+        if not first:
+            buffer.append(',')
+        buffer.append(dumps(item, separators=(',', ':'))) # Compact, like jsonify
+        first = False
+        if len(buffer) >= CHUNK_ITEMS * 2:
+            yield ''.join(buffer)
+            buffer = []
+    buffer.append(']')
+    yield ''.join(buffer)
+
+def stream_json_array(items, status=200):
+    """Returns a response that serializes an iterable (e.g. a generator) as a JSON array, one element at a time."""
+    # Bind the app's JSON settings now; the generator runs after the request context is gone.
+    return Response(_array_chunks(items, current_app.json.dumps), status=status, mimetype='application/json')
@@ -0,0 +1,158 @@
+import bisect
+import functools
+import hmac
+import inspect
+import os
+import threading
+import time
+
+from flask import g, request
+
+# In-process metrics in the Prometheus text format, served on /metrics.
+#
+# Latency histograms use fixed buckets, so recording a value is a bisect and a
+# few additions under a lock. Labels are kept to values with a small fixed set
+# (route patterns, function and event names), never ids or query strings.
+# Every process keeps its own numbers; with several workers, scrape each one.
+#
+# /metrics is only served when METRICS_TOKEN is set, to scrapers that send
+# "Authorization: Bearer <token>". The client address is never trusted: behind
+# a proxy on the same host (serve.py) every request comes from loopback.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+_lock = threading.Lock()
+_descriptions = {
+    'http_request_duration_seconds': ('histogram', 'Flask request handling time by route, method and status.'),
+    'http_response_bytes_total': ('counter', 'Response body bytes by route (responses with a known length).'),
+    'http_request_errors_total': ('counter', 'Requests that raised an unhandled exception, by route.'),
+    'storage_call_duration_seconds': ('histogram', 'Time spent in data_manager and JSON storage helpers.'),
+    'storage_call_errors_total': ('counter', 'Storage calls that raised, by call.'),
+    'storage_bytes_total': ('counter', 'Bytes read from and written to the JSON data files.'),
+    'image_processing_duration_seconds': ('histogram', 'Pillow resize and encode time, by operation.'),
+    'image_processing_errors_total': ('counter', 'Image processing calls that raised, by operation.'),
+    'image_output_bytes_total': ('counter', 'Bytes of encoded images written, by operation.'),
+    'image_store_uploads_total': ('counter', 'Product image uploads, by result (stored or deduplicated).'),
+    'image_store_collected_total': ('counter', 'Unreferenced stored images deleted by the collector.'),
+    'socketio_event_duration_seconds': ('histogram', 'Socket.IO event handler time, by event.'),
+    'socketio_event_errors_total': ('counter', 'Socket.IO event handlers that raised, by event.'),
+}
+_histograms = {}   # name -> {labels: [count per bucket..., +Inf count, sum]}
+_counters = {}     # name -> {labels: value}
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def observe(name, value, **labels):
+    """Records one value in a histogram."""
+    key = _label_key(labels)
+    index = bisect.bisect_left(LATENCY_BUCKETS, value)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        counts[index] += 1
+        counts[-1] += value
+
+def inc(name, amount=1, **labels):
+    """Adds to a counter."""
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+def timed(kind, **labels):
+    """Decorator recording a function's duration in <kind>_duration_seconds and failures in <kind>_errors_total.
+
+    Generator functions are timed from their first to their last item.
+    """
+    def decorator(func):
+        histogram, errors = f"{kind}_duration_seconds", f"{kind}_errors_total"
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    yield from func(*args, **kwargs)
+                except Exception:
+                    inc(errors, **labels)
+                    raise
+                finally:
+                    observe(histogram, time.perf_counter() - started, **labels)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                inc(errors, **labels)
+                raise
+            finally:
+                observe(histogram, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {name: {key: list(counts) for key, counts in series.items()} for name, series in _histograms.items()}
+        counters = {name: dict(series) for name, series in _counters.items()}
+    lines = []
+    for name in sorted(set(histograms) | set(counters)):
+        kind, text = _descriptions.get(name, ('histogram' if name in histograms else 'counter', ''))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in sorted(counters.get(name, {}).items()):
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for key, counts in sorted(histograms.get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {counts[-1]}")
+            lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def scrape_allowed():
+    """Whether the current request may read /metrics (it carries the METRICS_TOKEN bearer token)."""
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}")
+
+def init_app(app):
+    """Times every request of a Flask app (for streamed responses, up to the first byte)."""
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = _route_label()
+            observe('http_request_duration_seconds', time.perf_counter() - started,
+                    route=route, method=request.method, status=response.status_code)
+            if response.content_length is not None and not response.is_streamed:
+                inc('http_response_bytes_total', response.content_length, route=route)
+        return response
+
+    @app.teardown_request
+    def _record_request_error(error):
+        if error is not None:
+            inc('http_request_errors_total', route=_route_label())
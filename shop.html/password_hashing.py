@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing is deliberately slow. Run on the Socket.IO event loop it
+# stalls every connected client for the duration of a login, so the work is
+# handed to real OS threads (hashlib's scrypt/pbkdf2 release the GIL) with a
+# cap on how many hashes run at once.
+
+# Any werkzeug method string, e.g. 'scrypt' or 'pbkdf2:sha256:600000'.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+MAX_CONCURRENT_HASHES = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+
+_pool = {'run': None, 'method_prefix': None}
+
+def configure(async_mode):
+    """Picks how hashing is offloaded for the server's async mode."""
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        from eventlet.semaphore import BoundedSemaphore
+        # tpool runs the call on a native thread and only parks the calling
+        # green thread, so the hub keeps serving other clients meanwhile.
+        slots = BoundedSemaphore(MAX_CONCURRENT_HASHES)
+        def run(func, *args):
+            with slots:
+                return tpool.execute(func, *args)
+    else:
+        executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_HASHES, thread_name_prefix='password-hash')
+        def run(func, *args):
+            return executor.submit(func, *args).result()
+    _pool['run'] = run
+
+def _run(func, *args):
+    if _pool['run'] is None:
+        configure(None)
+    return _pool['run'](func, *args)
+
+def hash_password(password):
+    """Hashes a password with the configured method, off the event loop."""
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    """Checks a password against a stored hash, off the event loop."""
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+def needs_rehash(password_hash):
+    """True if a stored hash was made with different parameters than configured."""
+    if _pool['method_prefix'] is None:
+        # werkzeug fills in default parameters ('scrypt' -> 'scrypt:32768:8:1'),
+        # so learn the canonical form once from a throwaway hash.
+        _pool['method_prefix'] = hash_password('').split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _pool['method_prefix']
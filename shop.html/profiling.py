@@ -0,0 +1,205 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, request
+
+# Opt-in profiling of real traffic. A sampled fraction of Flask requests and
+# Socket.IO events (PROFILE_SAMPLE_RATE, 0 disables) runs under cProfile, and
+# the profile is kept with the route, method and query parameters. Requests
+# slower than PROFILE_SLOW_MS are always recorded; if they were not sampled the
+# record has no profile, but the next request to the same route is profiled,
+# so a route that is slow keeps producing profiles to look at.
+#
+# Records go to a bounded ring of files in PROFILE_DIR: one JSON summary (top
+# functions by cumulative time) plus the raw .prof for snakeviz or pstats.
+# Every worker writes to the same directory, so it is listed again whenever
+# records are listed or the ring is pruned, never cached per process.
+# Only one profile runs at a time; under eventlet all requests share an OS
+# thread and a second profiler would mix their frames together. That sharing
+# also means a profile taken under eventlet includes whatever other green
+# threads ran while the sampled request waited, so their cost is attributed to
+# it. Such records are flagged 'shared_thread' and /admin/profiles says so.
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))    # 0 disables slow-request capture
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')          # Not under static/: never served directly
+PROFILE_MAX_RECORDS = int(os.environ.get('PROFILE_MAX_RECORDS', 200))
+PROFILE_TOP_FUNCTIONS = 40
+
+_active = threading.Lock()          # Held while a profile is running
+_profile_next = set()               # Routes/events whose next call is profiled (after a slow one)
+_records_lock = threading.Lock()    # One pruning pass at a time in this process
+_mode = {'shared_thread': False}    # Set by configure()
+
+def configure(async_mode):
+    """Notes whether requests share one OS thread (eventlet), which blurs profiles."""
+    _mode['shared_thread'] = async_mode == 'eventlet'
+
+def shared_thread():
+    return _mode['shared_thread']
+
+def enabled():
+    return PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+def _start(target):
+    """Starts a profiler for `target` if it is sampled and none is running; returns it or None."""
+    forced = target in _profile_next
+    if not forced and random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if not _active.acquire(blocking=False):
+        return None
+    _profile_next.discard(target)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def _stop(profiler):
+    profiler.disable()
+    _active.release()
+
+def _summarize(profiler):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (calls, primitive_calls, total, cumulative, _) in stats.stats.items():
+        rows.append({"function": function, "file": filename, "line": line, "calls": calls,
+                     "total_ms": round(total * 1000, 3), "cumulative_ms": round(cumulative * 1000, 3)})
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:PROFILE_TOP_FUNCTIONS]
+
+def _load_ids():
+    """Returns the ids of all stored records, oldest first (ids sort by time)."""
+    try:
+        names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    except FileNotFoundError:
+        names = []
+    return [name[:-len('.json')] for name in names]
+
+def _save(record, profiler):
+    """Writes a record (and its raw profile) and drops the oldest records beyond the ring size."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(PROFILE_DIR, record['id'] + '.prof'))
+    temp_path = os.path.join(PROFILE_DIR, record['id'] + '.json.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+    os.replace(temp_path, os.path.join(PROFILE_DIR, record['id'] + '.json'))
+    with _records_lock:
+        ids = _load_ids() # Includes records of the other workers
+        for old_id in ids[:max(0, len(ids) - PROFILE_MAX_RECORDS)]:
+            for extension in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, old_id + extension))
+                except FileNotFoundError:
+                    pass
+
+def _finish(kind, target, started, profiler, details):
+    """Stops the profiler and stores a record if the call was sampled or slow."""
+    duration_ms = (time.perf_counter() - started) * 1000
+    if profiler is not None:
+        _stop(profiler)
+    slow = PROFILE_SLOW_MS > 0 and duration_ms >= PROFILE_SLOW_MS
+    if profiler is None and not slow:
+        return
+    if slow and profiler is None:
+        _profile_next.add(target)
+    now = datetime.now(timezone.utc)
+    record = {
+        # Sortable by time, unique across processes.
+        "id": f"{now.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}",
+        "timestamp": now.isoformat(),
+        "kind": kind,
+        "target": target,
+        "duration_ms": round(duration_ms, 2),
+        "slow": slow,
+        "sampled": profiler is not None,
+        "shared_thread": profiler is not None and _mode['shared_thread'],
+        "pid": os.getpid(),
+        "top": _summarize(profiler) if profiler is not None else [],
+        **details
+    }
+    try:
+        _save(record, profiler)
+    except OSError as e:
+        print(f"ERROR: could not save profile {record['id']}: {e}")
+
+def list_records(limit=100):
+    """Returns the newest stored records, without their function tables."""
+    records = []
+    for record_id in reversed(_load_ids()):
+        record = load_record(record_id)
+        if record is None:
+            continue
+        record.pop('top', None)
+        records.append(record)
+        if len(records) >= limit:
+            break
+    return records
+
+def load_record(record_id):
+    """Returns one stored record, or None if it is unknown or has rotated out."""
+    if not _valid_id(record_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, record_id + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def profile_path(record_id):
+    """Path of a record's raw .prof file, or None if it has none."""
+    if not _valid_id(record_id):
+        return None
+    path = os.path.join(PROFILE_DIR, record_id + '.prof')
+    return path if os.path.isfile(path) else None
+
+def _valid_id(record_id):
+    return bool(record_id) and all(c.isalnum() or c == '-' for c in record_id)
+
+def socket_event(event):
+    """Decorator profiling a Socket.IO event handler (event arguments are not stored: they hold chat text)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            target = f"socket:{event}"
+            started = time.perf_counter()
+            profiler = _start(target)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _finish('socketio', target, started, profiler, {"event": event})
+        return wrapper
+    return decorator
+
+def init_app(app):
+    """Profiles sampled Flask requests (for streamed responses, up to the first byte)."""
+    if not enabled():
+        return
+
+    @app.before_request
+    def _start_request_profile():
+        target = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.profile = (target, time.perf_counter(), _start(target))
+
+    @app.teardown_request
+    def _finish_request_profile(error):
+        state = g.pop('profile', None)
+        if state is None:
+            return
+        target, started, profiler = state
+        _finish('http', target, started, profiler, {
+            "method": request.method,
+            "path": request.path,
+            "params": {key: value[:200] for key, value in request.args.items() if key != 'password'},
+            "error": repr(error) if error is not None else None,
+        })
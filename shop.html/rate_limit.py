@@ -0,0 +1,45 @@
+import time
+
+# In-process token buckets. Each key (a user, a conversation, ...) holds up to
+# `burst` tokens that refill at `rate` tokens per second; an action spends one.
+
+_MAX_BUCKETS = 10000           # prune at once when a new key would go beyond this many
+PRUNE_INTERVAL_SECONDS = 60    # otherwise prune this often
+BUCKET_IDLE_SECONDS = 600      # a bucket untouched this long is forgotten
+
+_buckets = {}          # key -> [tokens, last_refill, rate, burst]
+_pruned = {'at': time.monotonic()}
+
+def _prune(now):
+    """Forgets buckets that have refilled completely (they are equivalent to new ones) or sat idle."""
+    _pruned['at'] = now
+    for key in [key for key, (tokens, updated, rate, burst) in list(_buckets.items())
+                if now - updated >= BUCKET_IDLE_SECONDS or tokens + (now - updated) * rate >= burst]:
+        _buckets.pop(key, None)
+
+def consume(key, rate, burst, now=None):
+    """Takes a token for `key` if one is available.
+
+    Returns (allowed, retry_after_seconds).
+    """
+    now = time.monotonic() if now is None else now
+    if now - _pruned['at'] >= PRUNE_INTERVAL_SECONDS:
+        _prune(now)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        if len(_buckets) >= _MAX_BUCKETS:
+            _prune(now)
+        bucket = _buckets[key] = [float(burst), now, rate, burst]
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens >= 1:
+        bucket[0] = tokens - 1
+        return True, 0.0
+    bucket[0] = tokens
+    return False, (1 - tokens) / rate
+
+def refund(key):
+    """Gives back a token taken by consume() for an action that did not happen."""
+    bucket = _buckets.get(key)
+    if bucket is not None:
+        bucket[0] += 1
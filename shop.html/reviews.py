@@ -0,0 +1,90 @@
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+
+# Merchant reviews live in their own SQLite file instead of inside each
+# merchant's record in users.json, so loading the user list (which happens on
+# almost every request) no longer drags every review ever written along with it.
+# The rating aggregates (ratings_total / ratings_count) stay on the merchant.
+
+REVIEWS_DB = os.environ.get('REVIEWS_DB', os.path.join('reviews', 'reviews.db'))  # Not under static/: never served
+
+def _connect():
+    os.makedirs(os.path.dirname(REVIEWS_DB), exist_ok=True)
+    conn = sqlite3.connect(REVIEWS_DB)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            merchant_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            rating INTEGER NOT NULL,
+            comment TEXT,
+            timestamp TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS reviews_by_merchant ON reviews (merchant_id, id)")
+    return conn
+
+def add_review(merchant_id, user_id, rating, comment, timestamp=None):
+    """Stores a single review and returns it as a dict."""
+    review = {
+        "merchant_id": merchant_id,
+        "user_id": user_id,
+        "rating": rating,
+        "comment": comment,
+        "timestamp": timestamp or datetime.now(timezone.utc).isoformat()
+    }
+    conn = _connect()
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO reviews (merchant_id, user_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (merchant_id, user_id, rating, comment, review['timestamp']))
+        review['id'] = cursor.lastrowid
+    finally:
+        conn.close()
+    return review
+
+def get_reviews(merchant_id, offset=0, limit=20):
+    """Returns (reviews, total) for a merchant, newest first."""
+    conn = _connect()
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM reviews WHERE merchant_id = ?", (merchant_id,)).fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, merchant_id, user_id, rating, comment, timestamp FROM reviews "
+            "WHERE merchant_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (merchant_id, limit, offset)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows], total
+
+def migrate_embedded_reviews(users):
+    """Moves any 'reviews' lists still embedded in user records into the store.
+
+    Mutates `users` in place and returns True if anything was moved, in which
+    case the caller must save the user list.
+    """
+    moved = False
+    conn = None
+    try:
+        for user in users:
+            embedded = user.pop('reviews', None)
+            if embedded is None:
+                continue
+            moved = True
+            if not embedded:
+                continue
+            if conn is None:
+                conn = _connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO reviews (merchant_id, user_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [(user.get('id'), review.get('user_id'), review.get('rating'), review.get('comment'),
+                      review.get('timestamp') or datetime.now(timezone.utc).isoformat())
+                     for review in sorted(embedded, key=lambda r: r.get('timestamp') or '')])
+    finally:
+        if conn is not None:
+            conn.close()
+    return moved
@@ -0,0 +1,321 @@
+import argparse
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# Production entry point: a small master process that runs several app
+# workers, restarts any that die, drains them on SIGTERM and replaces them one
+# by one on SIGHUP (zero-downtime reload).
+#
+#   python serve.py --workers 4 --port 5001                  # workers on 5001..5004
+#   python serve.py --workers 4 --port 5001 --shared-port    # all on 5001 (SO_REUSEPORT)
+#
+# Socket.IO's long-polling transport sends each client's requests to the
+# worker that holds its session, so clients must be sticky. By default every
+# worker listens on its own port (--port + index) for a proxy that pins each
+# client to one of them, e.g. nginx:
+#
+#   upstream shop { ip_hash; server 127.0.0.1:5001; server 127.0.0.1:5002; ... }
+#
+# --shared-port lets the kernel spread connections over the workers instead;
+# that is only sticky for clients on the websocket transport.
+#
+# Emits must reach clients connected to other workers, so with more than one
+# worker set SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0). The JSON
+# files are shared safely through file_lock. Chat rate limits and other
+# in-memory state are per worker.
+#
+# Under eventlet the standard library is not monkey-patched. Calls that can
+# block for long (password hashing, import images, waiting for another
+# worker's file lock) are handed to native threads explicitly (tpool); see the
+# configure() calls at the top of app.py.
+#
+# Worker life cycle: it starts warming up at start-up (snapshots.py) and tells
+# the master it is ready once warm-up is done. On SIGTERM it fails /readyz,
+# serves the connections already queued on its listening socket, closes it,
+# waits up to --drain-seconds for requests in flight, writes out buffered chat
+# messages, read marks, analytics and the catalog snapshot
+# (app.flush_pending_writes), and exits. Open Socket.IO
+# connections then drop and the clients reconnect to the remaining workers,
+# resending anything they had buffered.
+#
+# On reload the replacement is ready before the old worker is stopped. With
+# --shared-port each worker has its own SO_REUSEPORT socket and the kernel
+# resets whatever is still queued on a socket when it closes, so the old worker
+# keeps accepting until its queue is empty (BACKLOG_DRAIN_SECONDS at most)
+# before closing. A connect that lands in the instant between the last accept
+# and the close can still be reset; on Linux 5.14+ setting the sysctl
+# net.ipv4.tcp_migrate_req=1 hands those to the remaining workers instead.
+
+READY_TIMEOUT_SECONDS = 120
+RESPAWN_DELAY_SECONDS = 1.0
+BACKLOG_DRAIN_SECONDS = 5.0
+
+def _listen(host, port):
+    """Binds a listening socket that other workers (and a replacement worker) can share."""
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+def _has_pending(sock):
+    return bool(select.select([sock], [], [], 0)[0])
+
+def _accept_backlog(sock, handle, deadline):
+    """Accepts the connections queued on a listening socket and passes each to `handle(conn, address)`."""
+    sock.setblocking(False)
+    try:
+        while time.monotonic() < deadline:
+            try:
+                conn, address = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            conn.setblocking(True)
+            handle(conn, address)
+    finally:
+        sock.setblocking(True)
+
+def _pin_to_cpu(index):
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+
+class _InFlight:
+    """WSGI middleware counting HTTP requests in progress (Socket.IO traffic excluded: it is long-lived)."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, delta):
+        with self._lock:
+            self.count += delta
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/socket.io'):
+            return self.wsgi_app(environ, start_response)
+        self.add(1)
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.add(-1)
+            raise
+        return _ClosingBody(body, self)
+
+class _ClosingBody:
+    def __init__(self, body, in_flight):
+        self.body = body
+        self.in_flight = in_flight
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.in_flight.add(-1)
+
+def run_worker(args):
+    """Serves the app on one listening socket until SIGTERM, then drains and exits."""
+    if args.pin_cpus:
+        _pin_to_cpu(args.worker_index)
+    import app as shop_app
+
+    shop_app.prepare_data_files()
+    shop_app.start_background_tasks()
+    socketio = shop_app.socketio
+    in_flight = _InFlight(shop_app.app.wsgi_app)
+    shop_app.app.wsgi_app = in_flight
+    sock = _listen(args.host, args.worker_port)
+    state = {'draining': False, 'server': None}
+
+    def report_ready():
+        while shop_app.WARM_UP_ON_START and not shop_app.snapshots.readiness()[0]:
+            socketio.sleep(0.1)
+        if args.ready_fd is not None:
+            os.write(args.ready_fd, b'ready\n')
+            os.close(args.ready_fd)
+
+    def drain():
+        shop_app.snapshots.set_draining()
+        backlog_deadline = time.monotonic() + BACKLOG_DRAIN_SECONDS
+        if state['server'] is not None:
+            state['server'].shutdown() # werkzeug: its accept loop stops; the queued connections are ours to serve
+            _accept_backlog(sock, state['server'].process_request, backlog_deadline)
+            state['server'].server_close()
+        else:
+            while _has_pending(sock) and time.monotonic() < backlog_deadline:
+                socketio.sleep(0.05) # eventlet: the accept loop is still running and takes them
+        try:
+            sock.close() # eventlet: the accept loop ends
+        except OSError:
+            pass
+        deadline = time.monotonic() + args.drain_seconds
+        while in_flight.count > 0 and time.monotonic() < deadline:
+            socketio.sleep(0.1)
+        try:
+            shop_app.flush_pending_writes()
+        except Exception as e:
+            print(f"ERROR: could not flush pending writes on shutdown: {e}", file=sys.stderr)
+        sys.stdout.flush()
+        os._exit(0)
+
+    def on_sigterm(signum, frame):
+        if not state['draining']:
+            state['draining'] = True
+            socketio.start_background_task(drain)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The master handles Ctrl-C for the group
+    socketio.start_background_task(report_ready)
+
+    if socketio.async_mode == 'eventlet':
+        import eventlet.greenio
+        import eventlet.wsgi
+        try:
+            eventlet.wsgi.server(eventlet.greenio.GreenSocket(sock), shop_app.app, log_output=False)
+        except OSError:
+            if not state['draining']:
+                raise
+    else:
+        # Threading mode (no eventlet installed): werkzeug's threaded server on the pre-bound socket.
+        from werkzeug.serving import make_server
+        state['server'] = make_server(args.host, args.worker_port, shop_app.app, threaded=True, fd=sock.fileno())
+        state['server'].serve_forever()
+    while True: # The server loop ended because drain() closed it; drain() exits the process.
+        socketio.sleep(1)
+
+class Master:
+    """Keeps `workers` worker processes running and coordinates shutdown and reload."""
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}        # index -> Popen
+        self.stopping = False
+        self.reload_requested = False
+
+    def _port(self, index):
+        return self.args.port if self.args.shared_port else self.args.port + index
+
+    def _spawn(self, index):
+        """Starts worker `index`; returns (process, read end of its readiness pipe)."""
+        read_fd, write_fd = os.pipe()
+        command = [sys.executable, os.path.abspath(__file__), '--worker-index', str(index),
+                   '--host', self.args.host, '--worker-port', str(self._port(index)),
+                   '--drain-seconds', str(self.args.drain_seconds), '--ready-fd', str(write_fd)]
+        if self.args.pin_cpus:
+            command.append('--pin-cpus')
+        process = subprocess.Popen(command, pass_fds=(write_fd,))
+        os.close(write_fd)
+        return process, read_fd
+
+    def _wait_ready(self, process, read_fd):
+        """Waits for a worker's readiness message; returns False if it died or timed out."""
+        deadline = time.monotonic() + READY_TIMEOUT_SECONDS
+        try:
+            while time.monotonic() < deadline:
+                readable, _, _ = select.select([read_fd], [], [], 0.5)
+                if readable:
+                    return os.read(read_fd, 64).startswith(b'ready')
+                if process.poll() is not None:
+                    return False
+            return False
+        finally:
+            os.close(read_fd)
+
+    def _stop(self, process):
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+
+    def start(self):
+        pending = [(index,) + self._spawn(index) for index in range(self.args.workers)]
+        for index, process, read_fd in pending:
+            self.workers[index] = process
+            threading.Thread(target=self._wait_ready, args=(process, read_fd), daemon=True).start()
+        print(f"Started {self.args.workers} worker(s) on "
+              + (f"port {self.args.port}" if self.args.shared_port
+                 else f"ports {self.args.port}-{self.args.port + self.args.workers - 1}"), flush=True)
+
+    def reload(self):
+        """Replaces workers one at a time, each only after its replacement is ready."""
+        print("Reloading workers...", flush=True)
+        for index in sorted(self.workers):
+            if self.stopping:
+                return
+            old = self.workers[index]
+            process, read_fd = self._spawn(index)
+            if not self._wait_ready(process, read_fd):
+                print(f"Replacement for worker {index} did not become ready; keeping the old one.", flush=True)
+                self._stop(process)
+                continue
+            self.workers[index] = process
+            self._stop(old)
+            old.wait()
+        print("Reload complete.", flush=True)
+
+    def shutdown(self):
+        for process in self.workers.values():
+            self._stop(process)
+        deadline = time.monotonic() + self.args.drain_seconds + 15
+        for process in self.workers.values():
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, 'reload_requested', True))
+        self.start()
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            for index, process in list(self.workers.items()):
+                if process.poll() is not None and not self.stopping:
+                    print(f"Worker {index} exited with {process.returncode}; restarting.", flush=True)
+                    time.sleep(RESPAWN_DELAY_SECONDS)
+                    self.workers[index], read_fd = self._spawn(index)
+                    threading.Thread(target=self._wait_ready, args=(self.workers[index], read_fd), daemon=True).start()
+            time.sleep(0.5)
+        print("Shutting down: draining workers...", flush=True)
+        self.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the shop with several worker processes.')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5001)))
+    parser.add_argument('--shared-port', action='store_true', help='All workers on --port via SO_REUSEPORT.')
+    parser.add_argument('--pin-cpus', action='store_true', help='Pin worker N to the Nth available CPU.')
+    parser.add_argument('--drain-seconds', type=float, default=float(os.environ.get('DRAIN_SECONDS', 20)),
+                        help='How long a stopping worker waits for requests in flight.')
+    parser.add_argument('--worker-index', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker_index is not None:
+        run_worker(args)
+        return 0
+    if args.workers > 1 and not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        print("WARNING: SOCKETIO_MESSAGE_QUEUE is not set; real-time messages will only reach "
+              "clients connected to the same worker as the sender.", file=sys.stderr)
+    Master(args).run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import catalog_columns
+import catalog_index
+import chat_search
+import data_manager
+
+# Start-up warm-up and persisted catalog snapshots.
+#
+# Building catalog_index means parsing products.json and indexing every
+# product; catalog_columns then builds its arrays on top. A restarted worker
+# would pay that on its first requests. Instead, the built structures are
+# pickled to SNAPSHOT_DIR and a new worker loads them when they still describe
+# products.json: its (write counter, mtime, size) signature matches, or failing that
+# (e.g. the file was copied during a deploy) its SHA-256 does. Otherwise the
+# indexes are rebuilt and a fresh snapshot written.
+#
+# warm_up() runs in the background at start-up and records its progress for
+# the /readyz endpoint, so a load balancer only routes to warmed workers.
+# Afterwards the snapshot is rewritten every SNAPSHOT_INTERVAL_SECONDS while
+# the catalog keeps changing, and on shutdown. Snapshots are trusted local
+# files (pickle); keep SNAPSHOT_DIR writable by the app only.
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_FILE = os.path.join(SNAPSHOT_DIR, 'catalog.pickle')
+SNAPSHOT_FORMAT = 2   # bump when the layout of the index state changes
+SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 300))
+
+_readiness = {
+    'status': 'starting',     # starting -> warming -> ready (or failed) -> draining
+    'started_at': None,
+    'ready_at': None,
+    'steps': {},              # step name -> {"seconds", "source"}
+    'error': None,
+}
+_saved = {'signature': None}
+
+def _file_checksum(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+def save():
+    """Writes the current catalog indexes (and columns) to the snapshot file; returns True if written."""
+    state = catalog_index.export_state()
+    if state is None or state['signature'] is None:
+        return False
+    checksum = _file_checksum(data_manager.DATABASE_PATH)
+    if data_manager.get_catalog_signature() != state['signature']:
+        return False # The file changed under us; the next interval will catch up.
+    columns = None
+    if catalog_columns.available() and catalog_columns.is_current(state['generation']):
+        columns = catalog_columns.export_columns()
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "signature": state['signature'],
+        "checksum": checksum,
+        "index": state,
+        "columns": columns,
+    }
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, SNAPSHOT_FILE)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    _saved['signature'] = state['signature']
+    return True
+
+def load():
+    """Restores the catalog indexes from the snapshot if it matches products.json; returns True on success."""
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        print(f"WARNING: ignoring unreadable catalog snapshot: {e}")
+        return False
+    if not isinstance(payload, dict) or payload.get('format') != SNAPSHOT_FORMAT:
+        return False
+    if payload['index'].get('columnar') != catalog_columns.available():
+        return False # Written with(out) NumPy, so the fallback sets are missing or unused
+
+    signature = data_manager.get_catalog_signature()
+    if signature is None:
+        return False
+    if tuple(payload['signature']) != signature and payload['checksum'] != _file_checksum(data_manager.DATABASE_PATH):
+        return False
+
+    index = dict(payload['index'], signature=signature)
+    generation = catalog_index.restore_state(index)
+    if payload['columns'] is not None and catalog_columns.available():
+        catalog_columns.restore_columns(payload['columns'], generation)
+    _saved['signature'] = signature
+    return True
+
+def _step(name, func):
+    started = time.perf_counter()
+    source = func()
+    _readiness['steps'][name] = {"seconds": round(time.perf_counter() - started, 3), "source": source}
+
+def _warm_catalog():
+    if load():
+        return 'snapshot'
+    catalog_index.rebuild()
+    return 'rebuilt'
+
+def _warm_columns():
+    if not catalog_columns.available():
+        return 'unavailable'
+    catalog_index.filter_products(limit=1) # Builds the arrays if the snapshot had none
+    return 'ready'
+
+def _save_after_rebuild():
+    if _readiness['steps'].get('catalog_index', {}).get('source') != 'rebuilt':
+        return 'skipped'
+    return 'written' if save() else 'skipped'
+
+def _compile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    return 'compiled'
+
+def warm_up(app=None, load_conversations=None):
+    """Loads or builds the in-memory structures before the worker reports ready."""
+    _readiness['status'] = 'warming'
+    _readiness['started_at'] = datetime.now(timezone.utc).isoformat()
+    try:
+        _step('catalog_index', _warm_catalog)
+        _step('catalog_columns', _warm_columns)
+        _step('snapshot', _save_after_rebuild)
+        if load_conversations is not None:
+            _step('chat_search', lambda: chat_search.ensure_built(load_conversations) or 'ready')
+        if app is not None:
+            _step('templates', lambda: _compile_templates(app))
+    except Exception as e:
+        # Still serve; requests build what they need on demand.
+        _readiness['error'] = repr(e)
+        print(f"ERROR: warm-up failed: {e}")
+    if _readiness['status'] == 'warming': # Not draining meanwhile
+        _readiness['status'] = 'failed' if _readiness['error'] else 'ready'
+        _readiness['ready_at'] = datetime.now(timezone.utc).isoformat()
+
+def save_if_changed():
+    """Rewrites the snapshot if the catalog changed since the last one."""
+    state = catalog_index.export_state()
+    if state is not None and state['signature'] != _saved['signature']:
+        return save()
+    return False
+
+def run(app, load_conversations, sleep):
+    """Background task: warm up, then keep the snapshot fresh. `sleep` is the server's (e.g. socketio.sleep)."""
+    warm_up(app, load_conversations)
+    while True:
+        sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            save_if_changed()
+        except Exception as e:
+            print(f"ERROR: could not save catalog snapshot: {e}")
+
+def skip_warm_up():
+    """Reports the worker ready without warming up (WARM_UP_ON_START=false); requests build what they need."""
+    if _readiness['status'] == 'starting':
+        _readiness['status'] = 'ready'
+        _readiness['ready_at'] = datetime.now(timezone.utc).isoformat()
+
+def set_draining():
+    """Marks the worker as shutting down, so /readyz turns it away from the load balancer."""
+    _readiness['status'] = 'draining'
+
+def readiness():
+    """Returns (ready, details) for the readiness endpoint."""
+    return _readiness['status'] in ('ready', 'failed'), dict(_readiness, pid=os.getpid())
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat in the app directory and resolve their data files
+# ('static/products.json', ...) relative to the working directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs a test in an empty app directory."""
+    (tmp_path / 'static').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def client(workdir, monkeypatch):
+    """A Flask test client for the app, with empty data files in `workdir`."""
+    monkeypatch.setenv('WARM_UP_ON_START', 'false')
+    monkeypatch.setenv('MAIN_ADMIN_EMAIL', 'main@example.com')
+    import app
+    import catalog_index
+    catalog_index._state['built'] = False
+    app.prepare_data_files()
+    yield app.app.test_client()
+    catalog_index._state['built'] = False
@@ -0,0 +1,58 @@
+import json
+import sqlite3
+
+import pytest
+
+import analytics
+
+@pytest.fixture
+def rollups(workdir, monkeypatch):
+    monkeypatch.setattr(analytics, '_pending', {})
+
+def test_failed_flush_keeps_increments_pending(rollups, monkeypatch):
+    analytics.record('000001', 'a1', 'view', 7200)
+    connect = analytics._connect
+    monkeypatch.setattr(analytics, '_connect', lambda: sqlite3.connect(':memory:')) # No rollups table
+    with pytest.raises(sqlite3.OperationalError):
+        analytics.flush()
+    monkeypatch.setattr(analytics, '_connect', connect)
+    assert analytics.query('product', '000001', 'hour', 0, 10000)[0]['views'] == 1
+
+    analytics.flush()
+    assert analytics._pending == {}
+    analytics.record('000001', 'a1', 'inquiry', 7300)
+    series = analytics.query('product', '000001', 'hour', 0, 10000)
+    assert [(point['views'], point['inquiries']) for point in series] == [(1, 1)]
+
+def test_increments_recorded_during_a_flush_stay_pending(rollups, monkeypatch):
+    analytics.record('000001', 'a1', 'view', 7200)
+    connect = analytics._connect
+    def connect_and_record():
+        analytics.record('000001', 'a1', 'view', 7200) # Arrives while the batch is being written
+        return connect()
+    monkeypatch.setattr(analytics, '_connect', connect_and_record)
+    analytics.flush()
+    monkeypatch.setattr(analytics, '_connect', connect)
+    assert analytics._pending[('hour', 'product', '000001', 7200)] == [1, 0]
+    assert analytics.query('product', '000001', 'hour', 0, 10000)[0]['views'] == 2
+
+@pytest.fixture
+def admin_client(client):
+    with open('static/users.json', 'w') as f:
+        json.dump([{'id': 'a1', 'email': 'merchant@example.com', 'role': 'admin'}], f)
+    with client.session_transaction() as session:
+        session['user_id'] = 'a1'
+    return client
+
+@pytest.mark.parametrize('value', ['inf', '-inf', 'nan', '1e300', 'yesterday'])
+def test_unusable_range_bounds_are_rejected(admin_client, value):
+    response = admin_client.get('/api/analytics', query_string={'start': value})
+    assert response.status_code == 400
+    response = admin_client.get('/api/analytics', query_string={'end': value})
+    assert response.status_code == 400
+
+def test_range_query(admin_client):
+    analytics.record('000001', 'a1', 'view', 86400 * 3)
+    response = admin_client.get('/api/analytics', query_string={'start': '0', 'end': '1970-01-10'})
+    assert response.status_code == 200
+    assert response.get_json()['series'] == [{'bucket': '1970-01-04T00:00:00+00:00', 'views': 1, 'inquiries': 0}]
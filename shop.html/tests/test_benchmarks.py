@@ -0,0 +1,16 @@
+import json
+
+from benchmarks import generate
+
+def test_generate_is_seeded_and_consistent(tmp_path):
+    manifest = generate.generate(str(tmp_path / 'a'), products=40, merchants=3, users=10,
+                                 conversations=5, messages_per_conversation=4, seed=7)
+    assert generate.generate(str(tmp_path / 'b'), products=40, merchants=3, users=10,
+                             conversations=5, messages_per_conversation=4, seed=7)['counts'] == manifest['counts']
+
+    static = tmp_path / 'a' / 'static'
+    parks = json.loads((static / 'products.json').read_text())
+    users = json.loads((static / 'users.json').read_text())
+    assert len(parks) == manifest['counts']['products'] == 40
+    assert {park['admin_id'] for park in parks} <= {user['id'] for user in users if user['role'] == 'admin'}
+    assert json.loads((static / generate.MANIFEST_FILE).read_text()) == manifest
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import blob_storage
+
+@pytest.mark.parametrize('key, valid', [
+    ('store/ab/abcd.jpg', True),
+    ('users/user_7.jpg', True),
+    ('', False),
+    ('/etc/passwd', False),
+    ('store/../users.json', False),
+    ('.uploads/partial.jpg', False),
+    ('store\\ab.jpg', False),
+])
+def test_valid_key(key, valid):
+    assert blob_storage.valid_key(key) == valid
+
+def test_local_storage_moves_files_into_place(tmp_path):
+    storage = blob_storage.LocalStorage(str(tmp_path / 'images'))
+    source = tmp_path / 'upload.tmp'
+    source.write_bytes(b'jpeg')
+    storage.put_file('store/ab/abcd.jpg', str(source))
+
+    assert not source.exists()
+    assert storage.exists('store/ab/abcd.jpg') and storage.size('store/ab/abcd.jpg') == 4
+    with storage.open('store/ab/abcd.jpg') as f:
+        assert f.read() == b'jpeg'
+    storage.delete('store/ab/abcd.jpg')
+    storage.delete('store/ab/abcd.jpg')
+    assert not storage.exists('store/ab/abcd.jpg')
+
+@pytest.fixture
+def image(client, monkeypatch):
+    storage = blob_storage.LocalStorage('static/images')
+    monkeypatch.setitem(blob_storage._storage, 'backend', storage)
+    path = storage.path('store/ab/abcd.jpg')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'jpeg')
+    return client
+
+def test_images_are_served_with_cache_headers(image):
+    import app
+    response = image.get(app.IMAGE_URL_PREFIX + 'store/ab/abcd.jpg')
+    assert response.status_code == 200
+    assert response.get_data() == b'jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert image.get(app.IMAGE_URL_PREFIX + 'store/ab/missing.jpg').status_code == 404
+    assert image.get(app.IMAGE_URL_PREFIX + '.uploads/x.jpg').status_code == 404
+
+def test_proxy_mode_only_names_the_file(image, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'IMAGE_SERVE_MODE', 'x-accel-redirect')
+    response = image.get(app.IMAGE_URL_PREFIX + 'store/ab/abcd.jpg')
+    assert response.headers['X-Accel-Redirect'] == app.IMAGE_ACCEL_PREFIX + 'store/ab/abcd.jpg'
+    assert response.get_data() == b''
@@ -0,0 +1,45 @@
+import io
+import json
+import zipfile
+
+import bulk_import
+import catalog_changes
+
+def _image_bytes(color):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def _write_import(workdir):
+    (workdir / 'products.csv').write_text(
+        "name,location,price,description,type,images\n"
+        "Lamp,Oslo,10,A lamp,Lighting,shared.jpg;red.jpg\n"
+        "Chair,Oslo,25,A chair,Furniture,shared.jpg;missing.jpg\n"
+        "Desk,Oslo,90,A desk,Furniture,shared.jpg;blue.jpg\n")
+    with zipfile.ZipFile(workdir / 'images.zip', 'w') as archive:
+        archive.writestr('shared.jpg', _image_bytes('green'))
+        archive.writestr('red.jpg', _image_bytes('red'))
+        archive.writestr('blue.jpg', _image_bytes('blue'))
+
+def test_import_shares_images_and_reports_bad_rows(workdir):
+    _write_import(workdir)
+    with open('products.csv', 'rb') as stream:
+        summary = bulk_import.import_products(stream, 'csv', '000012', image_archive='images.zip', batch_size=2)
+
+    assert summary['imported'] == 2
+    assert summary['failed'] == 1
+    assert summary['errors'][0]['line'] == 3
+    import data_manager
+    parks = {park['name']: park for park in data_manager.get_all_parks()}
+    assert set(parks) == {'Lamp', 'Desk'}
+    assert parks['Lamp']['image_filenames'][0] == parks['Desk']['image_filenames'][0]
+
+def test_cli_records_imports_in_the_change_feed(workdir, capsys):
+    _write_import(workdir)
+    assert bulk_import.main(['import', 'products.csv', '--admin-id', '000012', '--images', 'images.zip']) == 1
+
+    summary = json.loads(capsys.readouterr().out)
+    version, changes = catalog_changes.get_changes(0)
+    assert version > 0
+    assert {product_id for product_id, deleted in changes} >= set(summary['ids'])
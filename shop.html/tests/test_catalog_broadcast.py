@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import data_manager
+
+@pytest.fixture
+def broadcast(client, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'CATALOG_BROADCAST_INTERVAL_SECONDS', 0.05)
+    monkeypatch.setitem(app._catalog_broadcast, 'categories', None)
+    monkeypatch.setitem(app._catalog_broadcast, 'pending', {})
+    sockets = []
+    def subscribe(categories=None):
+        socket = app.socketio.test_client(app.app)
+        socket.emit('subscribe_catalog', {'categories': categories} if categories else {})
+        sockets.append(socket)
+        return socket
+    yield app, subscribe
+    for socket in sockets:
+        socket.disconnect()
+
+def _changes(socket, timeout=3):
+    deadline = time.monotonic() + timeout
+    changes = []
+    while time.monotonic() < deadline:
+        changes += [change for event in socket.get_received() if event['name'] == 'catalog_update'
+                    for change in event['args'][0]['changes']]
+        if changes:
+            time.sleep(0.2) # Let a second interval's notices arrive too
+            changes += [change for event in socket.get_received() if event['name'] == 'catalog_update'
+                        for change in event['args'][0]['changes']]
+            return changes
+        time.sleep(0.05)
+    return changes
+
+def test_writes_are_announced_before_anyone_subscribed_here(broadcast, monkeypatch):
+    # With a message queue, the emit reaches subscribers connected to other workers.
+    app, subscribe = broadcast
+    emitted = []
+    emit = app.socketio.emit
+    def recording_emit(event, payload, to=None, **kwargs):
+        emitted.append((event, to, payload))
+        return emit(event, payload, to=to, **kwargs)
+    monkeypatch.setattr(app.socketio, 'emit', recording_emit)
+
+    data_manager.add_park({'name': 'Sofa', 'type': 'Furniture', 'price': '5'}, [], 'a1')
+
+    deadline = time.monotonic() + 3
+    while not emitted and time.monotonic() < deadline:
+        time.sleep(0.05)
+    rooms = {to for event, to, payload in emitted if event == 'catalog_update'}
+    assert rooms == {'catalog', 'catalog:furniture'}
+    assert app._catalog_broadcast['categories'] is None
+
+def test_subscribers_hear_about_changes_and_category_moves(broadcast, monkeypatch):
+    app, subscribe = broadcast
+    data_manager.add_park({'name': 'Sofa', 'type': 'Furniture', 'price': '5'}, [], 'a1')
+    _changes(subscribe()) # Drain the add
+    def no_file_reads():
+        raise AssertionError('subscribe_catalog should use the catalog index')
+    with monkeypatch.context() as patch:
+        patch.setattr(data_manager, 'get_all_parks', no_file_reads)
+        furniture = subscribe(['furniture'])
+        everything = subscribe()
+
+    data_manager.update_park('000001', {'type': 'Outdoor'})
+
+    assert [(c['id'], c['event'], c['type']) for c in _changes(furniture)] == [('000001', 'update', 'Outdoor')]
+    assert [c['id'] for c in _changes(everything)] == ['000001']
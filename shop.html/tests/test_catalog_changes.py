@@ -0,0 +1,41 @@
+import pytest
+
+import catalog_changes
+import data_manager
+
+@pytest.fixture(autouse=True)
+def feed():
+    catalog_changes.register()
+
+def _add(name):
+    return data_manager.add_park({'name': name, 'type': 'Furniture', 'price': '1'}, [], 'a1')
+
+def test_changes_since_a_version_keep_only_the_latest_per_product(workdir):
+    sofa, lamp = _add('Sofa'), _add('Lamp')
+    version, _ = catalog_changes.get_changes(0)
+    data_manager.update_park(sofa['id'], {**sofa, 'price': '2'})
+    data_manager.delete_park(lamp['id'])
+    data_manager.increment_product_view(sofa['id'])  # Counters are not versioned
+
+    latest, changes = catalog_changes.get_changes(version)
+    assert latest == version + 2
+    assert changes == [(sofa['id'], False), (lamp['id'], True)]
+    assert catalog_changes.get_changes(latest) == (latest, [])
+
+def test_versions_outside_the_feed_ask_for_a_reload(workdir):
+    _add('Sofa')
+    version = catalog_changes.current_version()
+    assert catalog_changes.get_changes(version + 1) == (version, None)
+    catalog_changes.record_change('gone', deleted=True, now=0)
+    catalog_changes.record_change('other', deleted=True)  # Prunes the expired tombstone
+    assert catalog_changes.get_changes(version)[1] is None
+
+def test_endpoint_returns_deltas_and_resets(client):
+    sofa = _add('Sofa')
+    full = client.get('/api/products/changes').get_json()
+    assert full['reset'] is True and [p['id'] for p in full['products']] == [sofa['id']]
+    lamp = _add('Lamp')
+    delta = client.get('/api/products/changes', query_string={'since': full['version']}).get_json()
+    assert delta['reset'] is False
+    assert [p['id'] for p in delta['products']] == [lamp['id']]
+    assert client.get('/api/products/changes', query_string={'since': 'x'}).status_code == 400
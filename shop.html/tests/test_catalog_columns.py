@@ -0,0 +1,91 @@
+import pytest
+
+import catalog_columns
+import catalog_index
+import data_manager
+
+pytestmark = pytest.mark.skipif(not catalog_columns.available(), reason='NumPy is not installed')
+
+@pytest.fixture
+def catalog(workdir):
+    catalog_index._state['built'] = False
+    catalog_columns._columns['generation'] = None
+    yield
+    catalog_index._state['built'] = False
+    catalog_columns._columns['generation'] = None
+
+def _add(name, price, product_type='Sofa', **extra):
+    return data_manager.add_park(dict({'name': name, 'price': price, 'type': product_type}, **extra), [], 'a1')
+
+def _query(**filters):
+    page, total = catalog_index.filter_products(**filters)
+    return [park['name'] for park in page], total
+
+def _query_without_columns(monkeypatch, **filters):
+    # The sets are only filled without NumPy, so rebuild the index both ways.
+    catalog_index._state['built'] = False
+    with monkeypatch.context() as patch:
+        patch.setattr(catalog_columns, 'available', lambda: False)
+        result = _query(**filters)
+    catalog_index._state['built'] = False
+    return result
+
+def test_writes_update_rows_in_place(catalog, monkeypatch):
+    for i in range(5):
+        _add(f'Item {i}', str(10 * (i + 1)))
+    assert _query(sort='price_asc')[1] == 5
+    rebuilds = []
+    monkeypatch.setattr(catalog_columns, 'rebuild', lambda *args: rebuilds.append(args))
+
+    _add('Cheap lamp', '1', 'Lamp')
+    data_manager.update_park('000002', {'price': '999', 'type': 'Lamp'})
+    data_manager.delete_park('000003')
+
+    assert rebuilds == []
+    assert _query(sort='price_asc') == (['Cheap lamp', 'Item 0', 'Item 3', 'Item 4', 'Item 1'], 5)
+    assert _query(product_type='lamp', sort='price_desc') == (['Item 1', 'Cheap lamp'], 2)
+    assert _query(max_price=30) == _query_without_columns(monkeypatch, max_price=30)
+
+def test_arrays_grow_past_their_capacity(catalog):
+    _add('First', '5')
+    _query()
+    for i in range(40):
+        _add(f'Item {i}', str(i))
+    assert catalog_columns.is_current(catalog_index._state['generation'])
+    assert _query(min_price=38) == (['Item 39', 'Item 38'], 2)
+
+def test_mostly_dead_rows_are_compacted(catalog):
+    for i in range(4):
+        _add(f'Item {i}', '5')
+    _query()
+    for park_id in ('000001', '000002', '000003'):
+        data_manager.delete_park(park_id)
+    assert not catalog_columns.is_current(catalog_index._state['generation'])
+    assert _query() == (['Item 3'], 1)
+    assert catalog_columns._columns['count'] == 1
+
+def test_popular_sort_uses_the_index_inquiry_weight(catalog, monkeypatch):
+    _add('Viewed', '5')
+    _add('Asked about', '5')
+    for _ in range(4):
+        data_manager.increment_product_view('000001')
+    data_manager.increment_product_inquiry('000002')
+    assert _query(sort='popular')[0] == ['Asked about', 'Viewed']
+    monkeypatch.setattr(catalog_index, 'INQUIRY_WEIGHT', 3)
+    assert _query(sort='popular')[0] == ['Viewed', 'Asked about']
+
+def test_facets_and_text_search_match_the_set_indexes(catalog, monkeypatch):
+    _add('Oak table', '120', 'Table', location='Oslo', home_delivery=True)
+    _add('Pine table', 'call us', 'Table', location='Bergen')
+    _add('Oak chair', '40', 'Chair', location='Oslo')
+    data_manager.delete_park('000003')
+
+    facets = dict(catalog_index.get_facets())
+    assert not catalog_index._state['by_type']
+    assert facets['price_range'] == {'min': 120.0, 'max': 120.0}
+    catalog_index._state['built'] = False
+    with monkeypatch.context() as patch:
+        patch.setattr(catalog_columns, 'available', lambda: False)
+        assert catalog_index.get_facets() == facets
+    assert _query(text='table', location='oslo') == _query_without_columns(monkeypatch, text='table', location='oslo')
+    assert _query(text='table') == (['Pine table', 'Oak table'], 2)
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import catalog_index
+import data_manager
+
+def _product(name, price='100', product_type='Sofa'):
+    return {'name': name, 'price': price, 'type': product_type, 'location': 'Accra'}
+
+@pytest.fixture
+def catalog(workdir):
+    catalog_index._state['built'] = False
+    yield
+    catalog_index._state['built'] = False
+
+def _parks():
+    return {park['id']: park for park in catalog_index.filter_products(limit=100)[0]}
+
+def _ids():
+    return sorted(_parks())
+
+def test_own_writes_update_the_index_in_place(catalog):
+    data_manager.add_park(_product('Oak table'), [], 'a1')
+    assert _ids() == ['000001']
+    generation = catalog_index._state['generation']
+
+    data_manager.add_parks([(_product('Pine chair'), []), (_product('Teak bed'), [])], 'a1')
+    assert catalog_index._state['built']
+    assert catalog_index._state['generation'] > generation
+    assert _ids() == ['000001', '000002', '000003']
+    assert catalog_index._state['signature'] == data_manager.get_catalog_signature()
+
+def test_foreign_write_is_not_hidden_by_own_write(catalog):
+    data_manager.add_park(_product('Oak table'), [], 'a1')
+    assert _ids() == ['000001']
+
+    # Another worker appends a product (no listeners run in this process)...
+    parks = data_manager.get_all_parks()
+    parks.append(dict(parks[0], id='000002', name='Foreign lamp'))
+    data_manager._save_all_parks(parks)
+    # ...then this worker writes before its next query.
+    data_manager.add_park(_product('Pine chair'), [], 'a1')
+
+    assert _ids() == ['000001', '000002', '000003']
+    assert _parks()['000002']['name'] == 'Foreign lamp'
+
+def test_same_size_rewrite_changes_the_signature(catalog):
+    data_manager.add_park(_product('Oak table'), [], 'a1')
+    signature = data_manager.get_catalog_signature()
+    data_manager._save_all_parks(data_manager.get_all_parks())
+    assert data_manager.get_catalog_signature() != signature
+
+def _types():
+    return [facet['value'] for facet in catalog_index.get_facets()['type']]
+
+def test_rename_in_another_process_is_seen(catalog):
+    data_manager.add_park(_product('Oak table'), [], 'a1')
+    assert _types() == ['Sofa']
+    with open(data_manager.DATABASE_PATH, encoding='utf-8') as f:
+        parks = json.load(f)
+    parks[0]['type'] = 'Sofe' # Same length: same file size
+    data_manager._save_all_parks(parks)
+    assert _types() == ['Sofe']
+
+def test_failing_listener_does_not_fail_the_write(catalog, monkeypatch, capsys):
+    calls = []
+    def broken(event, park):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(data_manager, '_listeners', [broken, lambda event, park: calls.append(event)])
+
+    park = data_manager.add_park(_product('Oak table'), [], 'a1')
+
+    assert park['id'] == '000001'
+    assert calls == ['add']
+    assert 'boom' in capsys.readouterr().out
+
+@pytest.mark.parametrize('columns', [True, False])
+def test_price_sort_without_leaking_parsed_price(catalog, monkeypatch, columns):
+    import catalog_columns
+    if not columns:
+        monkeypatch.setattr(catalog_columns, 'available', lambda: False)
+    data_manager.add_parks([(_product('Oak table', '1,200 DA'), []), (_product('Pine chair', 'ask'), []),
+                            (_product('Teak bed', '$15.99'), [])], 'a1')
+
+    page, total = catalog_index.filter_products(sort='price_asc')
+    assert total == 3
+    assert [park['name'] for park in page] == ['Teak bed', 'Oak table', 'Pine chair']
+    assert all('price_value' not in park for park in catalog_index.get_parks())
@@ -0,0 +1,17 @@
+import os
+
+import chat_archive
+
+def _conversations():
+    return {'5-2': {'messages': [{'sender': 'user', 'text': 'old', 'timestamp': '2020-01-01T00:00:00+00:00'},
+                                 {'sender': 'admin', 'text': 'new', 'timestamp': '2999-01-01T00:00:00+00:00'}],
+                    'deleted_by': []}}
+
+def test_segments_are_written_outside_the_served_folder(client):
+    conversations = _conversations()
+    assert chat_archive.archive_old_messages(conversations) == 1
+    assert [m['text'] for m in conversations['5-2']['messages']] == ['new']
+    assert chat_archive.load_segment('5-2', 1)[0]['text'] == 'old'
+    assert os.path.isfile(os.path.join('chat_archive', '5-2', '000001.json.gz'))
+    assert not os.path.exists(os.path.join('static', 'chat_archive'))
+    assert client.get('/static/chat_archive/5-2/000001.json.gz').status_code == 404
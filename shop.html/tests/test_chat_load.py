@@ -0,0 +1,12 @@
+from benchmarks import chat_load
+
+def test_load_test_summary_counts_lost_messages():
+    summary = chat_load._summarize([0.030, 0.010, 0.020], expected=4)
+    assert (summary['received'], summary['lost'], summary['loss_rate']) == (3, 1, 0.25)
+    assert summary['max_ms'] == 30.0
+    assert chat_load._summarize([], expected=0)['loss_rate'] == 0.0
+
+def test_sequence_numbers_come_from_load_test_messages_only():
+    assert chat_load._sequence_number(f'{chat_load.TEXT_PREFIX} 12 padding') == 12
+    assert chat_load._sequence_number('hello 12') is None
+    assert chat_load._sequence_number(None) is None
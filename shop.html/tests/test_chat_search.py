@@ -0,0 +1,33 @@
+import os
+
+import chat_archive
+import chat_search
+
+def _conversations():
+    conversations = {'5-2': {'messages': [
+        {'sender': 'user', 'text': 'Is the red sofa available?', 'timestamp': '2020-01-01T00:00:00+00:00'},
+        {'sender': 'admin', 'text': 'Yes, the sofa ships tomorrow', 'timestamp': '2999-01-01T00:00:00+00:00'}],
+        'deleted_by': []}}
+    chat_archive.archive_old_messages(conversations)
+    return conversations
+
+def _texts(query):
+    results, total = chat_search.search(query)
+    return sorted(result['text'] for result in results)
+
+def test_first_build_indexes_archived_messages(workdir):
+    conversations = _conversations()
+    chat_search.ensure_built(lambda: conversations)
+    assert _texts('sofa') == ['Is the red sofa available?', 'Yes, the sofa ships tomorrow']
+    assert _texts('red') == ['Is the red sofa available?']
+    assert os.path.isfile(chat_search.CHAT_SEARCH_DB)
+    assert not os.path.exists(os.path.join('static', 'chat_search.db'))
+
+def test_index_built_without_archives_is_completed(workdir):
+    conversations = _conversations()
+    conn = chat_search._connect()
+    with conn:
+        conn.execute("INSERT INTO meta (key, value) VALUES ('built', '1')")
+    conn.close()
+    chat_search.ensure_built(lambda: conversations)
+    assert _texts('red') == ['Is the red sofa available?']
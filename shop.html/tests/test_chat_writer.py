@@ -0,0 +1,66 @@
+import json
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def chat(client, monkeypatch):
+    import app
+    with open('static/users.json', 'w') as f:
+        json.dump([{'id': '1', 'name': 'Merchant', 'email': 'm@example.com', 'role': 'admin',
+                    'password': generate_password_hash('pw')},
+                   {'id': '2', 'name': 'Buyer', 'email': 'b@example.com', 'role': 'normal',
+                    'password': generate_password_hash('pw')}], f)
+    client.post('/login', json={'email': 'b@example.com', 'password': 'pw'})
+    monkeypatch.setattr(app, 'CHAT_WRITE_RETRY_SECONDS', 0.01)
+    socket = app.socketio.test_client(app.app, flask_test_client=client)
+    yield app, socket
+    socket.disconnect()
+
+def _flaky_writes(app, monkeypatch, failures):
+    write = app._write_message_batch
+    calls = {'failed': 0}
+    def flaky(batch, *args, **kwargs):
+        if batch and calls['failed'] < failures:
+            calls['failed'] += 1
+            raise OSError('disk full')
+        return write(batch, *args, **kwargs)
+    monkeypatch.setattr(app, '_write_message_batch', flaky)
+    return calls
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.05)
+    return predicate()
+
+def _saved_texts():
+    with open('static/conversations.json') as f:
+        return [m['text'] for m in json.load(f).get('2-1', {}).get('messages', [])]
+
+def test_failed_batch_is_retried_in_order(chat, monkeypatch):
+    app, socket = chat
+    calls = _flaky_writes(app, monkeypatch, failures=2)
+    socket.emit('new_message', {'text': 'first', 'conversation_id': '2-1'})
+    socket.emit('new_message', {'text': 'second', 'conversation_id': '2-1'})
+
+    assert _wait_for(lambda: len(_saved_texts()) == 2)
+    assert _saved_texts() == ['first', 'second']
+    assert calls['failed'] == 2
+    received = _wait_for(lambda: [e for e in socket.get_received() if e['name'] == 'receive_message'])
+    assert [e['args'][0]['text'] for e in received] == ['first', 'second']
+
+def test_senders_are_told_after_the_last_attempt(chat, monkeypatch):
+    app, socket = chat
+    monkeypatch.setattr(app, 'CHAT_WRITE_ATTEMPTS', 2)
+    _flaky_writes(app, monkeypatch, failures=2)
+    socket.emit('new_message', {'text': 'lost?', 'conversation_id': '2-1'})
+
+    slow_down = _wait_for(lambda: [e for e in socket.get_received() if e['name'] == 'slow_down'])
+    assert slow_down[0]['args'][0]['scope'] == 'server'
+    assert slow_down[0]['args'][0]['text'] == 'lost?'
+    assert _saved_texts() == []
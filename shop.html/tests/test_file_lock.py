@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+import file_lock
+
+def test_lock_is_reentrant_for_its_holder(workdir):
+    with file_lock.locked('static/products.json'):
+        with file_lock.locked('static/products.json'):
+            pass
+        assert file_lock._state['depth']
+    assert not file_lock._state['depth']
+
+def test_other_threads_wait_for_the_holder(workdir):
+    events = []
+
+    def other():
+        with file_lock.locked('static/products.json'):
+            events.append('other')
+
+    with file_lock.locked('static/products.json'):
+        thread = threading.Thread(target=other)
+        thread.start()
+        time.sleep(0.2)
+        events.append('holder')
+    thread.join(5)
+    assert events == ['holder', 'other']
+    assert not file_lock._state['depth']
+
+def test_green_threads_do_not_share_a_holders_lock(workdir, monkeypatch):
+    # Under eventlet every green thread runs on the same OS thread; a second
+    # green thread must wait for the flock (on a native thread), not re-enter.
+    current = {'holder': 'green-1'}
+    waits = []
+
+    class FakeTpool:
+        @staticmethod
+        def execute(func, *args):
+            waits.append(current['holder'])
+            raise RuntimeError("would wait on a native thread")
+
+    monkeypatch.setattr(file_lock, 'getcurrent', lambda: current['holder'])
+    monkeypatch.setitem(file_lock._state, 'tpool', FakeTpool)
+    with file_lock.locked('static/products.json'):
+        current['holder'] = 'green-2'
+        with pytest.raises(RuntimeError):
+            with file_lock.locked('static/products.json'):
+                pass
+        current['holder'] = 'green-1'
+    assert waits == ['green-2']
+    assert not file_lock._state['depth']
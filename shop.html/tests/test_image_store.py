@@ -0,0 +1,54 @@
+import io
+
+import pytest
+
+import data_manager
+import image_store
+
+@pytest.fixture
+def store(workdir):
+    image_store.register()
+    return image_store
+
+def _put(color):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return image_store.put(buffer, 'jpg')
+
+def _refcounts():
+    conn = image_store._connect()
+    try:
+        return dict(conn.execute("SELECT name, refcount FROM blobs"))
+    finally:
+        conn.close()
+
+def test_references_follow_the_product_lifecycle(store):
+    red, green, blue = _put('red'), _put('green'), _put('blue')
+    park = data_manager.add_park({'name': 'Lamp', 'price': '10'}, [red, green], 'a1')
+    assert _refcounts() == {red: 1, green: 1, blue: 0}
+
+    data_manager.update_park(park['id'], {'image_filenames': [blue, green]})
+    assert _refcounts() == {red: 0, green: 1, blue: 1}
+
+    data_manager.delete_park(park['id'])
+    assert _refcounts() == {red: 0, green: 0, blue: 0}
+    assert store.collect_garbage(grace_seconds=0) == 3
+    assert store.stats()['images'] == 0
+
+def test_stale_concurrent_edits_do_not_release_twice(store):
+    red, green, blue, white = _put('red'), _put('green'), _put('blue'), _put('white')
+    park = data_manager.add_park({'name': 'Lamp', 'price': '10'}, [red, green], 'a1')
+    # Two editors started from the same version; each replaced a different slot.
+    data_manager.update_park(park['id'], {'image_filenames': [blue, green]})
+    data_manager.update_park(park['id'], {'image_filenames': [red, white]})
+    assert _refcounts() == {red: 1, green: 0, blue: 0, white: 1}
+
+def test_shared_images_are_counted_per_product(store):
+    red = _put('red')
+    data_manager.add_parks([({'name': 'Lamp'}, [red, red]), ({'name': 'Desk'}, [red])], 'a1')
+    assert _refcounts() == {red: 3}
+    data_manager.delete_park('000001')
+    assert _refcounts() == {red: 1}
+    assert store.collect_garbage(grace_seconds=0) == 0
@@ -0,0 +1,30 @@
+import io
+import threading
+
+import images
+
+def _jpeg():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 900), 'red').save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+def test_decoding_is_offloaded_while_holding_a_slot(workdir, monkeypatch):
+    # Under eventlet `run` is tpool.execute and the slots a green semaphore:
+    # the slot is taken by the caller, the Pillow work runs in `run`.
+    slots = threading.BoundedSemaphore(1)
+    offloaded = []
+    def run(func, *args, **kwargs):
+        offloaded.append((func.__name__, slots._value))
+        return func(*args, **kwargs)
+    monkeypatch.setitem(images._offload, 'slots', slots)
+    monkeypatch.setitem(images._offload, 'run', run)
+
+    images.save_product_image(_jpeg(), 'out.jpg')
+    images.save_profile_photo(_jpeg(), 'photo.jpg')
+
+    assert offloaded == [('_resize', 0), ('_spool', 1), ('_resize', 0)]
+    from PIL import Image
+    assert max(Image.open('out.jpg').size) == 800
+    assert max(Image.open('photo.jpg').size) == 200
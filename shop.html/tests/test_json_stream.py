@@ -0,0 +1,17 @@
+from flask import Flask
+
+from json_stream import stream_json_array
+
+def _get(items):
+    app = Flask(__name__)
+    app.add_url_rule('/items', 'items', lambda: stream_json_array(items))
+    return app.test_client().get('/items')
+
+def test_streams_a_generator_as_one_json_array():
+    response = _get({'n': n, 'text': 'é'} for n in range(300))
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == [{'n': n, 'text': 'é'} for n in range(300)]
+
+def test_empty_list_is_an_empty_array():
+    assert _get(iter([])).get_data(as_text=True) == '[]'
@@ -0,0 +1,14 @@
+import metrics
+
+def test_metrics_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+    assert client.get('/metrics').status_code == 404
+
+def test_loopback_clients_still_need_the_token(client, monkeypatch):
+    # Behind a proxy on the same host every request comes from 127.0.0.1.
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds' in response.get_data(as_text=True)
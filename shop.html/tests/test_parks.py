@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+import data_manager
+
+@pytest.fixture
+def merchant(client):
+    with open('static/users.json', 'w') as f:
+        json.dump([{'id': '000001', 'name': 'Main', 'email': 'main@example.com', 'role': 'admin'},
+                   {'id': '000002', 'name': 'Lamps', 'email': 'lamps@example.com', 'role': 'admin'},
+                   {'id': '000003', 'name': 'Ada', 'email': 'ada@example.com', 'role': 'user'}], f)
+    data_manager.add_parks([({'name': f'Lamp {n}', 'price': str(10 * n), 'type': 'Lighting'}, [])
+                            for n in range(1, 6)], '000002')
+    data_manager.add_park({'name': 'Oak desk', 'price': '90', 'type': 'Furniture'}, [], '000004')
+    return client
+
+def _log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+def test_parks_page_is_sorted_and_projected(merchant):
+    _log_in(merchant, '000002')
+    body = merchant.get('/parks?page=2&limit=2&sort=oldest&fields=name').get_json()
+    assert (body['total'], body['page'], body['limit']) == (5, 2, 2)
+    assert body['products'] == [{'id': '000003', 'name': 'Lamp 3'}, {'id': '000004', 'name': 'Lamp 4'}]
+
+def test_parks_page_searches_within_the_merchant(merchant):
+    _log_in(merchant, '000002')
+    assert merchant.get('/parks?q=desk').get_json()['total'] == 0
+    _log_in(merchant, '000001')
+    body = merchant.get('/parks?q=desk').get_json()
+    assert [product['name'] for product in body['products']] == ['Oak desk']
+    assert merchant.get('/parks?limit=50&admin_id=000002').get_json()['total'] == 5
+
+def test_parks_without_page_params_returns_the_full_list(merchant):
+    _log_in(merchant, '000002')
+    assert len(merchant.get('/parks').get_json()) == 5
+    assert merchant.get('/parks?sort=cheapest-ever').status_code == 400
+    _log_in(merchant, '000003')
+    assert merchant.get('/parks?page=1').status_code == 403
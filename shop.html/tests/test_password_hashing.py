@@ -0,0 +1,19 @@
+import threading
+
+from werkzeug.security import generate_password_hash
+
+import password_hashing
+
+def test_hashing_runs_on_the_pool(monkeypatch):
+    monkeypatch.setattr(password_hashing, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    hashed = password_hashing.hash_password('secret')
+    assert password_hashing.verify_password(hashed, 'secret')
+    assert not password_hashing.verify_password(hashed, 'wrong')
+    assert not password_hashing.verify_password(None, 'secret')
+    assert password_hashing._run(lambda: threading.current_thread().name).startswith('password-hash')
+
+def test_hashes_with_other_parameters_need_rehash(monkeypatch):
+    monkeypatch.setattr(password_hashing, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    monkeypatch.setitem(password_hashing._pool, 'method_prefix', None)
+    assert password_hashing.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256:500'))
+    assert not password_hashing.needs_rehash(password_hashing.hash_password('secret'))
@@ -0,0 +1,47 @@
+import json
+import os
+
+import profiling
+
+def _write_record(record_id):
+    os.makedirs(profiling.PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(profiling.PROFILE_DIR, record_id + '.json'), 'w') as f:
+        json.dump({"id": record_id, "top": []}, f)
+
+def test_ring_includes_records_of_other_workers(workdir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_RECORDS', 3)
+    _write_record('20260101T000000000000-aaaaaaaa')
+    assert [record['id'] for record in profiling.list_records()] == ['20260101T000000000000-aaaaaaaa']
+
+    # Written by another worker after this one first listed the directory.
+    _write_record('20260101T000001000000-bbbbbbbb')
+    _write_record('20260101T000002000000-cccccccc')
+    profiling._save({"id": '20260101T000003000000-dddddddd', "top": []}, None)
+
+    assert [record['id'] for record in profiling.list_records()] == [
+        '20260101T000003000000-dddddddd', '20260101T000002000000-cccccccc', '20260101T000001000000-bbbbbbbb']
+    assert profiling.load_record('20260101T000000000000-aaaaaaaa') is None
+
+def test_profiles_page_is_for_the_main_admin_only(client):
+    with open('static/users.json', 'w') as f:
+        json.dump([{"id": "u1", "email": "main@example.com", "role": "admin"},
+                   {"id": "u2", "email": "seller@example.com", "role": "admin"}], f)
+    assert client.get('/admin/profiles').status_code == 401
+    with client.session_transaction() as session:
+        session['user_id'] = 'u2'
+    assert client.get('/admin/profiles').status_code == 403
+    with client.session_transaction() as session:
+        session['user_id'] = 'u1'
+    assert client.get('/admin/profiles').status_code == 200
+
+def test_profiles_taken_under_eventlet_are_flagged(workdir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 1.0)
+    monkeypatch.setitem(profiling._mode, 'shared_thread', False)
+    handler = profiling.socket_event('ping')(lambda: None)
+    profiling.configure('eventlet')
+    handler()
+    assert profiling.list_records()[0]['shared_thread']
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', 'other_profiles')
+    profiling.configure('threading')
+    handler()
+    assert not profiling.list_records()[0]['shared_thread']
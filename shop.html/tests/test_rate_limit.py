@@ -0,0 +1,40 @@
+import pytest
+
+import rate_limit
+
+@pytest.fixture(autouse=True)
+def buckets(monkeypatch):
+    monkeypatch.setattr(rate_limit, '_buckets', {})
+    monkeypatch.setitem(rate_limit._pruned, 'at', 0.0)
+
+def test_burst_then_refill():
+    assert all(rate_limit.consume('user:1', 1.0, 3, now=0.0)[0] for _ in range(3))
+    allowed, retry_after = rate_limit.consume('user:1', 1.0, 3, now=0.0)
+    assert not allowed and retry_after == pytest.approx(1.0)
+    assert rate_limit.consume('user:1', 1.0, 3, now=1.0) == (True, 0.0)
+    assert not rate_limit.consume('user:1', 1.0, 3, now=1.5)[0]
+
+def test_keys_are_independent_and_refund_returns_a_token():
+    rate_limit.consume('user:1', 1.0, 1, now=0.0)
+    assert not rate_limit.consume('user:1', 1.0, 1, now=0.0)[0]
+    assert rate_limit.consume('user:2', 1.0, 1, now=0.0)[0]
+    rate_limit.refund('user:1')
+    assert rate_limit.consume('user:1', 1.0, 1, now=0.0)[0]
+
+def test_idle_buckets_are_evicted_periodically():
+    rate_limit.consume('slow', 0.0001, 5, now=0.0)  # Would take hours to refill
+    rate_limit.consume('busy', 1.0, 5, now=0.0)
+    rate_limit.consume('busy', 1.0, 5, now=rate_limit.BUCKET_IDLE_SECONDS - 1)
+    assert set(rate_limit._buckets) == {'slow', 'busy'}
+
+    rate_limit.consume('busy', 1.0, 5, now=rate_limit.BUCKET_IDLE_SECONDS - 1 + rate_limit.PRUNE_INTERVAL_SECONDS)
+    assert set(rate_limit._buckets) == {'busy'}
+
+def test_full_buckets_are_pruned_when_the_table_is_full(monkeypatch):
+    monkeypatch.setattr(rate_limit, '_MAX_BUCKETS', 3)
+    for key in ('a', 'b', 'c'):
+        rate_limit.consume(key, 1.0, 2, now=0.0)
+    rate_limit.consume('a', 1.0, 2, now=0.5)
+    rate_limit.consume('a', 1.0, 2, now=0.5)
+    rate_limit.consume('d', 1.0, 2, now=1.0) # 'b' and 'c' have refilled; 'a' has not
+    assert set(rate_limit._buckets) == {'a', 'd'}
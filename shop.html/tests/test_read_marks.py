@@ -0,0 +1,41 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+@pytest.fixture
+def chat(client):
+    import app
+    with open('static/users.json', 'w') as f:
+        json.dump([{'id': '1', 'name': 'Merchant', 'email': 'm@example.com', 'role': 'admin',
+                    'password': generate_password_hash('pw')},
+                   {'id': '2', 'name': 'Buyer', 'email': 'b@example.com', 'role': 'normal',
+                    'password': generate_password_hash('pw')},
+                   {'id': '3', 'name': 'Main', 'email': 'main@example.com', 'role': 'admin',
+                    'password': generate_password_hash('pw')}], f)
+    sent = datetime.now(timezone.utc).isoformat()
+    app.save_conversations({'2-1': {'messages': [{'sender': 'user', 'text': 'hi', 'timestamp': sent}],
+                                    'deleted_by': []}})
+    app._pending_read_marks.clear()
+    yield app, client
+    app._pending_read_marks.clear()
+
+def _unread(app, reader_id):
+    convo_data = app.get_conversations()['2-1']
+    return app.count_unread('2-1', convo_data, convo_data['messages'], reader_id, 'user')
+
+def test_main_admin_reading_clears_the_merchants_unread_count(chat):
+    app, client = chat
+    client.post('/login', json={'email': 'main@example.com', 'password': 'pw'})
+    socket = app.socketio.test_client(app.app, flask_test_client=client)
+    assert _unread(app, '1') == 1
+    socket.emit('mark_read', {'conversation_id': '2-1'})
+    socket.disconnect()
+    assert _unread(app, '1') == 0
+
+def test_main_admin_mark_seen_clears_the_merchants_unread_count(chat):
+    app, client = chat
+    client.post('/login', json={'email': 'main@example.com', 'password': 'pw'})
+    assert client.post('/api/conversations/mark_seen', json={'conversation_key': '2-1'}).status_code == 200
+    assert _unread(app, '1') == 0
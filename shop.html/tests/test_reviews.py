@@ -0,0 +1,42 @@
+import json
+
+import reviews
+
+def test_reviews_are_paged_newest_first(workdir):
+    for n in range(5):
+        reviews.add_review('000002', '000003', 4, f'review {n}')
+    reviews.add_review('000004', '000003', 5, 'another store')
+
+    page, total = reviews.get_reviews('000002', offset=1, limit=2)
+    assert total == 5
+    assert [review['comment'] for review in page] == ['review 3', 'review 2']
+    assert reviews.get_reviews('000009') == ([], 0)
+
+def test_embedded_reviews_move_into_the_store(workdir):
+    users = [
+        {'id': '000002', 'role': 'admin', 'reviews': [
+            {'user_id': '000003', 'rating': 5, 'comment': 'newer', 'timestamp': '2024-02-01T00:00:00+00:00'},
+            {'user_id': '000004', 'rating': 3, 'comment': 'older', 'timestamp': '2024-01-01T00:00:00+00:00'}]},
+        {'id': '000003', 'role': 'user'},
+    ]
+    assert reviews.migrate_embedded_reviews(users)
+    assert all('reviews' not in user for user in users)
+    page, total = reviews.get_reviews('000002')
+    assert total == 2
+    assert [review['comment'] for review in page] == ['newer', 'older']
+
+    assert not reviews.migrate_embedded_reviews(users)
+
+def test_store_reviews_endpoint_pages_and_names_reviewers(client):
+    with open('static/users.json', 'w') as f:
+        json.dump([{'id': '000002', 'name': 'Lamp Store', 'role': 'admin', 'ratings_total': 9, 'ratings_count': 2},
+                   {'id': '000003', 'name': 'Ada', 'role': 'user'}], f)
+    reviews.add_review('000002', '000003', 4, 'fine')
+    reviews.add_review('000002', '000007', 5, 'great')
+
+    body = client.get('/api/store/000002/reviews?limit=1').get_json()
+    assert (body['total'], body['page'], body['limit'], body['avg_rating']) == (2, 1, 1, 4.5)
+    assert [(review['comment'], review['user_name']) for review in body['reviews']] == [('great', 'Former user')]
+    body = client.get('/api/store/000002/reviews?limit=1&page=2').get_json()
+    assert [(review['comment'], review['user_name']) for review in body['reviews']] == [('fine', 'Ada')]
+    assert client.get('/api/store/000003/reviews').status_code == 404
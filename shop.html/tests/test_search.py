@@ -0,0 +1,43 @@
+import catalog_index
+import data_manager
+
+def _add(*names):
+    data_manager.add_parks([({'name': name, 'type': 'Phone', 'price': '10', 'description': 'good deal'}, [])
+                            for name in names], 'a1')
+
+def _search(client, query):
+    response = client.get('/api/search', query_string={'q': query})
+    assert response.status_code == 200
+    return [product['name'] for product in response.get_json()]
+
+def test_misspelling_finds_the_closest_word(client):
+    _add('Apple iPhone 13', 'Samsung Galaxy', 'iPhone charger')
+    assert _search(client, 'iphnoe') == ['Apple iPhone 13', 'iPhone charger']
+    assert catalog_index.similar_words('iphnoe')[0][0] == 'iphone'
+
+def test_exact_word_outranks_fuzzy_match(client):
+    _add('Galaxy phone', 'Galaxie lamp')
+    # 'galaxy' is indexed, so it is matched exactly and not widened to 'galaxie'.
+    assert _search(client, 'galaxy') == ['Galaxy phone']
+    # Both are one edit from 'galaxi'; the fuzzy score stays below an exact name match.
+    names = _search(client, 'phone galaxi')
+    assert names[0] == 'Galaxy phone'
+    assert set(names) == {'Galaxy phone', 'Galaxie lamp'}
+
+def test_short_and_unrelated_terms_do_not_match_fuzzily(client):
+    _add('Leather sofa')
+    assert _search(client, 'sofx') == ['Leather sofa']
+    assert _search(client, 'sfa') == []
+    assert _search(client, 'xyzzy') == []
+
+def test_results_have_no_internal_fields(client):
+    _add('Apple iPhone 13')
+    product = client.get('/api/search', query_string={'q': 'iphone'}).get_json()[0]
+    assert 'price_value' not in product
+
+def test_deleted_product_is_no_longer_suggested(client):
+    _add('Zanzibar hammock')
+    assert _search(client, 'zanzibr') == ['Zanzibar hammock']
+    data_manager.delete_park('000001')
+    assert _search(client, 'zanzibr') == []
+    assert not catalog_index.has_word('zanzibar')
@@ -0,0 +1,17 @@
+import socket
+import time
+
+import serve
+
+def test_queued_connections_are_served_before_the_socket_closes():
+    listener = serve._listen('127.0.0.1', 0)
+    clients = [socket.create_connection(listener.getsockname()) for _ in range(3)]
+    handled = []
+    try:
+        serve._accept_backlog(listener, lambda conn, address: handled.append(conn), time.monotonic() + 5)
+        assert len(handled) == 3
+        assert not serve._has_pending(listener)
+    finally:
+        for conn in handled + clients:
+            conn.close()
+        listener.close()
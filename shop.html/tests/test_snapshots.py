@@ -0,0 +1,8 @@
+def test_worker_is_ready_without_warm_up(client):
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'ready'
+
+def test_importing_the_app_starts_no_background_tasks(client):
+    import app
+    assert not app._background['started'] # Only serve.py workers and `python app.py` start them
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+import analytics
+import catalog_index
+import data_manager
+import trending
+
+@pytest.fixture
+def catalog(workdir, monkeypatch):
+    catalog_index._state['built'] = False
+    monkeypatch.setattr(analytics, '_pending', {})
+    monkeypatch.setitem(trending._state, 'loaded', False)
+    for name, product_type in (('Sofa', 'Furniture'), ('Phone', 'Electronics'), ('Lamp', 'Furniture')):
+        data_manager.add_park({'name': name, 'type': product_type, 'price': '1'}, [], 'a1')
+    yield
+    catalog_index._state['built'] = False
+
+def _ranking(category=None):
+    return [park_id for park_id, _ in trending.get_trending(category)]
+
+def test_events_from_other_workers_are_merged_on_reload(catalog):
+    data_manager.increment_product_view('000001')
+    assert _ranking() == ['000001']
+    # Another worker's flushed events, and none of this worker's lost.
+    now = time.time()
+    for _ in range(3):
+        analytics.record('000002', 'a1', 'view', now)
+    analytics.flush()
+    trending.reload()
+    assert _ranking() == ['000002', '000001']
+    assert trending.recent_counts('000002') == (3, 0)
+    data_manager.increment_product_inquiry('000003')
+    assert _ranking('furniture') == ['000003', '000001']
+
+def test_reload_does_not_count_own_events_twice(catalog):
+    data_manager.increment_product_view('000001')
+    data_manager.increment_product_inquiry('000001')
+    before = dict(trending.get_trending())
+    analytics.flush()
+    trending.reload()
+    after = dict(trending.get_trending())
+    assert after.keys() == before.keys()
+    assert after['000001'] == pytest.approx(before['000001'])
+    assert trending.recent_counts('000001') == (1, 1)
+
+def test_reload_survives_a_restart_and_skips_deleted_products(catalog):
+    analytics.record('000002', 'a1', 'inquiry', time.time() - 2 * 3600)
+    analytics.record('000003', 'a1', 'view', time.time())
+    analytics.record('000001', 'a1', 'view', time.time() - 100 * 3600) # Outside the window
+    analytics.flush()
+    data_manager.delete_park('000003')
+    trending.reload()
+    assert _ranking() == ['000002']
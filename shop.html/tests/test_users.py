@@ -0,0 +1,19 @@
+import json
+
+import pytest
+
+@pytest.mark.parametrize('photo, stored', [
+    ('https://example.com/me.jpg', 'https://example.com/me.jpg'),
+    ('/static/images/users/user_7.jpg', '/static/images/users/user_7.jpg'),
+    ('x" onerror="alert(1)', None),
+    ('https://example.com/a.jpg" onerror="alert(1)', None),
+    ('javascript:alert(1)', None),
+    ('/static/images/../users.json', None),
+    (['https://example.com/me.jpg'], None),
+])
+def test_create_user_keeps_only_safe_photo_urls(client, photo, stored):
+    response = client.post('/create_user', json={'name': 'Ada', 'email': 'ada@example.com',
+                                                 'password': 'correct horse', 'photo': photo})
+    assert response.status_code == 201
+    with open('static/users.json') as f:
+        assert json.load(f)[0]['photo'] == stored
@@ -0,0 +1,212 @@
+import heapq
+import os
+import time
+from collections import defaultdict, deque
+
+import analytics
+import catalog_index
+import data_manager
+
+# "What is popular right now" ranking, fed by the view and inquiry events that
+# data_manager already emits. Events are counted in hourly buckets per product
+# and folded into a time-decayed score, and a small top-N heap is maintained per
+# category (plus one for the whole shop) so the trending list never needs a
+# catalog-wide sort.
+#
+# Scores use forward decay: an event at time t adds 2 ** ((t - epoch) / half_life)
+# instead of decaying every stored score as time passes. Relative order is then
+# fixed between events, which is what lets the heaps stay valid; dividing by
+# 2 ** ((now - epoch) / half_life) gives the familiar decayed value.
+#
+# Each worker counts the events it handles straight away, and every
+# TRENDING_REFRESH_SECONDS reloads the whole ranking from the hourly product
+# rollups in analytics, which every worker writes to. That way the ranking
+# covers the whole shop and survives restarts; the rollups include this
+# worker's own events (flushed or pending), so reloading never counts one twice.
+
+HALF_LIFE_SECONDS = 6 * 3600
+BUCKET_SECONDS = 3600
+WINDOW_BUCKETS = 72          # keep three days of hourly counters per product
+TOP_N = 50
+ALL_CATEGORIES = ''          # heap key for the shop-wide ranking
+TRENDING_REFRESH_SECONDS = int(os.environ.get('TRENDING_REFRESH_SECONDS', 60))  # 0: load once, on first use
+
+_MAX_EXPONENT = 512          # renormalize well before floats overflow
+
+_state = {
+    'loaded': False,         # reloaded from the analytics rollups at least once
+    'epoch': time.time(),
+    'buckets': {},           # product id -> deque of [bucket, views, inquiries]
+    'scores': {},            # product id -> forward-decayed score
+    'category': {},          # product id -> normalized type
+    'top': {},               # category -> {'heap': [(score, id)], 'members': {id: score}}
+}
+
+def _weight(timestamp):
+    return 2 ** ((timestamp - _state['epoch']) / HALF_LIFE_SECONDS)
+
+def _renormalize(now):
+    """Moves the decay epoch forward and rescales every stored score."""
+    factor = _weight(now)
+    _state['epoch'] = now
+    for park_id in _state['scores']:
+        _state['scores'][park_id] /= factor
+    for top in _state['top'].values():
+        top['members'] = {park_id: score / factor for park_id, score in top['members'].items()}
+        top['heap'] = [(score, park_id) for park_id, score in top['members'].items()]
+        heapq.heapify(top['heap'])
+
+def _top_for(category):
+    return _state['top'].setdefault(category, {'heap': [], 'members': {}})
+
+def _compact(top):
+    """Drops stale heap entries left behind by score updates."""
+    top['heap'] = [(score, park_id) for park_id, score in top['members'].items()]
+    heapq.heapify(top['heap'])
+
+def _offer(category, park_id, score):
+    """Offers a product's new (higher) score to a category's top-N heap."""
+    top = _top_for(category)
+    members = top['members']
+    heap = top['heap']
+    if park_id in members or len(members) < TOP_N:
+        members[park_id] = score
+        heapq.heappush(heap, (score, park_id))
+    else:
+        # Discard stale entries until the heap root is a live member.
+        while heap and members.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        if heap and score > heap[0][0]:
+            _, evicted = heapq.heappop(heap)
+            del members[evicted]
+            members[park_id] = score
+            heapq.heappush(heap, (score, park_id))
+    if len(heap) > 4 * TOP_N:
+        _compact(top)
+
+def _refill(category):
+    """Rebuilds a category's heap after one of its members left it."""
+    top = _top_for(category)
+    candidates = ((score, park_id) for park_id, score in _state['scores'].items()
+                  if category == ALL_CATEGORIES or _state['category'].get(park_id) == category)
+    top['members'] = {park_id: score for score, park_id in heapq.nlargest(TOP_N, candidates)}
+    _compact(top)
+
+def _forget(park_id):
+    """Removes a product from the ranking entirely (e.g. it was deleted)."""
+    _state['buckets'].pop(park_id, None)
+    _state['scores'].pop(park_id, None)
+    category = _state['category'].pop(park_id, None)
+    for key in (category, ALL_CATEGORIES):
+        if key is not None and park_id in _top_for(key)['members']:
+            del _top_for(key)['members'][park_id]
+            _refill(key)
+
+def _file_under(park_id, category):
+    """Offers a product to its category heap, leaving its old category if it changed."""
+    previous_category = _state['category'].get(park_id)
+    _state['category'][park_id] = category
+    if previous_category is not None and previous_category != category:
+        if park_id in _top_for(previous_category)['members']:
+            del _top_for(previous_category)['members'][park_id]
+            _refill(previous_category)
+    _offer(category, park_id, _state['scores'][park_id])
+
+def record_event(park, kind, timestamp=None):
+    """Counts a 'view' or 'inquiry' for a product and updates its rankings."""
+    park_id = park.get('id')
+    if not park_id:
+        return
+    now = time.time() if timestamp is None else timestamp
+    if (now - _state['epoch']) / HALF_LIFE_SECONDS > _MAX_EXPONENT:
+        _renormalize(now)
+
+    bucket = int(now // BUCKET_SECONDS)
+    counters = _state['buckets'].setdefault(park_id, deque())
+    if not counters or counters[-1][0] != bucket:
+        counters.append([bucket, 0, 0])
+    while counters[0][0] <= bucket - WINDOW_BUCKETS:
+        counters.popleft()
+    if kind == 'inquiry':
+        counters[-1][2] += 1
+        points = catalog_index.INQUIRY_WEIGHT
+    else:
+        counters[-1][1] += 1
+        points = 1
+
+    # Weights are taken at the bucket start, so a score is reproducible from
+    # its counters. Buckets that age out of the window are not subtracted:
+    # after WINDOW_BUCKETS hours their weight has halved twelve times over.
+    score = _state['scores'].get(park_id, 0.0) + points * _weight(bucket * BUCKET_SECONDS)
+    _state['scores'][park_id] = score
+
+    _file_under(park_id, catalog_index.normalize_key(park.get('type')))
+    _offer(ALL_CATEGORIES, park_id, score)
+
+def _on_catalog_change(event, park):
+    """data_manager listener feeding view/inquiry events into the ranking."""
+    park_id = park.get('id')
+    if event in ('view', 'inquiry'):
+        record_event(park, event)
+    elif event == 'delete':
+        _forget(park_id)
+    elif event == 'update' and park_id in _state['category']:
+        _file_under(park_id, catalog_index.normalize_key(park.get('type')))
+
+data_manager.add_listener(_on_catalog_change)
+
+def reload(now=None):
+    """Rebuilds the ranking from the shared analytics rollups of the last WINDOW_BUCKETS hours."""
+    now = time.time() if now is None else now
+    start = (int(now // BUCKET_SECONDS) - WINDOW_BUCKETS + 1) * BUCKET_SECONDS
+    state = {'loaded': True, 'epoch': now, 'buckets': {}, 'scores': {}, 'category': {}, 'top': {}}
+    candidates = defaultdict(list)
+    for (park_id, bucket_start), (views, inquiries) in sorted(analytics.rollups_since('hour', 'product', start).items()):
+        park = catalog_index.get_park(park_id)
+        if park is None:
+            continue # Deleted since
+        bucket = bucket_start // BUCKET_SECONDS
+        state['buckets'].setdefault(park_id, deque()).append([bucket, views, inquiries])
+        points = views + inquiries * catalog_index.INQUIRY_WEIGHT
+        weight = 2 ** ((bucket * BUCKET_SECONDS - now) / HALF_LIFE_SECONDS)
+        state['scores'][park_id] = state['scores'].get(park_id, 0.0) + points * weight
+        state['category'][park_id] = catalog_index.normalize_key(park.get('type'))
+    for park_id, score in state['scores'].items():
+        candidates[state['category'][park_id]].append((score, park_id))
+        candidates[ALL_CATEGORIES].append((score, park_id))
+    for category, scored in candidates.items():
+        top = state['top'][category] = {'heap': [], 'members': {}}
+        top['members'] = {park_id: score for score, park_id in heapq.nlargest(TOP_N, scored)}
+        _compact(top)
+    _state.update(state)
+
+def run_refresher(sleep):
+    """Background task reloading the ranking every TRENDING_REFRESH_SECONDS."""
+    while True:
+        sleep(TRENDING_REFRESH_SECONDS) # The first use loads it; no need to compete with warm-up
+        try:
+            reload()
+        except Exception as e:
+            print(f"ERROR: could not reload trending products: {e}")
+
+def get_trending(category=None, limit=20, now=None):
+    """Returns up to `limit` (product_id, decayed_score) pairs, hottest first."""
+    if not _state['loaded']:
+        reload()
+    key = catalog_index.normalize_key(category) if category else ALL_CATEGORIES
+    members = _state['top'].get(key, {}).get('members', {})
+    decay = _weight(time.time() if now is None else now)
+    ranked = heapq.nlargest(min(limit, TOP_N), members.items(), key=lambda item: item[1])
+    return [(park_id, score / decay) for park_id, score in ranked]
+
+def recent_counts(park_id, hours=24, now=None):
+    """Returns (views, inquiries) for a product over the last `hours` hours."""
+    if not _state['loaded']:
+        reload()
+    current_bucket = int((time.time() if now is None else now) // BUCKET_SECONDS)
+    views = inquiries = 0
+    for bucket, bucket_views, bucket_inquiries in _state['buckets'].get(park_id, ()):
+        if bucket > current_bucket - hours:
+            views += bucket_views
+            inquiries += bucket_inquiries
+    return views, inquiries